@@ -59,23 +59,30 @@ def get_user_input():
 
 
 def main(args):
+    streaming = None
+    if args.streaming_window is not None:
+        from gpt_oss.torch.streaming import StreamingConfig
+        streaming = StreamingConfig(num_sink_tokens=args.sink_tokens, window=args.streaming_window)
     match args.backend:
         case "triton":
             from gpt_oss.triton.model import TokenGenerator as TritonGenerator
             from gpt_oss.torch.utils import init_distributed
             device = init_distributed()
-            generator = TritonGenerator(args.checkpoint, args.context, device)
+            generator = TritonGenerator(args.checkpoint, args.context, device, streaming=streaming)
         case "torch":
             from gpt_oss.torch.model import TokenGenerator as TorchGenerator
             from gpt_oss.torch.utils import init_distributed
             device = init_distributed()
-            generator = TorchGenerator(args.checkpoint, device)
+            generator = TorchGenerator(args.checkpoint, device, context=args.context, streaming=streaming)
         case "vllm":
             from gpt_oss.vllm.token_generator import TokenGenerator as VLLMGenerator
             generator = VLLMGenerator(args.checkpoint, tensor_parallel_size=2)
         case _:
             raise ValueError(f"Invalid backend: {args.backend}")
 
+    # Keep the KV state of the conversation between turns, so that only new messages are prefilled
+    session = generator.session() if hasattr(generator, "session") else generator
+
     encoding = load_harmony_encoding(HarmonyEncodingName.HARMONY_GPT_OSS)
 
     system_message_content = (
@@ -245,7 +252,7 @@ def main(args):
         field_created = False
         current_output_text = ""
         output_text_delta_buffer = ""
-        for predicted_token in generator.generate(tokens, encoding.stop_tokens_for_assistant_actions()):
+        for predicted_token in session.generate(tokens, encoding.stop_tokens_for_assistant_actions()):
             parser.process(predicted_token)
             if args.raw:
                 print(encoding.decode([predicted_token]), end="", flush=True)
@@ -341,6 +348,19 @@ if __name__ == "__main__":
         default=8192,
         help="Max context length",
     )
+    parser.add_argument(
+        "--streaming-window",
+        metavar="N",
+        type=int,
+        default=None,
+        help="Bound the KV cache of long sessions to the attention sinks and the last N tokens",
+    )
+    parser.add_argument(
+        "--sink-tokens",
+        type=int,
+        default=4,
+        help="Number of initial tokens kept in the KV cache with --streaming-window",
+    )
     parser.add_argument(
         "--raw",
         default=False,
@@ -4,37 +4,109 @@
 # torchrun --nproc-per-node=4 -m gpt_oss.generate -p "why did the chicken cross the road?" model/
 
 import argparse
+from contextlib import nullcontext
 
 from gpt_oss.tokenizer import get_tokenizer
 
 
 def main(args):
+    streaming = None
+    if args.streaming_window is not None:
+        from gpt_oss.torch.streaming import StreamingConfig
+        streaming = StreamingConfig(num_sink_tokens=args.sink_tokens, window=args.streaming_window)
     match args.backend:
+        case "torch" if args.prefill_workers > 0:
+            import torch
+            from gpt_oss.torch.disaggregation import DisaggregatedGenerator
+            generator = DisaggregatedGenerator(
+                args.checkpoint,
+                device="cuda" if torch.cuda.is_available() else "cpu",
+                context=args.context_length,
+                num_prefill_workers=args.prefill_workers,
+                num_decode_workers=args.decode_workers,
+            )
         case "torch":
             from gpt_oss.torch.utils import init_distributed
             from gpt_oss.torch.model import TokenGenerator as TorchGenerator
             device = init_distributed()
-            generator = TorchGenerator(args.checkpoint, device=device)
+            expert_cache_bytes = None if args.expert_cache_gb is None else int(args.expert_cache_gb * 2**30)
+            generator = TorchGenerator(
+                args.checkpoint,
+                device=device,
+                context=args.context_length,
+                expert_cache_bytes=expert_cache_bytes,
+                router_telemetry=args.router_stats is not None,
+                streaming=streaming,
+            )
         case "triton":
             from gpt_oss.torch.utils import init_distributed
             from gpt_oss.triton.model import TokenGenerator as TritonGenerator
             device = init_distributed()
-            generator = TritonGenerator(args.checkpoint, context=args.context_length, device=device)
+            generator = TritonGenerator(
+                args.checkpoint,
+                context=args.context_length,
+                device=device,
+                router_telemetry=args.router_stats is not None,
+                streaming=streaming,
+            )
         case "vllm":
             from gpt_oss.vllm.token_generator import TokenGenerator as VLLMGenerator
             generator = VLLMGenerator(args.checkpoint, tensor_parallel_size=args.tensor_parallel_size)
         case _:
             raise ValueError(f"Invalid backend: {args.backend}")
 
+    try:
+        run(args, generator)
+    finally:
+        # Shuts down the worker processes
+        if args.prefill_workers > 0:
+            generator.close()
+
+
+def run(args, generator):
     tokenizer = get_tokenizer()
     tokens = tokenizer.encode(args.prompt)
+    if args.load_kv is not None:
+        num_restored = len(generator.load_kv_snapshot(args.load_kv))
+        print(f"Restored the KV state of {num_restored} tokens from {args.load_kv}")
+    if args.save_kv is not None:
+        generator.save_kv_snapshot(args.save_kv, tokens)
     max_tokens = None if args.limit == 0 else args.limit
-    for token, logprob in generator.generate(tokens, stop_tokens=[tokenizer.eot_token], temperature=args.temperature, max_tokens=max_tokens, return_logprobs=True):
-        tokens.append(token)
-        token_text = tokenizer.decode([token])
-        print(
-            f"Generated token: {repr(token_text)}, logprob: {logprob}"
+    generate_kwargs = {}
+    if args.experts_per_token is not None:
+        from gpt_oss.torch.fast_mode import parse_experts_per_token
+        generate_kwargs["experts_per_token"] = parse_experts_per_token(args.experts_per_token)
+    profiler = None
+    if args.profile is not None:
+        from gpt_oss.torch.profiling import Profiler
+        profiler = Profiler()
+    with profiler or nullcontext():
+        for token, logprob in generator.generate(tokens, stop_tokens=[tokenizer.eot_token], temperature=args.temperature, max_tokens=max_tokens, return_logprobs=True, **generate_kwargs):
+            tokens.append(token)
+            token_text = tokenizer.decode([token])
+            print(
+                f"Generated token: {repr(token_text)}, logprob: {logprob}"
+            )
+
+    if profiler is not None:
+        print(profiler.summary_table())
+        profiler.to_chrome_trace(args.profile)
+
+    if args.router_stats is not None:
+        generator.router_telemetry.to_json(args.router_stats)
+
+    if args.memory_report:
+        from gpt_oss.torch.memory import estimate_memory, format_bytes
+        streaming = getattr(generator, "streaming", None)
+        estimate = estimate_memory(
+            generator.model.config,
+            backend=args.backend,
+            context=args.context_length,
+            expert_cache_bytes=None if args.expert_cache_gb is None else int(args.expert_cache_gb * 2**30),
+            streaming_capacity=None if streaming is None else streaming.capacity,
         )
+        print(f"Estimated: {format_bytes(estimate['total'])}")
+        print(generator.memory.report())
 
 
 if __name__ == "__main__":
@@ -88,8 +160,99 @@ if __name__ == "__main__":
         "--context-length",
         type=int,
         default=4096,
-        help="Context length for Triton backend",
+        help="Context length for the torch and Triton backends",
+    )
+    parser.add_argument(
+        "--prefill-workers",
+        type=int,
+        default=0,
+        help="Run the prompt in this many separate processes and hand its KV state to decode processes (torch backend)",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=1,
+        help="Number of decode processes when --prefill-workers is set (torch backend)",
+    )
+    parser.add_argument(
+        "--streaming-window",
+        metavar="N",
+        type=int,
+        default=None,
+        help="Streaming mode: keep only the attention sinks and the last N tokens in the KV cache (torch and triton backends)",
+    )
+    parser.add_argument(
+        "--sink-tokens",
+        type=int,
+        default=4,
+        help="Number of initial tokens kept in the KV cache in streaming mode",
+    )
+    parser.add_argument(
+        "--expert-cache-gb",
+        type=float,
+        default=None,
+        help="Keep only this many GiB of MoE experts resident and load the others on demand (torch backend)",
+    )
+    parser.add_argument(
+        "--router-stats",
+        metavar="FILE",
+        type=str,
+        default=None,
+        help="Record per-layer expert routing statistics and write them to a JSON file (torch and triton backends)",
+    )
+    parser.add_argument(
+        "-k",
+        "--experts-per-token",
+        metavar="K",
+        type=str,
+        default=None,
+        help="Fast mode: experts per token, either one value or a comma-separated value per layer (torch and triton backends)",
+    )
+    parser.add_argument(
+        "--save-kv",
+        metavar="FILE",
+        type=str,
+        default=None,
+        help="Write the KV state of the prompt to a snapshot file (torch and triton backends)",
+    )
+    parser.add_argument(
+        "--load-kv",
+        metavar="FILE",
+        type=str,
+        default=None,
+        help="Restore a KV snapshot so that a prompt sharing its prefix skips that part of the prefill (torch and triton backends)",
+    )
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="Print the peak memory of the load, prefill and decode phases next to the estimate (torch and triton backends)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        type=str,
+        nargs="?",
+        const="gpt_oss_trace.json",
+        default=None,
+        help="Time the named model regions, print a per-op and per-layer summary and write a Chrome trace (torch and triton backends)",
     )
     args = parser.parse_args()
+    if args.prefill_workers > 0:
+        # DisaggregatedGenerator only generates, with the full model in every worker
+        unsupported = {
+            f"--backend {args.backend}": args.backend != "torch",
+            "--streaming-window": args.streaming_window is not None,
+            "--expert-cache-gb": args.expert_cache_gb is not None,
+            "--router-stats": args.router_stats is not None,
+            "--experts-per-token": args.experts_per_token is not None,
+            "--save-kv": args.save_kv is not None,
+            "--load-kv": args.load_kv is not None,
+            "--memory-report": args.memory_report,
+            # The regions run in the worker processes
+            "--profile": args.profile is not None,
+        }
+        for flag, used in unsupported.items():
+            if used:
+                parser.error(f"{flag} is not supported with --prefill-workers")
 
     main(args)
@@ -1,9 +1,10 @@
+import asyncio
 import os
 import datetime
 import uuid
 from typing import Callable, Literal, Optional, Union
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
@@ -25,6 +26,7 @@ from gpt_oss.tools.python_docker.docker_tool import PythonTool
 from gpt_oss.tools.simple_browser import SimpleBrowserTool
 from gpt_oss.tools.simple_browser.backend import YouComBackend, ExaBackend
 
+from .batching import BatchScheduler, as_batched_backend
 from .events import (
     ResponseCodeInterpreterCallCodeDelta,
     ResponseCodeInterpreterCallCodeDone,
@@ -59,7 +61,11 @@ from .types import (
     ReasoningTextContentItem,
     ResponseObject,
     ResponsesRequest,
+    ScoredToken,
+    ScoreRequest,
+    ScoreResponse,
     TextContentItem,
+    TopLogprob,
     UrlCitation,
     Usage,
     WebSearchActionFind,
@@ -67,6 +73,7 @@ from .types import (
     WebSearchActionSearch,
     WebSearchCallItem,
 )
+from .worker import InferenceWorker
 
 DEFAULT_TEMPERATURE = 0.0
 
@@ -98,9 +105,19 @@ def is_not_builtin_tool(
 
 
 def create_api_server(
-    infer_next_token: Callable[[list[int], float], int], encoding: HarmonyEncoding
+    # infer_next_token(tokens, temperature, new_request), or a BatchedBackend, see .batching
+    infer_next_token: Callable[[list[int], float], int],
+    encoding: HarmonyEncoding,
+    score: Optional[Callable[[list[int], list[int], int], list]] = None,
+    worker: Optional[InferenceWorker] = None,
 ) -> FastAPI:
+    # score(prompt_tokens, continuation_tokens, top_n) returns a gpt_oss.torch.scoring.TokenScore per continuation token
     app = FastAPI()
+    # All calls into the backend run on the worker thread, never on the event loop
+    if worker is None:
+        worker = InferenceWorker()
+    # Responses generated at the same time share the steps of the backend
+    scheduler = BatchScheduler(as_batched_backend(infer_next_token), worker)
 
     @app.exception_handler(RequestValidationError)
     async def log_validation_error(request: Request, exc: RequestValidationError):
@@ -426,6 +443,8 @@ def create_api_server(
             self.sequence_number = 0
             self.function_call_ids: list[tuple[str, str]] = []
             self.response_id = response_id
+            # Identifies the sequence in the batched steps of the scheduler
+            self.sequence_id = response_id or f"seq_{uuid.uuid4().hex}"
             self.store_callback = store_callback
             self.new_request = True
             self.browser_tool = browser_tool
@@ -490,7 +509,7 @@ def create_api_server(
             else:
                 return event
 
-        async def run(self):
+        async def _run(self):
             browser_tool = self.browser_tool
             self.new_request = True
             initial_response = generate_response(
@@ -540,10 +559,12 @@ def create_api_server(
                 if self.request is not None and await self.request.is_disconnected():
                     print("Client disconnected, stopping token generation.")
                     break
-                next_tok = infer_next_token(
+                next_tok = await scheduler.next_token(
+                    self.sequence_id,
                     self.tokens,
                     temperature=self.temperature,
                     new_request=self.new_request,
+                    experts_per_token=self.request_body.experts_per_token,
                 )
                 self.new_request = False
                 self.tokens.append(next_tok)
@@ -923,8 +944,10 @@ def create_api_server(
                             )
                             result = await run_tool()
 
-                            new_tokens = encoding.render_conversation_for_completion(
-                                Conversation.from_messages(result), Role.ASSISTANT
+                            new_tokens = await asyncio.to_thread(
+                                encoding.render_conversation_for_completion,
+                                Conversation.from_messages(result),
+                                Role.ASSISTANT,
                             )
 
                             print(encoding.decode_utf8(new_tokens))
@@ -1054,8 +1077,10 @@ def create_api_server(
 
                             self.python_call_outputs[code_call_id] = code_outputs
 
-                            new_tokens = encoding.render_conversation_for_completion(
-                                Conversation.from_messages(result), Role.ASSISTANT
+                            new_tokens = await asyncio.to_thread(
+                                encoding.render_conversation_for_completion,
+                                Conversation.from_messages(result),
+                                Role.ASSISTANT,
                             )
 
                             print(encoding.decode_utf8(new_tokens))
@@ -1132,6 +1157,15 @@ def create_api_server(
                     )
                 )
 
+        async def run(self):
+            try:
+                async for event in self._run():
+                    yield event
+            finally:
+                # Backends that keep the KV state of several conversations can hand this one's to other requests.
+                # Queued without waiting, so that it also happens when the client disconnected mid-stream
+                scheduler.release(self.sequence_id)
+
     @app.post("/v1/responses", response_model=ResponseObject)
     async def generate(body: ResponsesRequest, request: Request):
         print("request received")
@@ -1319,8 +1353,9 @@ def create_api_server(
 
         conversation = Conversation.from_messages(messages)
 
-        initial_tokens = encoding.render_conversation_for_completion(
-            conversation, Role.ASSISTANT
+        # Rendering long conversations takes a while, keep the event loop responsive
+        initial_tokens = await asyncio.to_thread(
+            encoding.render_conversation_for_completion, conversation, Role.ASSISTANT
         )
         print(encoding.decode_utf8(initial_tokens))
         response_id = f"resp_{uuid.uuid4().hex}"
@@ -1349,4 +1384,49 @@ def create_api_server(
 
             return last_event.response
 
+    @app.post("/v1/score", response_model=ScoreResponse)
+    async def score_continuation(body: ScoreRequest):
+        if score is None:
+            raise HTTPException(status_code=501, detail="The inference backend does not support scoring")
+
+        def _tokens(value: Union[str, list[int]]) -> list[int]:
+            if isinstance(value, str):
+                return encoding.encode(value, allowed_special="all")
+            return value
+
+        prompt_tokens = _tokens(body.prompt)
+        continuation_tokens = _tokens(body.continuation)
+        if not prompt_tokens or not continuation_tokens:
+            raise HTTPException(status_code=400, detail="prompt and continuation must not be empty")
+
+        # Runs on the inference worker like infer_next_token, so it never runs concurrently with generation
+        scores = await worker.run(score, prompt_tokens, continuation_tokens, body.top_logprobs or 0)
+        tokens = [
+            ScoredToken(
+                token=token_score.token,
+                text=encoding.decode([token_score.token]),
+                logprob=token_score.logprob,
+                top_logprobs=[
+                    TopLogprob(token=token, text=encoding.decode([token]), logprob=logprob)
+                    for token, logprob in token_score.top
+                ],
+            )
+            for token_score in scores
+        ]
+        return ScoreResponse(
+            model=body.model,
+            prompt_tokens=len(prompt_tokens),
+            tokens=tokens,
+            total_logprob=sum(token.logprob for token in tokens),
+        )
+
+    @app.get("/health")
+    async def health():
+        # Answered on the event loop, also while the worker is busy generating
+        return {
+            "status": "ok",
+            "pending_inference_calls": worker.pending,
+            "waiting_sequences": len(scheduler.waiting),
+        }
+
     return app
@@ -0,0 +1,202 @@
+"""Continuous batching of the responses the server is generating.
+
+A `BatchedBackend` advances many sequences per step: `step` takes the
+sequences that need their next token, keyed by an id that stays the same for
+the lifetime of a response, and returns the next token of each. Every step
+passes the whole sequence, so backends keep the tokens they already processed
+(e.g. in a KV cache slot per id) and only feed the new ones: the last
+generated token, or a tool output appended by the server. `release` is
+called once the response is done. A backend that cannot advance one of the
+sequences returns an exception in its place, which fails that response only.
+Backends that hold the state of a bounded number of sequences (e.g. one KV
+cache slot each) set `max_num_sequences`: further responses wait until one of
+the sequences is released, instead of taking over its state.
+
+`BatchScheduler` collects the sequences of all active responses into shared
+steps, run on the `InferenceWorker`. Responses join and leave between any two
+steps: a response that got its token submits the next one while the step of
+the others is still running, and is part of the following step.
+
+Backends that only implement the original contract,
+`infer_next_token(tokens, temperature, new_request) -> int`, are run one
+sequence per step by `SequentialBackend`. Others expose their batched
+backend as `infer_next_token.batched`:
+
+    scheduler = BatchScheduler(as_batched_backend(infer_next_token), InferenceWorker())
+    next_token = await scheduler.next_token(response_id, tokens, temperature=0.0)
+"""
+
+import asyncio
+import itertools
+from dataclasses import dataclass
+from typing import Callable, Optional, Protocol
+
+from .worker import InferenceWorker
+
+
+@dataclass
+class SequenceStep:
+    tokens: list[int]
+    temperature: float = 0.0
+    # First step of the response, or tokens the backend did not generate were appended since the last one
+    new_request: bool = False
+    # Reduced-expert fast mode of the response, one value or one per layer, see gpt_oss.torch.fast_mode
+    experts_per_token: Optional[int | list[int]] = None
+
+
+class BatchedBackend(Protocol):
+    # Most sequences per step, e.g. the number of KV cache slots
+    max_batch_size: int
+
+    def step(self, sequences: dict[str, SequenceStep]) -> dict[str, int | Exception]:
+        ...
+
+    def release(self, sequence_id: str):
+        ...
+
+
+@dataclass
+class FunctionBackend:
+    """A `BatchedBackend` made of functions, for backends written as closures over their state."""
+
+    step: Callable[[dict[str, SequenceStep]], dict[str, int | Exception]]
+    release: Callable[[str], None] = lambda sequence_id: None
+    max_batch_size: int = 1
+    # Most sequences between their first step and their release, None for no limit
+    max_num_sequences: Optional[int] = None
+
+
+class SequentialBackend:
+    """Runs a one-sequence `infer_next_token` behind the batched protocol."""
+
+    # One sequence per step, so that concurrent responses take turns token by token
+    max_batch_size = 1
+
+    def __init__(self, infer_next_token: Callable[..., int]):
+        self.infer_next_token = infer_next_token
+        self.tokens: dict[str, list[int]] = {}
+
+    def step(self, sequences: dict[str, SequenceStep]) -> dict[str, int]:
+        next_tokens = {}
+        for sequence_id, sequence in sequences.items():
+            # Only passed when set, so that backends without a fast mode keep working
+            kwargs = {} if sequence.experts_per_token is None else {"experts_per_token": sequence.experts_per_token}
+            next_tokens[sequence_id] = self.infer_next_token(
+                sequence.tokens, temperature=sequence.temperature, new_request=sequence.new_request, **kwargs
+            )
+            self.tokens[sequence_id] = sequence.tokens
+        return next_tokens
+
+    def release(self, sequence_id: str):
+        tokens = self.tokens.pop(sequence_id, None)
+        # Backends that keep the KV state of several conversations find it by its tokens
+        release = getattr(self.infer_next_token, "release", None)
+        if tokens is not None and release is not None:
+            release(tokens)
+
+
+def as_batched_backend(infer_next_token) -> BatchedBackend:
+    """The batched backend of what a `setup_model` returned."""
+    if hasattr(infer_next_token, "step"):
+        return infer_next_token
+    batched = getattr(infer_next_token, "batched", None)
+    return batched if batched is not None else SequentialBackend(infer_next_token)
+
+
+class BatchScheduler:
+    def __init__(self, backend: BatchedBackend, worker: InferenceWorker):
+        self.backend = backend
+        self.worker = worker
+        # Sequences waiting for the next step, in order of arrival
+        self.waiting: dict[str, tuple[SequenceStep, asyncio.Future]] = {}
+        # Sequences that took part in a step and were not released yet, see max_num_sequences
+        self.admitted: set[str] = set()
+        self.num_steps = 0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.loop_task: Optional[asyncio.Task] = None
+
+    def _ensure_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop_task is None or self.loop_task.done() or self.loop_task.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.loop_task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self.waiting:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            # Let the responses that just got a token submit their next one
+            await asyncio.sleep(0)
+            batch = self._next_batch()
+            if not batch:
+                # Only sequences that wait for a release
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            for sequence_id in batch:
+                del self.waiting[sequence_id]
+            try:
+                next_tokens = await self.worker.run(
+                    self.backend.step, {sequence_id: step for sequence_id, (step, _) in batch.items()}
+                )
+            except Exception as e:
+                # Fail the sequences of this step rather than leaving their responses hanging
+                for _, future in batch.values():
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.num_steps += 1
+            for sequence_id, (_, future) in batch.items():
+                # Responses whose client went away cancelled their future
+                if future.done():
+                    continue
+                next_token = next_tokens[sequence_id]
+                if isinstance(next_token, Exception):
+                    future.set_exception(next_token)
+                else:
+                    future.set_result(next_token)
+
+    def _next_batch(self) -> dict[str, tuple[SequenceStep, asyncio.Future]]:
+        max_num_sequences = getattr(self.backend, "max_num_sequences", None)
+        if max_num_sequences is None:
+            return dict(itertools.islice(self.waiting.items(), self.backend.max_batch_size))
+        batch = {}
+        for sequence_id, entry in self.waiting.items():
+            if len(batch) == self.backend.max_batch_size:
+                break
+            if sequence_id not in self.admitted:
+                if len(self.admitted) == max_num_sequences:
+                    continue
+                self.admitted.add(sequence_id)
+            batch[sequence_id] = entry
+        return batch
+
+    async def next_token(
+        self,
+        sequence_id: str,
+        tokens: list[int],
+        temperature: float = 0.0,
+        new_request: bool = False,
+        experts_per_token: Optional[int | list[int]] = None,
+    ) -> int:
+        """The next token of a sequence, computed in one step with all other waiting sequences."""
+        assert sequence_id not in self.waiting, f"Sequence {sequence_id} is already waiting for a token"
+        self._ensure_loop()
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[sequence_id] = (SequenceStep(list(tokens), temperature, new_request, experts_per_token), future)
+        self.wakeup.set()
+        return await future
+
+    def release(self, sequence_id: str):
+        """The response is done, also if it was aborted: the backend can free the state of the sequence."""
+        entry = self.waiting.pop(sequence_id, None)
+        if entry is not None:
+            entry[1].cancel()
+        if sequence_id in self.admitted:
+            self.admitted.remove(sequence_id)
+            # Sequences waiting for a free place can take this one
+            self.wakeup.set()
+        # Queued behind the step the sequence may still be part of
+        self.worker.submit(self.backend.release, sequence_id)
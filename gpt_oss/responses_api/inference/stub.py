@@ -1,6 +1,8 @@
 import time
 from typing import Callable
 
+from ..batching import SequenceStep
+
 fake_tokens = [
     200005,
     35644,
@@ -138,5 +140,48 @@ def stub_infer_next_token(
     return next_tok
 
 
+def stub_score(prompt_tokens: list[int], continuation_tokens: list[int], top_n: int = 0):
+    from gpt_oss.torch.scoring import TokenScore
+
+    # Every continuation token gets the same logprob, the alternatives are the following token ids
+    return [
+        TokenScore(token, -1.0, [(token + i, -1.0 - i) for i in range(top_n)])
+        for token in continuation_tokens
+    ]
+
+
+class StubBackend:
+    """Batched stub: every sequence replays the fake tokens, and a step takes `step_time` however many sequences it has.
+
+    Lets the batch scheduler of the server be load-tested without a GPU.
+    """
+
+    def __init__(self, step_time: float = 0.1, max_batch_size: int = 64):
+        self.step_time = step_time
+        self.max_batch_size = max_batch_size
+        # Position of every sequence in the fake tokens
+        self.positions: dict[str, int] = {}
+        self.num_steps = 0
+        self.batch_sizes: list[int] = []
+
+    def step(self, sequences: dict[str, SequenceStep]) -> dict[str, int]:
+        time.sleep(self.step_time)
+        self.num_steps += 1
+        self.batch_sizes.append(len(sequences))
+        next_tokens = {}
+        for sequence_id in sequences:
+            position = self.positions.get(sequence_id, 0)
+            next_tokens[sequence_id] = fake_tokens[position % len(fake_tokens)]
+            self.positions[sequence_id] = position + 1
+        return next_tokens
+
+    def release(self, sequence_id: str):
+        self.positions.pop(sequence_id, None)
+
+
+stub_infer_next_token.score = stub_score
+stub_infer_next_token.batched = StubBackend()
+
+
 def setup_model(_checkpoint: str) -> Callable[[list[int], float], int]:
     return stub_infer_next_token
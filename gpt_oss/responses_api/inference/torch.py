@@ -0,0 +1,141 @@
+"""Responses API backend on the torch reference model.
+
+All active responses are decoded together: every response keeps its KV
+entries in a shared paged cache (see `gpt_oss.torch.engine.TorchModelRunner`)
+until it is released, and a step feeds each sequence the tokens it is
+missing, one token for a response that is generating and the rest of the
+prompt or a tool output otherwise. The forward passes of a step are planned
+by `Engine.run_pending`, so long prompts are prefilled in chunks within the
+token budget, and a sequence that does not fit preempts the others or the
+idle responses and is recomputed. Only a sequence that does not fit into the
+empty cache fails. Sequences asking for different numbers of experts per
+token (see `gpt_oss.torch.fast_mode`) are run one setting after the other.
+"""
+
+import itertools
+import os
+from typing import Callable
+
+import torch
+
+from gpt_oss.responses_api.batching import FunctionBackend, SequenceStep
+from gpt_oss.torch.engine import Engine, Sequence, TorchModelRunner, sample_tokens
+from gpt_oss.torch.fast_mode import expand_experts_per_token, experts_per_token_override
+from gpt_oss.torch.kv_snapshot import common_prefix_length
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.scoring import score_logits, scoring_inputs
+
+DEFAULT_TEMPERATURE = 0.0
+# KV blocks of 16 tokens shared by all active responses
+NUM_KV_BLOCKS = int(os.environ.get("GPT_OSS_KV_BLOCKS", 4096))
+MAX_BATCH_SIZE = 16
+
+
+def load_model(checkpoint: str) -> Transformer:
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"loading model on {device}...")
+    return Transformer.from_checkpoint(checkpoint, device=device)
+
+
+def get_infer_next_token(model: Transformer, num_blocks: int = NUM_KV_BLOCKS):
+    runner = TorchModelRunner(model, num_blocks=num_blocks)
+    engine = Engine(runner, max_num_seqs=MAX_BATCH_SIZE)
+    # Sequence id -> tokens of the sequence, the first num_computed of which are in the KV cache
+    sequences: dict[str, Sequence] = {}
+
+    @torch.inference_mode()
+    def step(batch: dict[str, SequenceStep]) -> dict[str, int | Exception]:
+        for sequence_id, sequence in batch.items():
+            seq = sequences.get(sequence_id)
+            if seq is None:
+                seq = sequences[sequence_id] = engine.new_sequence(sequence.tokens)
+            # Keep at least one token to compute the logits of the next one
+            num_cached = min(
+                common_prefix_length(seq.tokens[: seq.num_computed], sequence.tokens), len(sequence.tokens) - 1
+            )
+            runner.kv_cache.truncate(seq.handle, num_cached)
+            seq.tokens, seq.num_computed = list(sequence.tokens), num_cached
+
+        # The model holds one experts-per-token setting at a time
+        results: dict[str, torch.Tensor | Exception] = {}
+        settings: dict[tuple[int, ...], list[str]] = {}
+        for sequence_id, sequence in batch.items():
+            try:
+                setting = tuple(expand_experts_per_token(model, sequence.experts_per_token))
+            except AssertionError as e:
+                results[sequence_id] = ValueError(str(e))
+                continue
+            settings.setdefault(setting, []).append(sequence_id)
+        for setting, sequence_ids in settings.items():
+            idle = [seq for sequence_id, seq in sequences.items() if sequence_id not in sequence_ids]
+            with experts_per_token_override(model, list(setting)):
+                results.update(
+                    zip(sequence_ids, engine.run_pending([sequences[sequence_id] for sequence_id in sequence_ids], idle))
+                )
+        ready = [sequence_id for sequence_id, result in results.items() if isinstance(result, torch.Tensor)]
+        next_tokens: dict[str, int | Exception] = {}
+        if ready:
+            tokens, _ = sample_tokens(
+                torch.stack([results[sequence_id] for sequence_id in ready]),
+                [batch[sequence_id].temperature for sequence_id in ready],
+            )
+            next_tokens.update(zip(ready, tokens))
+        for sequence_id, result in results.items():
+            if sequence_id not in next_tokens:
+                next_tokens[sequence_id] = result
+                release(sequence_id)
+        return next_tokens
+
+    def release(sequence_id: str):
+        seq = sequences.pop(sequence_id, None)
+        if seq is not None:
+            runner.free(seq.handle)
+
+    # One-sequence contract: conversations are told apart by their tokens
+    conversation_ids = (f"conversation-{i}" for i in itertools.count())
+
+    def find_conversation(tokens: list[int]) -> str | None:
+        """The sequence continuing the conversation `tokens`, if any."""
+        candidates = [
+            sequence_id
+            for sequence_id, seq in sequences.items()
+            if sequence_id.startswith("conversation-") and tokens[: len(seq.tokens)] == seq.tokens
+        ]
+        return max(candidates, key=lambda sequence_id: len(sequences[sequence_id].tokens), default=None)
+
+    def infer_next_token(
+        tokens: list[int],
+        temperature: float = DEFAULT_TEMPERATURE,
+        new_request: bool = False,
+        experts_per_token: int | list[int] | None = None,
+    ) -> int:
+        sequence_id = find_conversation(tokens) or next(conversation_ids)
+        next_token = step({sequence_id: SequenceStep(tokens, temperature, new_request, experts_per_token)})[sequence_id]
+        if isinstance(next_token, Exception):
+            raise next_token
+        return next_token
+
+    def release_conversation(tokens: list[int]):
+        """Called when a response is done: the KV entries of the conversation are freed."""
+        sequence_id = find_conversation(tokens)
+        if sequence_id is not None:
+            release(sequence_id)
+
+    @torch.inference_mode()
+    def score(prompt_tokens: list[int], continuation_tokens: list[int], top_n: int = 0):
+        tokens, first = scoring_inputs(prompt_tokens, continuation_tokens)
+        logits = model(
+            torch.as_tensor(tokens, dtype=torch.int32, device=runner.device),
+            logits_indices=torch.arange(first, len(tokens), device=runner.device),
+        )
+        return score_logits(logits, continuation_tokens, top_n)
+
+    infer_next_token.score = score
+    infer_next_token.release = release_conversation
+    infer_next_token.batched = FunctionBackend(step, release, max_batch_size=MAX_BATCH_SIZE)
+    return infer_next_token
+
+
+def setup_model(checkpoint: str) -> Callable[[list[int], float], int]:
+    model = load_model(checkpoint)
+    return get_infer_next_token(model)
@@ -6,11 +6,18 @@ os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 import torch
 import torch.distributed as dist
 
-from gpt_oss.triton.model import Cache, ModelConfig, Transformer
+from gpt_oss.responses_api.batching import FunctionBackend, SequenceStep
+from gpt_oss.torch.attention_backends import decode_num_keys
+from gpt_oss.torch.fast_mode import expand_experts_per_token, experts_per_token_override, get_experts_per_token
+from gpt_oss.torch.scoring import score_logits, scoring_inputs
+from gpt_oss.torch.kv_snapshot import common_prefix_length
+from gpt_oss.triton.cache import Cache, CacheSlots, NoFreeSlotError
+from gpt_oss.triton.model import ModelConfig, Transformer
 
 DEFAULT_TEMPERATURE = 0.0
 CONTEXT = 16_384
-CONCURRENT_SESSIONS = 1
+# Conversations whose KV state is kept at the same time, decoded together in one graph replay
+CONCURRENT_SESSIONS = 4
 
 rank = int(
     os.environ.get("RANK", 0)
@@ -33,66 +40,183 @@ def load_model(checkpoint: str):
 
 def get_infer_next_token(model, device):
     caches = [
-        Cache(CONCURRENT_SESSIONS, CONTEXT, model.config.num_key_value_heads)
+        Cache(CONCURRENT_SESSIONS, CONTEXT, model.config.num_key_value_heads, device=device)
         for _ in range(len(model.block))
     ]
-    # offsets = torch.zeros(CONCURRENT_SESSIONS, dtype=torch.int32, device=device) # TBD
-    input_token = torch.zeros(
-        1, dtype=torch.int32, device=device
-    )  # add concurrent sessions support
-    tokens_so_far = []
-
-    model.prefill(torch.zeros(1, 4, dtype=torch.int32, device=device), caches)
-    graph = torch.cuda.CUDAGraph()
-    with torch.cuda.graph(graph):
-        logits = model(input_token[None, :], caches=caches)[0]
-
-    def lcp(cache: list[int], inp: list[int]) -> list[int]:
-        i = 0
-        max_len = min(len(cache), len(inp))
-        while i < max_len and cache[i] == inp[i]:
-            i += 1
-        return cache[:i]
+    # Every conversation holds one row (slot) of the caches
+    slots = CacheSlots(CONCURRENT_SESSIONS, CONTEXT)
+    # One token per slot; slots that are not decoding get a dummy token that is rolled back
+    input_tokens = torch.zeros(CONCURRENT_SESSIONS, 1, dtype=torch.int32, device=device)
+
+    # Decode graphs of all slots per experts-per-token setting and bound on the slot lengths, see attention_decode
+    graphs = {}
+
+    def get_graph(num_keys: int) -> tuple[torch.cuda.CUDAGraph, torch.Tensor]:
+        num_keys = decode_num_keys(num_keys, CONTEXT)
+        key = (tuple(get_experts_per_token(model)), num_keys)
+        if key not in graphs:
+            for cache in caches:
+                cache.num_keys = num_keys
+            try:
+                # warmup, then capture a decode step of all slots
+                model(input_tokens, caches=caches)
+                slots.sync(caches)
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    logits = model(input_tokens, caches=caches)[:, -1]
+                graphs[key] = graph, logits
+            finally:
+                slots.sync(caches)
+                for cache in caches:
+                    cache.num_keys = CONTEXT
+        return graphs[key]
+
+    get_graph(1)
 
     def sample_next_token(
         logits: torch.Tensor, temperature: float = DEFAULT_TEMPERATURE
     ) -> int:
         """Executed only on rank 0."""
         if temperature == 0.0:
-            return torch.argmax(logits[-1, :], dim=-1).item()
+            return torch.argmax(logits, dim=-1).item()
         probs = torch.softmax(logits * (1.0 / temperature), dim=-1)
-        return torch.multinomial(probs[-1, :], num_samples=1).item()
+        return torch.multinomial(probs, num_samples=1).item()
+
+    def prefill(slot: int, tokens: list[int]):
+        if tokens:
+            model(
+                torch.as_tensor(tokens, dtype=torch.int32, device=device)[None, :],
+                caches=[cache.slot(slot) for cache in caches],
+            )
+            slots.append(slot, tokens)
+
+    def decode(slot_tokens: dict[int, int]) -> torch.Tensor:
+        """Feed one token to each of the given slots in a single graph replay; returns the logits of all slots."""
+        tokens = [0] * CONCURRENT_SESSIONS
+        for slot, token in slot_tokens.items():
+            tokens[slot] = token
+        input_tokens.copy_(torch.as_tensor(tokens, dtype=torch.int32)[:, None])
+        graph, logits = get_graph(max(slots.lengths()) + 1)
+        graph.replay()
+        for slot, token in slot_tokens.items():
+            slots.append(slot, [token])
+        # Roll back the dummy tokens of the other slots
+        slots.sync(caches)
+        return logits
+
+    def prepare(tokens: list[int], slot: int | None = None) -> int:
+        """Slot of the conversation `tokens` (acquired unless given), holding all of them but the last one."""
+        # Checked before the prefill writes past the slot, which is a device-side assert on CUDA
+        assert len(tokens) <= slots.max_tokens, f"{len(tokens)} tokens do not fit in a slot of {slots.max_tokens}"
+        if slot is None:
+            slot, num_cached = slots.acquire(tokens)
+        else:
+            num_cached = common_prefix_length(slots.tokens[slot], tokens)
+        # Keep at least one token to compute the logits of the next one
+        num_cached = min(num_cached, len(tokens) - 1)
+        slots.truncate(slot, num_cached)
+        for cache in caches:
+            cache.truncate(num_cached, slot=slot)
+        prefill(slot, tokens[num_cached:-1])
+        return slot
 
     @torch.inference_mode()
     def infer_next_token(
         tokens: list[int],
         temperature: float = DEFAULT_TEMPERATURE,
         new_request: bool = False,
+        experts_per_token: int | list[int] | None = None,
     ) -> int:
-        nonlocal tokens_so_far
-        tokens_so_far = lcp(tokens_so_far, tokens)
-        for cache in caches:
-            cache.truncate(len(tokens_so_far))
-        all_tokens = tokens  # for pdb
-        tokens = tokens[len(tokens_so_far) :]
-
-        if len(tokens) > 1:
-            model.prefill(
-                torch.as_tensor(tokens[:-1], dtype=torch.int32, device=device)[None, :],
-                caches,
-            )
-
-        if len(tokens) == 0:
-            breakpoint()
-
-        input_token[-1] = tokens[-1]
-        graph.replay()
+        with experts_per_token_override(model, experts_per_token):
+            slot = prepare(tokens)
+            step_logits = decode({slot: tokens[-1]})
 
         # decide next token on rank‑0
-        next_tok = sample_next_token(logits, temperature=temperature)
+        next_tok = sample_next_token(step_logits[slot], temperature=temperature)
 
         return next_tok
 
+    def release(tokens: list[int]):
+        """Called by the server when a response is done: the slot of the conversation becomes available."""
+        slot = slots.find(tokens)
+        if slot is not None:
+            slots.release(slot)
+
+    # Slot of every sequence of the batched backend, from its first step to its release
+    sequence_slots: dict[str, int] = {}
+
+    @torch.inference_mode()
+    def step(sequences: dict[str, SequenceStep]) -> dict[str, int | Exception]:
+        """Decode the last token of every sequence, one graph replay per experts-per-token setting."""
+        assert len(sequences) <= CONCURRENT_SESSIONS
+        next_tokens: dict[str, int | Exception] = {}
+        # The model holds one setting at a time
+        settings: dict[tuple[int, ...], list[str]] = {}
+        for sequence_id, sequence in sequences.items():
+            try:
+                setting = tuple(expand_experts_per_token(model, sequence.experts_per_token))
+            except AssertionError as e:
+                next_tokens[sequence_id] = ValueError(str(e))
+                continue
+            settings.setdefault(setting, []).append(sequence_id)
+        for setting, sequence_ids in settings.items():
+            with experts_per_token_override(model, list(setting)):
+                step_slots({sequence_id: sequences[sequence_id] for sequence_id in sequence_ids}, next_tokens)
+        return next_tokens
+
+    def step_slots(sequences: dict[str, SequenceStep], next_tokens: dict[str, int | Exception]):
+        """Decode the last token of the sequences in one graph replay, after prefilling what each one is missing."""
+        for sequence_id, sequence in sequences.items():
+            if len(sequence.tokens) > slots.max_tokens:
+                next_tokens[sequence_id] = ValueError(
+                    f"{len(sequence.tokens)} tokens do not fit in a slot of {slots.max_tokens}"
+                )
+                release_sequence(sequence_id)
+            elif sequence_id in sequence_slots:
+                prepare(sequence.tokens, sequence_slots[sequence_id])
+            elif slots.num_free_slots:
+                # Not the slot of another sequence, also if it holds the same prompt
+                slot, _ = slots.acquire(sequence.tokens, new=True)
+                sequence_slots[sequence_id] = prepare(sequence.tokens, slot)
+            else:
+                # The scheduler admits at most max_num_sequences, so no sequence takes over the slot of another
+                next_tokens[sequence_id] = NoFreeSlotError(f"All {CONCURRENT_SESSIONS} cache slots are in use")
+        ready = [sequence_id for sequence_id in sequences if sequence_id not in next_tokens]
+        if ready:
+            step_logits = decode({sequence_slots[sequence_id]: sequences[sequence_id].tokens[-1] for sequence_id in ready})
+            for sequence_id in ready:
+                next_tokens[sequence_id] = sample_next_token(
+                    step_logits[sequence_slots[sequence_id]], temperature=sequences[sequence_id].temperature
+                )
+
+    def release_sequence(sequence_id: str):
+        slot = sequence_slots.pop(sequence_id, None)
+        if slot is not None:
+            slots.release(slot)
+
+    @torch.inference_mode()
+    def score(prompt_tokens: list[int], continuation_tokens: list[int], top_n: int = 0):
+        tokens, first = scoring_inputs(prompt_tokens, continuation_tokens)
+        assert len(tokens) <= CONTEXT, f"Scoring {len(tokens)} tokens, the context is {CONTEXT}"
+        # Without caches, so that scoring neither waits for a slot nor takes one from a conversation
+        logits = model(
+            torch.as_tensor(tokens, dtype=torch.int32, device=device)[None, :],
+            logits_indices=torch.arange(first, len(tokens), device=device),
+        )[0]
+        return score_logits(logits, continuation_tokens, top_n)
+
+    def init_worker():
+        # The current device and the grad mode are per thread, the server runs the model on its own thread
+        torch.cuda.set_device(device)
+        torch.set_grad_enabled(False)
+
+    infer_next_token.score = score
+    infer_next_token.init_worker = init_worker
+    # The slots are decoded together, see gpt_oss.responses_api.batching
+    infer_next_token.batched = FunctionBackend(
+        step, release_sequence, max_batch_size=CONCURRENT_SESSIONS, max_num_sequences=CONCURRENT_SESSIONS
+    )
+    infer_next_token.release = release
     return infer_next_token
 
 
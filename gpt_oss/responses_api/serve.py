@@ -9,6 +9,7 @@ from openai_harmony import (
 )
 
 from .api_server import create_api_server
+from .worker import InferenceWorker
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Responses API server")
@@ -39,6 +40,8 @@ if __name__ == "__main__":
 
     if args.inference_backend == "triton":
         from .inference.triton import setup_model
+    elif args.inference_backend == "torch":
+        from .inference.torch import setup_model
     elif args.inference_backend == "stub":
         from .inference.stub import setup_model
     elif args.inference_backend == "metal":
@@ -55,4 +58,8 @@ if __name__ == "__main__":
     encoding = load_harmony_encoding(HarmonyEncodingName.HARMONY_GPT_OSS)
 
     infer_next_token = setup_model(args.checkpoint)
-    uvicorn.run(create_api_server(infer_next_token, encoding), port=args.port)
+    # Backends that can score continuations expose it as infer_next_token.score
+    score = getattr(infer_next_token, "score", None)
+    # and per-thread setup of the inference thread as infer_next_token.init_worker
+    worker = InferenceWorker(initializer=getattr(infer_next_token, "init_worker", None))
+    uvicorn.run(create_api_server(infer_next_token, encoding, score=score, worker=worker), port=args.port)
@@ -1,7 +1,7 @@
 from typing import Any, Dict, Literal, Optional, Union
 
 from openai_harmony import ReasoningEffort
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, PositiveInt
 
 MODEL_IDENTIFIER = "gpt-oss-120b"
 DEFAULT_TEMPERATURE = 0.0
@@ -182,6 +182,8 @@ class ResponsesRequest(BaseModel):
     previous_response_id: Optional[str] = None
     temperature: Optional[float] = DEFAULT_TEMPERATURE
     include: Optional[list[str]] = None
+    # Reduced-expert fast mode: experts per token, for all layers or one value per layer
+    experts_per_token: Optional[Union[PositiveInt, list[PositiveInt]]] = None
 
 
 class ResponseObject(BaseModel):
@@ -213,3 +215,33 @@ class ResponseObject(BaseModel):
     text: Optional[Dict[str, Any]] = None
     tool_choice: Optional[str] = "auto"
     top_p: Optional[int] = 1
+
+
+class ScoreRequest(BaseModel):
+    model: Optional[str] = MODEL_IDENTIFIER
+    # Text (special tokens allowed) or token ids; text is tokenized separately for both fields
+    prompt: Union[str, list[int]]
+    continuation: Union[str, list[int]]
+    # Alternatives per scored token, bounded like the top_logprobs of the OpenAI API
+    top_logprobs: Optional[int] = Field(0, ge=0, le=20)
+
+
+class TopLogprob(BaseModel):
+    token: int
+    text: str
+    logprob: float
+
+
+class ScoredToken(BaseModel):
+    token: int
+    text: str
+    logprob: float
+    top_logprobs: list[TopLogprob] = []
+
+
+class ScoreResponse(BaseModel):
+    object: Literal["score"] = "score"
+    model: Optional[str] = MODEL_IDENTIFIER
+    prompt_tokens: int
+    tokens: list[ScoredToken]
+    total_logprob: float
@@ -0,0 +1,51 @@
+"""Runs the inference backend off the event loop.
+
+The backends behind `infer_next_token` are synchronous and keep state (KV
+caches, CUDA graphs, open streams) that is not safe to use from several
+threads. An `InferenceWorker` owns one thread that executes the submitted
+calls one at a time, in submission order; coroutines await their results
+without blocking the event loop, so other requests, disconnect detection and
+health checks keep being served while a forward pass runs. Concurrent
+responses queue one token at a time and therefore take turns.
+
+    worker = InferenceWorker()
+    next_token = await worker.run(infer_next_token, tokens, temperature=0.0)
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class InferenceWorker:
+    def __init__(self, initializer: Optional[Callable[[], None]] = None, name: str = "inference"):
+        # initializer runs on the worker thread first, e.g. to select the CUDA device of this rank
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name, initializer=initializer)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Calls submitted and not finished yet, including the running one."""
+        return self._pending
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn: Callable[..., T], *args, **kwargs) -> "Future[T]":
+        """Queue a call without waiting for it, e.g. to release resources from a finalizer."""
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
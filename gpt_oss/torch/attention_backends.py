@@ -0,0 +1,302 @@
+"""Registry of attention implementations with an autotuner that picks one per shape.
+
+All backends share the signature of the Triton kernel:
+
+    backend(query, key, value, sinks, sm_scale, sliding_window, start_q) -> output
+
+with query [batch, n_q, n_kv_heads, q_mult, head_dim], key and value
+[batch, n_kv, n_kv_heads, head_dim], start_q a tensor holding the position of
+the first query, either one element shared by the batch or one per batch row,
+and output [batch, n_q, n_heads * head_dim].
+
+The first time a shape is seen, every backend that supports it is timed and
+checked against `attention_ref`; the fastest one is stored per device in a
+JSON file (GPT_OSS_ATTENTION_CACHE, by default under ~/.cache/gpt_oss), so
+later runs skip the benchmark. GPT_OSS_ATTENTION_BACKEND forces one backend.
+The check runs on a slice of at most CHECK_QUERIES queries and CHECK_KEYS
+keys, and the reference, which materializes all scores, only serves short
+inputs, so tuning a long prefill never runs it at full size.
+"""
+
+import json
+import os
+import time
+import warnings
+from dataclasses import dataclass
+from typing import Callable
+
+import torch
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "gpt_oss", "attention_autotune.json")
+CHECK_QUERIES = 64
+CHECK_KEYS = 1024
+
+
+@dataclass
+class AttentionBackend:
+    name: str
+    fn: Callable[..., torch.Tensor]
+    supports: Callable[[torch.Tensor, torch.Tensor], bool]
+    # Whether the backend can be recorded into a CUDA graph (no host synchronization)
+    graph_safe: bool = True
+
+
+ATTENTION_BACKENDS: dict[str, AttentionBackend] = {}
+
+
+def register_attention_backend(
+    name: str,
+    supports: Callable[[torch.Tensor, torch.Tensor], bool] | None = None,
+    graph_safe: bool = True,
+):
+    def decorator(fn):
+        ATTENTION_BACKENDS[name] = AttentionBackend(name, fn, supports or (lambda query, key: True), graph_safe)
+        return fn
+    return decorator
+
+
+def _attend(query, key, value, sinks, sm_scale, mask) -> torch.Tensor:
+    """Attention with sinks; mask [1 or batch, num_queries, num_keys] is True for the keys a query does not see."""
+    batch_size, num_queries, num_key_value_heads, num_key_value_groups, head_dim = query.shape
+
+    sinks = sinks.view(1, num_key_value_heads, num_key_value_groups, 1, 1).float()
+    key = key.unsqueeze(3)
+    value = value.unsqueeze(3)
+
+    logits = torch.einsum("bqhmd,bkhmd->bhmqk", query.float(), key.float()) * sm_scale
+    logits = logits.masked_fill(mask[:, None, None, :, :], float("-inf"))
+
+    logits_max = torch.max(logits, dim=-1, keepdim=True).values
+    logits_or_sinks_max = torch.maximum(sinks, logits_max)
+    sinks = torch.exp(sinks - logits_or_sinks_max)
+    unnormalized_scores = torch.exp(logits - logits_or_sinks_max)
+    normalizer = unnormalized_scores.sum(dim=-1, keepdim=True) + sinks
+    scores = unnormalized_scores / normalizer
+
+    output = torch.einsum("bhmqk,bkhmd->bqhmd", scores, value.float())
+
+    output = output.reshape(batch_size, num_queries, num_key_value_heads * num_key_value_groups * head_dim).bfloat16()
+    return output
+
+
+@register_attention_backend("ref", supports=lambda query, key: query.shape[1] < CHECK_QUERIES)
+def attention_ref(
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    sinks: torch.Tensor,
+    sm_scale: float = 0.125,
+    sliding_window: int | None = None,
+    start_q: torch.LongTensor = 0,
+):
+    num_queries = query.shape[1]
+    num_keys = key.shape[1]
+
+    pos_keys = torch.arange(num_keys, device=query.device)
+    # [1 or batch, num_queries]
+    start_q = torch.as_tensor(start_q, device=query.device).view(-1, 1)
+    pos_queries = torch.arange(num_queries, device=query.device) + start_q
+    mask = pos_keys[None, None, :] > pos_queries[:, :, None]
+
+    if sliding_window:
+        too_old = pos_keys[None, None, :] < (pos_queries[:, :, None] - sliding_window + 1)
+        mask = mask | too_old
+
+    return _attend(query, key, value, sinks, sm_scale, mask)
+
+
+@register_attention_backend("decode", supports=lambda query, key: query.shape[1] == 1)
+def attention_decode(
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    sinks: torch.Tensor,
+    sm_scale: float = 0.125,
+    sliding_window: int | None = None,
+    start_q: torch.LongTensor = 0,
+    num_keys: int | None = None,
+):
+    """Single-query attention that only reads the keys the query can see.
+
+    key and value are whole KV caches. Sliding-window layers gather the
+    `sliding_window` entries ending at the position of each row, other layers
+    read the first `num_keys` entries, which must cover every row (see
+    `decode_num_keys`). The positions stay on the device and the shapes only
+    depend on these host-side bounds, so the cost of a step tracks the context
+    length rather than the cache capacity, also in CUDA graphs.
+    """
+    batch_size, num_queries = query.shape[:2]
+    assert num_queries == 1
+    num_keys = key.shape[1] if num_keys is None else min(num_keys, key.shape[1])
+    # [1 or batch, 1]
+    start_q = torch.as_tensor(start_q, device=query.device).view(-1, 1)
+
+    if sliding_window and sliding_window < num_keys:
+        positions = (start_q + torch.arange(1 - sliding_window, 1, device=query.device)).expand(batch_size, -1)
+        rows = torch.arange(batch_size, device=query.device)[:, None]
+        indices = positions.clamp(min=0)
+        key, value = key[rows, indices], value[rows, indices]
+        # Early in the sequence the window starts before the first token
+        mask = positions < 0
+    else:
+        key, value = key[:, :num_keys], value[:, :num_keys]
+        pos_keys = torch.arange(num_keys, device=query.device)
+        mask = pos_keys[None, :] > start_q
+        if sliding_window:
+            mask = mask | (pos_keys[None, :] < start_q - sliding_window + 1)
+
+    return _attend(query, key, value, sinks, sm_scale, mask[:, None, :])
+
+
+def decode_num_keys(num_keys: int, capacity: int, min_keys: int = 256) -> int:
+    """Bound on the keys read by `attention_decode` for rows of up to num_keys entries.
+
+    Rounded up to a power of two, so that a decode step captured into a CUDA
+    graph for one bound serves a range of context lengths.
+    """
+    return min(max(_bucket(num_keys), min_keys), capacity)
+
+
+@register_attention_backend("sdpa", graph_safe=False)
+def attention_sdpa(query, key, value, sinks, sm_scale, sliding_window=None, start_q=0):
+    """The torch model's sdpa, run per sequence over the valid prefix of the KV cache only."""
+    from gpt_oss.torch.model import sdpa
+
+    batch_size, num_queries = query.shape[:2]
+    offsets = torch.as_tensor(start_q).flatten().tolist()
+    if len(offsets) == 1:
+        offsets = offsets * batch_size
+    outputs = [
+        sdpa(q, k[: offset + num_queries], v[: offset + num_queries], sinks, sm_scale, sliding_window or 0, offset)
+        for q, k, v, offset in zip(query, key, value, offsets)
+    ]
+    return torch.stack(outputs).bfloat16()
+
+
+def _bucket(n: int) -> int:
+    # Prompt lengths vary, so tune once per power of two
+    return 1 << max(0, n - 1).bit_length()
+
+
+def device_name(device: torch.device) -> str:
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    return device.type
+
+
+class AttentionAutotuner:
+    def __init__(
+        self,
+        backends: list[str] | None = None,
+        cache_path: str | None = None,
+        warmup: int = 2,
+        repeats: int = 5,
+        atol: float = 1e-2,
+        rtol: float = 1e-2,
+    ):
+        self.backends = backends
+        self.cache_path = cache_path or os.environ.get("GPT_OSS_ATTENTION_CACHE", DEFAULT_CACHE_PATH)
+        self.warmup = warmup
+        self.repeats = repeats
+        self.atol = atol
+        self.rtol = rtol
+        # device name -> shape key -> {"best": name, "timings_ms": {name: ms}}
+        self.table: dict[str, dict[str, dict]] = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, "r") as f:
+                self.table = json.load(f)
+
+    def candidates(self, query: torch.Tensor, key: torch.Tensor) -> list[AttentionBackend]:
+        names = self.backends if self.backends is not None else list(ATTENTION_BACKENDS)
+        return [ATTENTION_BACKENDS[name] for name in names if ATTENTION_BACKENDS[name].supports(query, key)]
+
+    @staticmethod
+    def shape_key(query: torch.Tensor, key: torch.Tensor, sliding_window: int | None) -> str:
+        batch_size, num_queries, num_key_value_heads, num_key_value_groups, head_dim = query.shape
+        return (
+            f"b={batch_size},q={_bucket(num_queries)},kv={key.shape[1]},"
+            f"heads={num_key_value_heads}x{num_key_value_groups},d={head_dim},"
+            f"window={sliding_window or 0},dtype={str(query.dtype).removeprefix('torch.')}"
+        )
+
+    def _time(self, backend: AttentionBackend, args: tuple) -> float:
+        synchronize = torch.cuda.synchronize if args[0].is_cuda else (lambda: None)
+        for _ in range(self.warmup):
+            backend.fn(*args)
+        synchronize()
+        start = time.perf_counter()
+        for _ in range(self.repeats):
+            backend.fn(*args)
+        synchronize()
+        return (time.perf_counter() - start) / self.repeats * 1e3
+
+    @staticmethod
+    def check_slice(query, key, value, sinks, sm_scale, sliding_window, start_q) -> tuple:
+        """Inputs of the correctness check: the first row, with its queries after the first keys."""
+        num_queries = min(query.shape[1], CHECK_QUERIES)
+        num_keys = min(key.shape[1], CHECK_KEYS)
+        start_q = torch.tensor([max(num_keys - num_queries, 0)], device=query.device)
+        return query[:1, :num_queries], key[:1, :num_keys], value[:1, :num_keys], sinks, sm_scale, sliding_window, start_q
+
+    def tune(self, query, key, value, sinks, sm_scale, sliding_window, start_q) -> dict:
+        args = (query, key, value, sinks, sm_scale, sliding_window, start_q)
+        check_args = self.check_slice(*args)
+        expected = attention_ref(*check_args)
+        timings = {}
+        for backend in self.candidates(query, key):
+            try:
+                torch.testing.assert_close(backend.fn(*check_args), expected, atol=self.atol, rtol=self.rtol)
+            except Exception as e:
+                warnings.warn(f"Attention backend {backend.name} is excluded for this shape: {e}")
+                continue
+            timings[backend.name] = self._time(backend, args)
+        assert timings, "No attention backend supports this shape"
+        return {"best": min(timings, key=timings.get), "timings_ms": timings}
+
+    def select(self, query, key, value, sinks, sm_scale, sliding_window, start_q) -> AttentionBackend:
+        forced = os.environ.get("GPT_OSS_ATTENTION_BACKEND")
+        if forced:
+            return ATTENTION_BACKENDS[forced]
+        capturing = query.is_cuda and torch.cuda.is_current_stream_capturing()
+        entries = self.table.setdefault(device_name(query.device), {})
+        shape_key = self.shape_key(query, key, sliding_window)
+        if shape_key not in entries:
+            if capturing:
+                # Benchmarking is not possible while capturing, run a forward pass before capture to tune
+                return next(b for b in self.candidates(query, key) if b.graph_safe)
+            entries[shape_key] = self.tune(query, key, value, sinks, sm_scale, sliding_window, start_q)
+            self.save()
+        entry = entries[shape_key]
+        names = sorted(entry["timings_ms"], key=entry["timings_ms"].get)
+        for name in names:
+            backend = ATTENTION_BACKENDS.get(name)
+            if backend is not None and (backend.graph_safe or not capturing):
+                return backend
+        raise RuntimeError(f"No usable attention backend among {names}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # Write and rename so that concurrent ranks never read a partial file
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.table, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def __call__(self, query, key, value, sinks, sm_scale, sliding_window=None, start_q=0) -> torch.Tensor:
+        backend = self.select(query, key, value, sinks, sm_scale, sliding_window, start_q)
+        return backend.fn(query, key, value, sinks, sm_scale, sliding_window, start_q)
+
+
+_autotuner: AttentionAutotuner | None = None
+
+
+def get_autotuner() -> AttentionAutotuner:
+    global _autotuner
+    if _autotuner is None:
+        _autotuner = AttentionAutotuner()
+    return _autotuner
+
+
+def attention(query, key, value, sinks, sm_scale, sliding_window=None, start_q=0) -> torch.Tensor:
+    """Dispatch to the fastest registered backend for this shape."""
+    return get_autotuner()(query, key, value, sinks, sm_scale, sliding_window, start_q)
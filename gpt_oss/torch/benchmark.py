@@ -0,0 +1,379 @@
+"""CPU microbenchmarks for the building blocks of the torch reference model.
+
+Every benchmark runs on downscaled model configs so that the suite finishes in
+seconds on a laptop. Results are written as JSON and can be compared against a
+stored baseline; the exit code is non-zero if any benchmark regressed by more
+than the threshold:
+
+python -m gpt_oss.torch.benchmark --output results.json
+python -m gpt_oss.torch.benchmark --baseline results.json --threshold 0.1
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import re
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import torch
+
+from gpt_oss.torch.attention_backends import attention_decode, attention_ref, decode_num_keys
+from gpt_oss.torch.model import MLPBlock, ModelConfig, RMSNorm, RotaryEmbedding, sdpa, swiglu
+from gpt_oss.torch.weights import dequantize_mxfp4
+
+CONFIGS = {
+    "tiny": ModelConfig(
+        num_hidden_layers=2,
+        num_experts=8,
+        experts_per_token=2,
+        vocab_size=1024,
+        hidden_size=128,
+        intermediate_size=128,
+        head_dim=32,
+        num_attention_heads=8,
+        num_key_value_heads=2,
+        sliding_window=64,
+    ),
+    "small": ModelConfig(
+        num_hidden_layers=4,
+        num_experts=32,
+        experts_per_token=4,
+        vocab_size=8192,
+        hidden_size=512,
+        intermediate_size=512,
+        head_dim=64,
+        num_attention_heads=16,
+        num_key_value_heads=2,
+        sliding_window=128,
+    ),
+}
+
+
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[..., Callable[[], object]]
+    params: dict[str, list]
+
+    def cases(self):
+        keys = list(self.params)
+        for values in itertools.product(*(self.params[k] for k in keys)):
+            params = dict(zip(keys, values))
+            case_name = ",".join(f"{k}={v}" for k, v in params.items())
+            yield f"{self.name}[{case_name}]", params
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, **params: list):
+    """Register a setup function that returns the closure to time for one parameter combination."""
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, setup, params))
+        return setup
+    return decorator
+
+
+def _init(module: torch.nn.Module) -> torch.nn.Module:
+    for param in module.parameters():
+        param.data.normal_(0.0, 0.02)
+    return module
+
+
+def _hidden(config: ModelConfig, tokens: int) -> torch.Tensor:
+    return torch.randn(tokens, config.hidden_size, dtype=torch.bfloat16)
+
+
+@benchmark("rmsnorm", config=["tiny", "small"], tokens=[1, 128])
+def _rmsnorm(config: ModelConfig, tokens: int):
+    norm = RMSNorm(config.hidden_size)
+    x = _hidden(config, tokens)
+    return lambda: norm(x)
+
+
+@benchmark("rope", config=["tiny", "small"], tokens=[1, 128])
+def _rope(config: ModelConfig, tokens: int):
+    rope = RotaryEmbedding(
+        config.head_dim,
+        config.rope_theta,
+        torch.float32,
+        initial_context_length=config.initial_context_length,
+        scaling_factor=config.rope_scaling_factor,
+        ntk_alpha=config.rope_ntk_alpha,
+        ntk_beta=config.rope_ntk_beta,
+    )
+    q = torch.randn(tokens, config.num_attention_heads, config.head_dim, dtype=torch.bfloat16)
+    k = torch.randn(tokens, config.num_key_value_heads, config.head_dim, dtype=torch.bfloat16)
+    return lambda: rope(q, k)
+
+
+def _sdpa_inputs(config: ModelConfig, tokens: int, offset: int):
+    q_mult = config.num_attention_heads // config.num_key_value_heads
+    Q = torch.randn(tokens, config.num_key_value_heads, q_mult, config.head_dim, dtype=torch.bfloat16)
+    K = torch.randn(offset + tokens, config.num_key_value_heads, config.head_dim, dtype=torch.bfloat16)
+    V = torch.randn(offset + tokens, config.num_key_value_heads, config.head_dim, dtype=torch.bfloat16)
+    S = torch.zeros(config.num_attention_heads, dtype=torch.bfloat16)
+    return Q, K, V, S, 1.0 / config.head_dim**0.5
+
+
+@benchmark("sdpa_prefill", config=["tiny", "small"], tokens=[128, 512], window=["dense", "sliding"])
+def _sdpa_prefill(config: ModelConfig, tokens: int, window: str):
+    Q, K, V, S, sm_scale = _sdpa_inputs(config, tokens, offset=0)
+    sliding_window = config.sliding_window if window == "sliding" else 0
+    return lambda: sdpa(Q, K, V, S, sm_scale, sliding_window)
+
+
+@benchmark("sdpa_decode", config=["tiny", "small"], context=[512, 2048], window=["dense", "sliding"])
+def _sdpa_decode(config: ModelConfig, context: int, window: str):
+    Q, K, V, S, sm_scale = _sdpa_inputs(config, 1, offset=context - 1)
+    sliding_window = config.sliding_window if window == "sliding" else 0
+    return lambda: sdpa(Q, K, V, S, sm_scale, sliding_window, offset=context - 1)
+
+
+# Capacity of the KV cache in the decode attention benchmarks, as preallocated by the triton model
+DECODE_CAPACITY = 8192
+
+
+@benchmark(
+    "cache_decode",
+    config=["tiny", "small"],
+    context=[256, 1024, 4096],
+    window=["dense", "sliding"],
+    kernel=["full", "length_aware"],
+)
+def _cache_decode(config: ModelConfig, context: int, window: str, kernel: str):
+    # One decode step over a preallocated cache holding `context` tokens: the full kernel
+    # reads the whole capacity, the length-aware one should scale with the context
+    q_mult = config.num_attention_heads // config.num_key_value_heads
+    Q = torch.randn(1, 1, config.num_key_value_heads, q_mult, config.head_dim, dtype=torch.bfloat16)
+    K = torch.randn(1, DECODE_CAPACITY, config.num_key_value_heads, config.head_dim, dtype=torch.bfloat16)
+    V = torch.randn(1, DECODE_CAPACITY, config.num_key_value_heads, config.head_dim, dtype=torch.bfloat16)
+    S = torch.zeros(config.num_attention_heads, dtype=torch.bfloat16)
+    sm_scale = 1.0 / config.head_dim**0.5
+    sliding_window = config.sliding_window if window == "sliding" else 0
+    start_q = torch.tensor([context - 1])
+    if kernel == "full":
+        return lambda: attention_ref(Q, K, V, S, sm_scale, sliding_window, start_q)
+    num_keys = decode_num_keys(context, DECODE_CAPACITY)
+    return lambda: attention_decode(Q, K, V, S, sm_scale, sliding_window, start_q, num_keys=num_keys)
+
+
+@benchmark("mlp_routing", config=["tiny", "small"], tokens=[1, 128])
+def _mlp_routing(config: ModelConfig, tokens: int):
+    mlp = _init(MLPBlock(config))
+    x = _hidden(config, tokens)
+
+    def run():
+        g = mlp.gate(mlp.norm(x))
+        experts = torch.topk(g, k=mlp.experts_per_token, dim=-1, sorted=True)
+        return torch.nn.functional.softmax(experts.values, dim=1), experts.indices
+
+    return run
+
+
+@benchmark("mlp_block", config=["tiny", "small"], tokens=[1, 128])
+def _mlp_block(config: ModelConfig, tokens: int):
+    mlp = _init(MLPBlock(config))
+    x = _hidden(config, tokens)
+    return lambda: mlp(x)
+
+
+@benchmark("swiglu", config=["tiny", "small"], tokens=[1, 128])
+def _swiglu(config: ModelConfig, tokens: int):
+    x = torch.randn(tokens, config.experts_per_token, config.intermediate_size * 2, dtype=torch.bfloat16)
+    return lambda: swiglu(x, limit=config.swiglu_limit)
+
+
+@benchmark("mxfp4_dequant", config=["tiny", "small"])
+def _mxfp4_dequant(config: ModelConfig):
+    # Same layout as the mlp1 weight of one layer: [experts, rows, groups of 32 values, 16 bytes]
+    rows = config.intermediate_size * 2
+    blocks = torch.randint(0, 256, (config.num_experts, rows, config.hidden_size // 32, 16), dtype=torch.uint8)
+    scales = torch.randint(120, 134, (config.num_experts, rows, config.hidden_size // 32), dtype=torch.uint8)
+    return lambda: dequantize_mxfp4(blocks, scales)
+
+
+@benchmark("unembedding", config=["tiny", "small"], tokens=[1, 128])
+def _unembedding(config: ModelConfig, tokens: int):
+    unembedding = _init(torch.nn.Linear(config.hidden_size, config.vocab_size, bias=False, dtype=torch.bfloat16))
+    x = _hidden(config, tokens)
+    return lambda: unembedding(x)
+
+
+def time_fn(fn: Callable[[], object], warmup: int = 2, repeats: int = 10, min_time: float = 0.0) -> list[float]:
+    """Return per-call times in milliseconds; keeps repeating until at least `min_time` seconds were spent."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeats or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1e3)
+    return times
+
+
+@torch.inference_mode()
+def run_benchmarks(
+    patterns: list[str] | None = None,
+    warmup: int = 2,
+    repeats: int = 10,
+    min_time: float = 0.0,
+) -> dict[str, dict]:
+    results = {}
+    for bench in BENCHMARKS:
+        for case_name, params in bench.cases():
+            if patterns and not any(re.search(p, case_name) for p in patterns):
+                continue
+            torch.manual_seed(0)
+            fn = bench.setup(**(params | {"config": CONFIGS[params["config"]]}))
+            times = time_fn(fn, warmup, repeats, min_time)
+            results[case_name] = {
+                "benchmark": bench.name,
+                "params": params,
+                "repeats": len(times),
+                "median_ms": statistics.median(times),
+                "min_ms": min(times),
+                "mean_ms": statistics.fmean(times),
+                "stdev_ms": statistics.stdev(times) if len(times) > 1 else 0.0,
+            }
+    return results
+
+
+def environment() -> dict[str, object]:
+    return {
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float = 0.1) -> list[dict]:
+    """Compare the median times of the benchmarks present in both runs; a ratio above 1 + threshold is a regression."""
+    comparisons = []
+    for case_name, result in results.items():
+        if case_name not in baseline:
+            continue
+        ratio = result["median_ms"] / baseline[case_name]["median_ms"]
+        comparisons.append({
+            "name": case_name,
+            "baseline_ms": baseline[case_name]["median_ms"],
+            "current_ms": result["median_ms"],
+            "ratio": ratio,
+            "regression": ratio > 1.0 + threshold,
+        })
+    return comparisons
+
+
+def format_results(results: dict[str, dict], comparisons: list[dict] | None = None) -> str:
+    by_name = {c["name"]: c for c in comparisons or []}
+    width = max((len(name) for name in results), default=10)
+    lines = [f"{'benchmark':<{width}} {'median ms':>10} {'min ms':>10} {'baseline':>10} {'ratio':>7}"]
+    for case_name, result in results.items():
+        line = f"{case_name:<{width}} {result['median_ms']:>10.4f} {result['min_ms']:>10.4f}"
+        if case_name in by_name:
+            comparison = by_name[case_name]
+            flag = "  REGRESSION" if comparison["regression"] else ""
+            line += f" {comparison['baseline_ms']:>10.4f} {comparison['ratio']:>7.2f}{flag}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(args) -> int:
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    if args.list:
+        for bench in BENCHMARKS:
+            for case_name, _ in bench.cases():
+                print(case_name)
+        return 0
+
+    results = run_benchmarks(args.filter, args.warmup, args.repeats, args.min_time)
+    comparisons = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            comparisons = compare(results, json.load(f)["results"], args.threshold)
+    print(format_results(results, comparisons))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+    regressions = [c["name"] for c in comparisons or [] if c["regression"]]
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU microbenchmarks for the torch model building blocks")
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        type=str,
+        default=None,
+        help="Write the results to a JSON file",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        type=str,
+        default=None,
+        help="Compare against the results of a previous run",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown of the median time that counts as a regression",
+    )
+    parser.add_argument(
+        "-k",
+        "--filter",
+        metavar="PATTERN",
+        type=str,
+        action="append",
+        default=None,
+        help="Only run benchmarks whose name matches this regular expression, e.g. 'sdpa_decode' (can be repeated)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=2,
+        help="Untimed calls before measuring",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=10,
+        help="Minimum number of timed calls",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.1,
+        help="Minimum time in seconds spent measuring each benchmark",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of intra-op CPU threads",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="List the benchmarks and exit",
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,245 @@
+"""Prefill/decode disaggregation: prompts and generated tokens run in different processes.
+
+Prefill is compute bound and decode is memory bandwidth bound, and a long
+prefill in the same forward pass as in-flight decodes stalls all of them.
+`DisaggregatedGenerator` starts dedicated worker processes instead:
+
+- prefill workers run the prompt (all tokens but the last) through the model
+  and send its keys and values to a decode worker as KV snapshot bytes (see
+  `gpt_oss.torch.kv_snapshot`), bf16 tensors plus a small header;
+- decode workers import the KV state into their paged cache and generate with
+  a continuous-batching `Engine`, so their forward passes only ever contain
+  the last prompt token and the decoded tokens.
+
+Requests are spread over the decode workers by id. A stream that is closed
+before its request finished sends an abort message to the decode worker of
+the request, which frees its KV state. All messages go through
+multiprocessing queues (pipes), so it works on CPU, e.g.:
+
+python -m gpt_oss.generate --backend torch --prefill-workers 2 --decode-workers 1 gpt-oss-20b/original/
+"""
+
+import itertools
+import math
+import multiprocessing as mp
+import queue
+import threading
+import traceback
+
+import torch
+
+from gpt_oss.torch.engine import Engine, TorchModelRunner
+from gpt_oss.torch.kv_snapshot import KVSnapshot, kv_snapshot_from_bytes, kv_snapshot_to_bytes
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.paged_cache import PagedKVCache
+
+# Seconds between the liveness checks of the workers while a stream waits for a token
+WORKER_POLL_INTERVAL = 1.0
+
+
+@torch.inference_mode()
+def _prefill_worker(checkpoint: str, device: str, context: int, block_size: int, inbox, decode_inboxes, outbox):
+    model = Transformer.from_checkpoint(checkpoint, device=device)
+    config = model.config
+    kv_cache = PagedKVCache(
+        num_layers=config.num_hidden_layers,
+        num_blocks=math.ceil(context / block_size),
+        block_size=block_size,
+        num_kv_heads=config.num_key_value_heads,
+        head_dim=config.head_dim,
+        device=torch.device(device),
+    )
+    while (message := inbox.get()) is not None:
+        request_id, prompt_tokens, *sampling = message
+        # The decode worker feeds the last prompt token itself to get the logits of the first new token
+        tokens = prompt_tokens[:-1]
+        table = kv_cache.new_sequence()
+        try:
+            if tokens:
+                caches = kv_cache.prepare([table], [len(tokens)])
+                model(torch.as_tensor(tokens, dtype=torch.int32, device=device), caches=caches)
+            k, v = kv_cache.export_kv(table)
+            data = kv_snapshot_to_bytes(KVSnapshot(config, tokens, k, v))
+        except Exception:
+            outbox.put((request_id, None, None, None, traceback.format_exc()))
+            continue
+        finally:
+            kv_cache.free(table)
+        decode_inboxes[request_id % len(decode_inboxes)].put((request_id, prompt_tokens, *sampling, data))
+
+
+@torch.inference_mode()
+def _decode_worker(checkpoint: str, device: str, context: int, block_size: int, max_num_seqs: int, inbox, outbox):
+    model = Transformer.from_checkpoint(checkpoint, device=device)
+    engine = Engine(TorchModelRunner(model, math.ceil(context / block_size), block_size), max_num_seqs=max_num_seqs)
+    # Engine request id -> request id of the front end
+    request_ids = {}
+    # Aborted before the prefill worker passed them on; the set keeps ids of requests that finished first
+    aborted = set()
+    while True:
+        messages = []
+        if not engine.has_unfinished():
+            messages.append(inbox.get())
+        while True:
+            try:
+                messages.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        for message in messages:
+            if message is None:
+                return
+            if message[0] == "abort":
+                _, request_id = message
+                engine_id = next((e for e, r in request_ids.items() if r == request_id), None)
+                if engine_id is None:
+                    aborted.add(request_id)
+                else:
+                    engine.abort(engine_id)
+                    del request_ids[engine_id]
+                continue
+            request_id, prompt_tokens, stop_tokens, temperature, max_tokens, data = message
+            if request_id in aborted:
+                aborted.remove(request_id)
+                continue
+            try:
+                snapshot = kv_snapshot_from_bytes(data, device=device, config=model.config)
+                engine_id = engine.add_request(
+                    prompt_tokens, stop_tokens, temperature, max_tokens, kv=(snapshot.k, snapshot.v)
+                )
+            except Exception:
+                outbox.put((request_id, None, None, None, traceback.format_exc()))
+                continue
+            request_ids[engine_id] = request_id
+        try:
+            outputs = engine.step()
+        except Exception:
+            # Fail the requests in flight rather than the worker, which keeps serving new ones
+            error = traceback.format_exc()
+            for engine_id, request_id in request_ids.items():
+                engine.abort(engine_id)
+                outbox.put((request_id, None, None, None, error))
+            request_ids.clear()
+            continue
+        for output in outputs:
+            outbox.put((request_ids[output.request_id], output.token, output.logprob, output.finish_reason, None))
+            if output.finish_reason is not None:
+                del request_ids[output.request_id]
+
+
+class DisaggregatedGenerator:
+    def __init__(
+        self,
+        checkpoint: str,
+        device: str = "cpu",
+        context: int = 8192,
+        block_size: int = 16,
+        num_prefill_workers: int = 1,
+        num_decode_workers: int = 1,
+        max_num_seqs: int = 64,
+    ):
+        # CUDA cannot be initialized in forked processes
+        ctx = mp.get_context("spawn")
+        self.prefill_inbox = ctx.Queue()
+        self.decode_inboxes = [ctx.Queue() for _ in range(num_decode_workers)]
+        self.outbox = ctx.Queue()
+        self.prefill_workers = [
+            ctx.Process(
+                target=_prefill_worker,
+                args=(checkpoint, str(device), context, block_size, self.prefill_inbox, self.decode_inboxes, self.outbox),
+                daemon=True,
+            )
+            for _ in range(num_prefill_workers)
+        ]
+        self.decode_workers = [
+            ctx.Process(
+                target=_decode_worker,
+                args=(checkpoint, str(device), context, block_size, max_num_seqs, inbox, self.outbox),
+                daemon=True,
+            )
+            for inbox in self.decode_inboxes
+        ]
+        for worker in self.prefill_workers + self.decode_workers:
+            worker.start()
+
+        self.request_ids = itertools.count()
+        self.streams: dict[int, queue.Queue] = {}
+        self.lock = threading.Lock()
+        self.dispatcher = threading.Thread(target=self._dispatch, name="gpt-oss-disaggregation", daemon=True)
+        self.dispatcher.start()
+
+    def _dispatch(self):
+        while (message := self.outbox.get()) is not None:
+            request_id, *output = message
+            with self.lock:
+                stream = self.streams.get(request_id)
+            if stream is not None:
+                stream.put(output)
+
+    def submit(
+        self,
+        prompt_tokens: list[int],
+        stop_tokens: list[int] | None = None,
+        temperature: float = 1.0,
+        max_tokens: int = 0,
+    ) -> int:
+        assert prompt_tokens, "The prompt must not be empty"
+        request_id = next(self.request_ids)
+        with self.lock:
+            self.streams[request_id] = queue.Queue()
+        self.prefill_inbox.put((request_id, list(prompt_tokens), list(stop_tokens or []), temperature, max_tokens or 0))
+        return request_id
+
+    def stream(self, request_id: int, return_logprobs: bool = False):
+        stream = self.streams[request_id]
+        finished = False
+        try:
+            while True:
+                try:
+                    token, logprob, finish_reason, error = stream.get(timeout=WORKER_POLL_INTERVAL)
+                except queue.Empty:
+                    workers = self.prefill_workers + self.decode_workers
+                    if not all(worker.is_alive() for worker in workers):
+                        raise RuntimeError(f"A worker process exited while request {request_id} was in flight")
+                    continue
+                if error is not None:
+                    finished = True
+                    raise RuntimeError(f"Request {request_id} failed in a worker:\n{error}")
+                finished = finish_reason is not None
+                yield (token, logprob) if return_logprobs else token
+                if finished:
+                    break
+        finally:
+            with self.lock:
+                del self.streams[request_id]
+            # The consumer stopped early, the decode worker would keep generating into the void
+            if not finished:
+                self.decode_inboxes[request_id % len(self.decode_inboxes)].put(("abort", request_id))
+
+    def generate(self,
+                 prompt_tokens: list[int],
+                 stop_tokens: list[int] | None = None,
+                 temperature: float = 1.0,
+                 max_tokens: int = 0,
+                 return_logprobs: bool = False):
+        request_id = self.submit(prompt_tokens, stop_tokens, temperature, max_tokens)
+        yield from self.stream(request_id, return_logprobs)
+
+    def close(self):
+        # Prefill workers first, so that every request they pass on is still received
+        for _ in self.prefill_workers:
+            self.prefill_inbox.put(None)
+        for worker in self.prefill_workers:
+            worker.join()
+        for inbox in self.decode_inboxes:
+            inbox.put(None)
+        for worker in self.decode_workers:
+            worker.join()
+        self.outbox.put(None)
+        self.dispatcher.join()
+
+    def __enter__(self) -> "DisaggregatedGenerator":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
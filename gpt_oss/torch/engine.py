@@ -0,0 +1,478 @@
+"""Continuous batching: serve many sequences at once with one forward pass per step.
+
+Every `Engine.step` builds a batch from all unfinished requests. Running
+sequences get their next token (decode), and sequences whose prompt is not
+fully prefilled get a chunk of it, as long as the batch stays within
+`max_num_tokens` tokens and `max_num_seqs` sequences and the KV entries fit in
+the cache. New requests are admitted and finished ones retired at every step.
+When the KV cache runs out, the most recently admitted sequence is preempted:
+its KV entries are dropped and recomputed (prompt and generated tokens) once
+there is room again.
+
+The scheduler only talks to the model through a `ModelRunner`.
+`TorchModelRunner` runs the reference model with a paged KV cache on CPU or
+GPU, `gpt_oss.triton.engine.TritonModelRunner` the triton model in the slots
+of its caches, and another model can be served by implementing the same
+interface.
+
+Callers that keep their own sequences across requests (see
+`gpt_oss.responses_api.inference.torch`) drive the engine with `run_pending`
+instead of `step`: it runs the pending tokens of the given sequences through
+the same scheduling and returns their logits without sampling.
+
+`AsyncEngine` runs the step loop in a worker thread and exposes it to asyncio:
+
+    engine = AsyncEngine(Engine(TorchModelRunner(model, num_blocks=1024)))
+    async for token in engine.generate(prompt_tokens, stop_tokens, max_tokens=100):
+        ...
+"""
+
+import asyncio
+import itertools
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
+
+import torch
+
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.paged_cache import OutOfBlocksError, PagedKVCache
+
+
+class ModelRunner(ABC):
+    """The model and KV cache the engine schedules work for.
+
+    Each sequence owns an opaque KV handle created by `new_sequence`.
+    """
+
+    @property
+    @abstractmethod
+    def max_context(self) -> int:
+        """Largest number of tokens a single sequence can hold."""
+
+    @abstractmethod
+    def new_sequence(self) -> Any:
+        ...
+
+    @abstractmethod
+    def free(self, handle: Any):
+        ...
+
+    @abstractmethod
+    def can_append(self, handles: list[Any], num_new_tokens: list[int]) -> bool:
+        """Whether the KV entries of one forward pass over these sequences fit in the cache."""
+
+    @abstractmethod
+    def forward(self, handles: list[Any], tokens: list[list[int]]) -> torch.Tensor:
+        """Append `tokens` to every sequence; returns the logits after the last new token of each, [len(handles), vocab]."""
+
+
+class KVImportRunner(ModelRunner):
+    """A `ModelRunner` that accepts requests carrying the KV state of a prompt prefix."""
+
+    @abstractmethod
+    def import_kv(self, k: torch.Tensor, v: torch.Tensor) -> Any:
+        """Create a sequence from keys and values [num_layers, num_tokens, num_kv_heads, head_dim] computed elsewhere."""
+
+
+class TorchModelRunner(KVImportRunner):
+    def __init__(self, model: Transformer, num_blocks: int, block_size: int = 16):
+        config = model.config
+        self.model = model
+        self.device = model.embedding.weight.device
+        self.kv_cache = PagedKVCache(
+            num_layers=config.num_hidden_layers,
+            num_blocks=num_blocks,
+            block_size=block_size,
+            num_kv_heads=config.num_key_value_heads,
+            head_dim=config.head_dim,
+            device=self.device,
+        )
+
+    @property
+    def max_context(self) -> int:
+        return self.kv_cache.allocator.num_blocks * self.kv_cache.block_size
+
+    def new_sequence(self):
+        return self.kv_cache.new_sequence()
+
+    def free(self, handle):
+        self.kv_cache.free(handle)
+
+    def can_append(self, handles, num_new_tokens) -> bool:
+        needed = sum(self.kv_cache.num_blocks_needed(table, n) for table, n in zip(handles, num_new_tokens))
+        return needed <= self.kv_cache.allocator.num_free_blocks
+
+    def import_kv(self, k, v):
+        return self.kv_cache.import_kv(k, v)
+
+    def forward(self, handles, tokens) -> torch.Tensor:
+        num_new_tokens = [len(t) for t in tokens]
+        caches = self.kv_cache.prepare(handles, num_new_tokens)
+        x = torch.as_tensor(list(itertools.chain(*tokens)), dtype=torch.int32, device=self.device)
+        last = torch.as_tensor(list(itertools.accumulate(num_new_tokens)), device=self.device) - 1
+        return self.model(x, caches=caches, logits_indices=last)
+
+
+def sample_tokens(logits: torch.Tensor, temperatures: list[float]) -> tuple[list[int], list[float]]:
+    """Sample one token per row of logits [batch, vocab], greedily for a temperature of 0; returns tokens and logprobs."""
+    temperatures = torch.tensor(temperatures, device=logits.device)
+    greedy = torch.argmax(logits, dim=-1)
+    probs = torch.softmax(logits.float() / temperatures.clamp(min=1e-5)[:, None], dim=-1)
+    sampled = torch.multinomial(probs, num_samples=1)[:, 0]
+    tokens = torch.where(temperatures == 0.0, greedy, sampled)
+    logprobs = torch.log_softmax(logits.float(), dim=-1).gather(1, tokens[:, None])[:, 0]
+    return tokens.tolist(), logprobs.tolist()
+
+
+@dataclass
+class Request:
+    request_id: int
+    prompt_tokens: list[int]
+    stop_tokens: list[int] = field(default_factory=list)
+    temperature: float = 1.0
+    # 0 generates until a stop token or the end of the context
+    max_tokens: int = 0
+
+
+@dataclass
+class RequestOutput:
+    request_id: int
+    token: int
+    logprob: float
+    # None while the request is running, otherwise "stop" or "length"
+    finish_reason: str | None = None
+
+
+@dataclass
+class Sequence:
+    request: Request
+    handle: Any
+    # Prompt followed by the generated tokens
+    tokens: list[int]
+    # Tokens whose keys and values are in the KV cache
+    num_computed: int = 0
+    num_generated: int = 0
+
+    @property
+    def num_pending(self) -> int:
+        return len(self.tokens) - self.num_computed
+
+
+class Engine:
+    def __init__(self, runner: ModelRunner, max_num_seqs: int = 64, max_num_tokens: int = 512):
+        self.runner = runner
+        self.max_num_seqs = max_num_seqs
+        # Token budget of one forward pass; long prompts are prefilled in chunks
+        self.max_num_tokens = max_num_tokens
+        self.waiting: deque[Sequence] = deque()
+        self.running: list[Sequence] = []
+        # Sequences outside of the queues whose KV entries may be dropped to make room, see run_pending
+        self.evictable: list[Sequence] = []
+        self.request_ids = itertools.count()
+        self.num_steps = 0
+
+    def add_request(
+        self,
+        prompt_tokens: list[int],
+        stop_tokens: list[int] | None = None,
+        temperature: float = 1.0,
+        max_tokens: int = 0,
+        kv: tuple[torch.Tensor, torch.Tensor] | None = None,
+    ) -> int:
+        """Queue a request; `kv` optionally holds the keys and values of a prefix of the prompt."""
+        assert prompt_tokens, "The prompt must not be empty"
+        assert len(prompt_tokens) < self.runner.max_context, (
+            f"Prompt of {len(prompt_tokens)} tokens does not fit in {self.runner.max_context} KV entries"
+        )
+        assert kv is None or isinstance(self.runner, KVImportRunner), (
+            f"{type(self.runner).__name__} cannot import KV state, submit the request without kv"
+        )
+        request = Request(next(self.request_ids), list(prompt_tokens), list(stop_tokens or []), temperature, max_tokens)
+        seq = Sequence(request, self.runner.new_sequence(), list(prompt_tokens))
+        if kv is not None:
+            k, v = kv
+            num_tokens = k.shape[1]
+            assert num_tokens < len(prompt_tokens), "The last prompt token must be left to compute the logits"
+            # Without room for the prefix, it is recomputed like after a preemption
+            if self.runner.can_append([seq.handle], [num_tokens]):
+                self.runner.free(seq.handle)
+                seq.handle = self.runner.import_kv(k, v)
+                seq.num_computed = num_tokens
+        self.waiting.append(seq)
+        return request.request_id
+
+    def abort(self, request_id: int) -> bool:
+        for queue in (self.running, self.waiting):
+            for seq in queue:
+                if seq.request.request_id == request_id:
+                    queue.remove(seq)
+                    self.runner.free(seq.handle)
+                    return True
+        return False
+
+    def has_unfinished(self) -> bool:
+        return bool(self.running or self.waiting)
+
+    def new_sequence(self, tokens: list[int], temperature: float = 1.0) -> Sequence:
+        """A sequence for `run_pending`, which the caller keeps and frees with `runner.free(seq.handle)`."""
+        request = Request(next(self.request_ids), list(tokens), temperature=temperature)
+        return Sequence(request, self.runner.new_sequence(), list(tokens))
+
+    def evict(self, seq: Sequence):
+        """Drop the KV entries of a sequence that is not running; they are recomputed once it is scheduled again."""
+        self.runner.free(seq.handle)
+        seq.handle = self.runner.new_sequence()
+        seq.num_computed = 0
+
+    def _preempt(self, seq: Sequence):
+        self.running.remove(seq)
+        self.evict(seq)
+        self.waiting.appendleft(seq)
+
+    def _make_room(self) -> bool:
+        """Evict an evictable sequence, or else the last waiting one holding KV entries (e.g. an imported prefix)."""
+        for seq in itertools.chain(self.evictable, reversed(self.waiting)):
+            if seq.num_computed > 0:
+                self.evict(seq)
+                return True
+        return False
+
+    def schedule(self) -> list[tuple[Sequence, int]]:
+        """Pick the sequences of the next forward pass and the number of tokens each one gets."""
+        batch: list[tuple[Sequence, int]] = []
+        budget = self.max_num_tokens
+
+        def fits(seq: Sequence, n: int) -> bool:
+            handles = [s.handle for s, _ in batch] + [seq.handle]
+            counts = [c for _, c in batch] + [n]
+            return self.runner.can_append(handles, counts)
+
+        # Running sequences first, in order of admission: decodes and the rest of chunked prefills
+        i = 0
+        while i < len(self.running) and budget > 0:
+            seq = self.running[i]
+            n = min(seq.num_pending, budget)
+            while not fits(seq, n) and self.running[-1] is not seq:
+                self._preempt(self.running[-1])
+            while not fits(seq, n) and self._make_room():
+                pass
+            if not fits(seq, n):
+                # Nothing left to preempt but the sequence itself
+                self._preempt(seq)
+                break
+            batch.append((seq, n))
+            budget -= n
+            i += 1
+
+        # Admit new (or preempted) sequences while there is room
+        while self.waiting and budget > 0 and len(self.running) < self.max_num_seqs:
+            seq = self.waiting[0]
+            n = min(seq.num_pending, budget)
+            if not fits(seq, n):
+                # With nothing running, sequences outside of it are what fills the cache
+                if not self.running and self._make_room():
+                    continue
+                break
+            self.running.append(self.waiting.popleft())
+            batch.append((seq, n))
+            budget -= n
+        return batch
+
+    def _sample(self, logits: torch.Tensor, seqs: list[Sequence]) -> tuple[list[int], list[float]]:
+        return sample_tokens(logits, [seq.request.temperature for seq in seqs])
+
+    def _finish_reason(self, seq: Sequence, token: int) -> str | None:
+        if token in seq.request.stop_tokens:
+            return "stop"
+        if seq.num_generated == seq.request.max_tokens:
+            return "length"
+        # The last token would not fit in the cache
+        if len(seq.tokens) >= self.runner.max_context:
+            return "length"
+        return None
+
+    def _forward(self, batch: list[tuple[Sequence, int]]) -> torch.Tensor:
+        logits = self.runner.forward(
+            [seq.handle for seq, _ in batch],
+            [seq.tokens[seq.num_computed : seq.num_computed + n] for seq, n in batch],
+        )
+        self.num_steps += 1
+        for seq, n in batch:
+            seq.num_computed += n
+        return logits
+
+    @torch.inference_mode()
+    def run_pending(self, seqs: list[Sequence], others: list[Sequence] = ()) -> list[torch.Tensor | OutOfBlocksError]:
+        """Feed every sequence its pending tokens; returns the logits after the last token of each.
+
+        The forward passes are planned by `schedule`, so long prompts are chunked
+        and sequences that do not fit are preempted and recomputed. If nothing
+        fits, the KV entries of `others` (the caller's sequences that are not
+        part of this call) and of the sequences that are done are dropped first.
+        A sequence that does not fit into the cache on its own gets an
+        OutOfBlocksError instead of its logits.
+        """
+        assert not self.has_unfinished(), "run_pending cannot be mixed with requests driven by step"
+        assert all(seq.num_pending > 0 for seq in seqs), "Every sequence needs a token to compute its logits"
+        results: dict[int, torch.Tensor | OutOfBlocksError] = {}
+        for seq in seqs:
+            # Evicting the others only makes progress for sequences that fit on their own
+            if len(seq.tokens) > self.runner.max_context:
+                results[id(seq)] = OutOfBlocksError(f"A sequence of {len(seq.tokens)} tokens does not fit in the KV cache")
+            else:
+                self.waiting.append(seq)
+        self.evictable = list(others)
+        try:
+            while self.has_unfinished():
+                batch = self.schedule()
+                if not batch:
+                    seq = self.waiting.popleft()
+                    results[id(seq)] = OutOfBlocksError(f"A sequence of {len(seq.tokens)} tokens does not fit in the KV cache")
+                    continue
+                logits = self._forward(batch)
+                for i, (seq, _) in enumerate(batch):
+                    if seq.num_pending == 0:
+                        self.running.remove(seq)
+                        self.evictable.append(seq)
+                        results[id(seq)] = logits[i]
+        finally:
+            self.running.clear()
+            self.waiting.clear()
+            self.evictable = []
+        return [results[id(seq)] for seq in seqs]
+
+    @torch.inference_mode()
+    def step(self) -> list[RequestOutput]:
+        batch = self.schedule()
+        if not batch:
+            return []
+        logits = self._forward(batch)
+
+        # Only sequences that consumed all their pending tokens produce a new one
+        ready = [i for i, (seq, _) in enumerate(batch) if seq.num_pending == 0]
+        if not ready:
+            return []
+        seqs = [batch[i][0] for i in ready]
+        tokens, logprobs = self._sample(logits[ready], seqs)
+
+        outputs = []
+        for seq, token, logprob in zip(seqs, tokens, logprobs):
+            seq.tokens.append(token)
+            seq.num_generated += 1
+            finish_reason = self._finish_reason(seq, token)
+            if finish_reason is not None:
+                self.running.remove(seq)
+                self.runner.free(seq.handle)
+            outputs.append(RequestOutput(seq.request.request_id, token, logprob, finish_reason))
+        return outputs
+
+
+class AsyncEngine:
+    """Asyncio front end: requests are submitted from the event loop, steps run in a worker thread."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        # The engine is only touched by the loop task between steps, so submit and abort are queued
+        self.pending: list[tuple[asyncio.Future, tuple]] = []
+        self.pending_aborts: list[int] = []
+        self.queues: dict[int, asyncio.Queue] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpt-oss-engine")
+        self.wakeup: asyncio.Event | None = None
+        self.loop_task: asyncio.Task | None = None
+
+    def _ensure_loop(self):
+        if self.loop_task is None or self.loop_task.done():
+            self.wakeup = asyncio.Event()
+            self.loop_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            for request_id in self.pending_aborts:
+                self.engine.abort(request_id)
+                self.queues.pop(request_id, None)
+            self.pending_aborts.clear()
+            for future, args in self.pending:
+                try:
+                    request_id = self.engine.add_request(*args)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                self.queues[request_id] = asyncio.Queue()
+                future.set_result(request_id)
+            self.pending.clear()
+
+            if not self.engine.has_unfinished():
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            try:
+                outputs = await loop.run_in_executor(self.executor, self.engine.step)
+            except Exception as e:
+                # Fail every request in flight rather than leaving the streams hanging
+                for request_id, queue in self.queues.items():
+                    queue.put_nowait(e)
+                    self.engine.abort(request_id)
+                self.queues.clear()
+                continue
+            for output in outputs:
+                queue = self.queues.get(output.request_id)
+                if queue is None:
+                    continue
+                queue.put_nowait(output)
+                if output.finish_reason is not None:
+                    del self.queues[output.request_id]
+
+    async def submit(
+        self,
+        prompt_tokens: list[int],
+        stop_tokens: list[int] | None = None,
+        temperature: float = 1.0,
+        max_tokens: int = 0,
+    ) -> int:
+        """Queue a request for the next step; returns its id, to be passed to `stream`."""
+        self._ensure_loop()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((future, (prompt_tokens, stop_tokens, temperature, max_tokens)))
+        self.wakeup.set()
+        return await future
+
+    async def stream(self, request_id: int) -> AsyncIterator[RequestOutput]:
+        queue = self.queues[request_id]
+        finished = False
+        try:
+            while not finished:
+                output = await queue.get()
+                if isinstance(output, Exception):
+                    raise output
+                finished = output.finish_reason is not None
+                yield output
+        finally:
+            if not finished:
+                # The consumer went away, stop generating for it
+                self.pending_aborts.append(request_id)
+                self.wakeup.set()
+
+    async def generate(
+        self,
+        prompt_tokens: list[int],
+        stop_tokens: list[int] | None = None,
+        temperature: float = 1.0,
+        max_tokens: int = 0,
+    ) -> AsyncIterator[int]:
+        request_id = await self.submit(prompt_tokens, stop_tokens, temperature, max_tokens)
+        async for output in self.stream(request_id):
+            yield output.token
+
+    async def close(self):
+        if self.loop_task is not None:
+            self.loop_task.cancel()
+            try:
+                await self.loop_task
+            except asyncio.CancelledError:
+                pass
+            self.loop_task = None
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,104 @@
+"""Residency manager for MoE expert weights.
+
+Only a byte-budgeted working set of experts is kept in fast memory. Cold
+experts stay in their cold tier (the mmapped checkpoint, or tensors on a slower
+device) and are loaded on demand when the router selects them.
+"""
+
+from collections import OrderedDict
+from typing import Callable
+
+import torch
+
+# (layer_idx, expert_idx) -> (mlp1_weight, mlp1_bias, mlp2_weight, mlp2_bias)
+ExpertWeights = tuple[torch.Tensor, ...]
+ExpertLoader = Callable[[int, int], ExpertWeights]
+
+
+class ExpertCache:
+    def __init__(self, load_fn: ExpertLoader, budget_bytes: int, policy: str = "lru"):
+        assert policy in ("lru", "lfu"), f"Invalid expert cache policy: {policy}"
+        self.load_fn = load_fn
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        # Ordered from least to most recently used
+        self.experts: OrderedDict[tuple[int, int], ExpertWeights] = OrderedDict()
+        self.access_counts: dict[tuple[int, int], int] = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loaded_bytes = 0
+
+    def _evict_one(self):
+        if self.policy == "lru":
+            key = next(iter(self.experts))
+        else:
+            # Least frequently used, ties broken by recency
+            key = min(self.experts, key=lambda k: self.access_counts.get(k, 0))
+        weights = self.experts.pop(key)
+        self.resident_bytes -= sum(t.nbytes for t in weights)
+
+    def _load(self, key: tuple[int, int]) -> ExpertWeights:
+        weights = self.load_fn(*key)
+        nbytes = sum(t.nbytes for t in weights)
+        while self.experts and self.resident_bytes + nbytes > self.budget_bytes:
+            self._evict_one()
+        self.experts[key] = weights
+        self.resident_bytes += nbytes
+        self.loaded_bytes += nbytes
+        return weights
+
+    def get(self, layer_idx: int, expert_idx: int) -> ExpertWeights:
+        key = (layer_idx, expert_idx)
+        self.access_counts[key] = self.access_counts.get(key, 0) + 1
+        if key in self.experts:
+            self.hits += 1
+            self.experts.move_to_end(key)
+            return self.experts[key]
+        self.misses += 1
+        return self._load(key)
+
+    def prefetch(self, layer_idx: int, experts: list[int]):
+        """Make experts resident ahead of use, without counting them as accesses."""
+        for expert_idx in experts:
+            key = (layer_idx, expert_idx)
+            if key not in self.experts:
+                self._load(key)
+
+    def warmup(self, expert_counts: torch.Tensor):
+        """Load the experts with the highest router selection counts until the budget is full.
+
+        `expert_counts` has shape [num_layers, num_experts], e.g. aggregated
+        router statistics of representative traffic.
+        """
+        num_experts = expert_counts.shape[1]
+        counts = expert_counts.flatten().tolist()
+        expert_bytes = 0
+        warmed = []
+        for flat_idx in sorted(range(len(counts)), key=lambda i: -counts[i]):
+            if counts[flat_idx] == 0:
+                break
+            key = divmod(flat_idx, num_experts)
+            # Seed the frequencies so that LFU keeps the warmed experts
+            self.access_counts[key] = self.access_counts.get(key, 0) + int(counts[flat_idx])
+            if key in self.experts:
+                continue
+            # Stop before the next expert would evict one of the hotter ones
+            if self.experts and self.resident_bytes + expert_bytes > self.budget_bytes:
+                break
+            expert_bytes = sum(t.nbytes for t in self._load(key))
+            warmed.append(key)
+        # Hottest experts become the most recently used ones
+        for key in reversed(warmed):
+            if key in self.experts:
+                self.experts.move_to_end(key)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / max(1, self.hits + self.misses),
+            "resident_experts": len(self.experts),
+            "resident_bytes": self.resident_bytes,
+            "loaded_bytes": self.loaded_bytes,
+        }
@@ -0,0 +1,202 @@
+"""Reduced-expert fast mode: run the MoE blocks with fewer experts per token.
+
+The number of experts can be lowered globally or per layer; the gate weights
+of the selected experts are renormalized by the softmax over the top-k logits
+in both the torch and the triton MoE implementations.
+
+The harness in this module compares a reduced setting against the full model
+on a prompt set, reporting the throughput gain and the divergence of the
+next-token distributions:
+
+python -m gpt_oss.torch.fast_mode --experts-per-token 2 --prompts prompts.txt gpt-oss-20b/original/
+"""
+
+import argparse
+import time
+from contextlib import contextmanager
+
+import torch
+
+ExpertsPerToken = int | list[int] | None
+
+
+def parse_experts_per_token(value: str) -> int | list[int]:
+    """Parse "2" (all layers) or "4,4,2,2,..." (one value per layer)."""
+    values = [int(v) for v in value.split(",")]
+    return values[0] if len(values) == 1 else values
+
+
+def expand_experts_per_token(model: torch.nn.Module, experts_per_token: ExpertsPerToken) -> list[int]:
+    """Per-layer top-k of a setting, checked against the model; None is the config value."""
+    num_layers = len(model.block)
+    if experts_per_token is None:
+        experts_per_token = model.config.experts_per_token
+    if isinstance(experts_per_token, int):
+        experts_per_token = [experts_per_token] * num_layers
+    assert len(experts_per_token) == num_layers, (
+        f"Expected {num_layers} per-layer values, got {len(experts_per_token)}"
+    )
+    for k in experts_per_token:
+        assert 1 <= k <= model.config.num_experts, f"Invalid number of experts per token: {k}"
+    return experts_per_token
+
+
+def set_experts_per_token(model: torch.nn.Module, experts_per_token: ExpertsPerToken):
+    """Set top-k for every MoE block of a torch or triton Transformer; None restores the config value."""
+    for block, k in zip(model.block, expand_experts_per_token(model, experts_per_token)):
+        block.mlp.experts_per_token = k
+
+
+def get_experts_per_token(model: torch.nn.Module) -> list[int]:
+    return [block.mlp.experts_per_token for block in model.block]
+
+
+@contextmanager
+def experts_per_token_override(model: torch.nn.Module, experts_per_token: ExpertsPerToken):
+    """Run the forward passes of the block with a top-k setting, None keeps the current one.
+
+    The model is shared by all sessions of a generator, so a setting is only
+    applied around the forward passes of the request that asked for it.
+    """
+    if experts_per_token is None:
+        yield
+        return
+    original = get_experts_per_token(model)
+    set_experts_per_token(model, experts_per_token)
+    try:
+        yield
+    finally:
+        set_experts_per_token(model, original)
+
+
+def _forward_logits(model: torch.nn.Module, tokens: torch.Tensor, batched: bool) -> torch.Tensor:
+    # The triton model takes a batch dimension, the torch model a flat token stream
+    if batched:
+        return model(tokens[None, :])[0].float()
+    return model(tokens).float()
+
+
+def _timed_logits(model, prompts: list[torch.Tensor], batched: bool) -> tuple[list[torch.Tensor], float]:
+    if prompts[0].device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    logits = [_forward_logits(model, tokens, batched) for tokens in prompts]
+    if prompts[0].device.type == "cuda":
+        torch.cuda.synchronize()
+    return logits, time.perf_counter() - start
+
+
+@torch.inference_mode()
+def evaluate_fast_mode(
+    model: torch.nn.Module,
+    prompts: list[list[int]],
+    experts_per_token: int | list[int],
+    device: torch.device,
+    batched: bool = False,
+) -> dict[str, float]:
+    """Compare a reduced top-k setting against the full model with teacher-forced forward passes."""
+    prompts = [torch.as_tensor(p, dtype=torch.int32, device=device) for p in prompts]
+    num_tokens = sum(len(p) for p in prompts)
+    original = get_experts_per_token(model)
+    try:
+        # Warm up both settings so that one-time costs are not attributed to either
+        _forward_logits(model, prompts[0], batched)
+        full_logits, full_time = _timed_logits(model, prompts, batched)
+        set_experts_per_token(model, experts_per_token)
+        _forward_logits(model, prompts[0], batched)
+        fast_logits, fast_time = _timed_logits(model, prompts, batched)
+    finally:
+        set_experts_per_token(model, original)
+
+    kl_sum, top1_agree, max_abs_diff = 0.0, 0, 0.0
+    for full, fast in zip(full_logits, fast_logits):
+        full_logprobs = torch.log_softmax(full, dim=-1)
+        fast_logprobs = torch.log_softmax(fast, dim=-1)
+        kl = (full_logprobs.exp() * (full_logprobs - fast_logprobs)).sum(dim=-1)
+        kl_sum += kl.sum().item()
+        top1_agree += (full.argmax(dim=-1) == fast.argmax(dim=-1)).sum().item()
+        max_abs_diff = max(max_abs_diff, (full - fast).abs().max().item())
+
+    return {
+        "num_prompts": len(prompts),
+        "num_tokens": num_tokens,
+        "full_tokens_per_second": num_tokens / full_time,
+        "fast_tokens_per_second": num_tokens / fast_time,
+        "speedup": full_time / fast_time,
+        "mean_kl_divergence": kl_sum / num_tokens,
+        "top1_agreement": top1_agree / num_tokens,
+        "max_abs_logit_diff": max_abs_diff,
+    }
+
+
+def main(args):
+    from gpt_oss.tokenizer import get_tokenizer
+
+    match args.backend:
+        case "torch":
+            from gpt_oss.torch.model import Transformer
+            device = torch.device(args.device)
+            model = Transformer.from_checkpoint(args.checkpoint, device=device)
+        case "triton":
+            from gpt_oss.triton.model import Transformer
+            device = torch.device(args.device)
+            model = Transformer.from_checkpoint(args.checkpoint, device=device)
+        case _:
+            raise ValueError(f"Invalid backend: {args.backend}")
+
+    tokenizer = get_tokenizer()
+    with open(args.prompts, "r") as f:
+        prompts = [tokenizer.encode(line.strip()) for line in f if line.strip()]
+
+    results = evaluate_fast_mode(
+        model,
+        prompts,
+        parse_experts_per_token(args.experts_per_token),
+        device,
+        batched=args.backend == "triton",
+    )
+    for key, value in results.items():
+        print(f"{key:>24}: {value:.4f}" if isinstance(value, float) else f"{key:>24}: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reduced-expert fast mode evaluation")
+    parser.add_argument(
+        "checkpoint",
+        metavar="FILE",
+        type=str,
+        help="Path to the SafeTensors checkpoint",
+    )
+    parser.add_argument(
+        "--prompts",
+        metavar="FILE",
+        type=str,
+        required=True,
+        help="Text file with one prompt per line",
+    )
+    parser.add_argument(
+        "-k",
+        "--experts-per-token",
+        metavar="K",
+        type=str,
+        default="2",
+        help="Experts per token, either one value or a comma-separated value per layer",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        metavar="BACKEND",
+        type=str,
+        default="torch",
+        choices=["triton", "torch"],
+        help="Inference backend",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda",
+        help="Device to run the model on",
+    )
+    args = parser.parse_args()
+
+    main(args)
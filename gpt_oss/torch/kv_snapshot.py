@@ -0,0 +1,140 @@
+"""KV state snapshots: the keys and values of a token prefix, saved to disk.
+
+A snapshot is a safetensors file with the tensors `tokens` [n], `k` and `v`
+[num_layers, n, num_kv_heads, head_dim], and the model config and a SHA-256
+checksum of the tensors in its metadata. The layout does not depend on the
+cache implementation, so a snapshot written by the torch generator can be
+restored into the triton generator and vice versa. The same bytes are used to
+hand prefilled KV state from one process to another, see
+`gpt_oss.torch.disaggregation`.
+"""
+
+import dataclasses
+import hashlib
+import json
+import struct
+from dataclasses import dataclass
+from typing import Callable
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load, save, save_file
+
+from gpt_oss.torch.model import ModelConfig
+from gpt_oss.torch.weights import get_mapped_tensor, map_safetensors
+
+FORMAT = "gpt_oss_kv_snapshot"
+VERSION = "1"
+
+
+class SnapshotMismatchError(ValueError):
+    pass
+
+
+@dataclass
+class KVSnapshot:
+    config: ModelConfig
+    tokens: list[int]
+    k: torch.Tensor
+    v: torch.Tensor
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.tokens)
+
+
+def _checksum(tensors: dict[str, torch.Tensor]) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(tensors):
+        digest.update(name.encode())
+        tensor = tensors[name].detach().contiguous().cpu()
+        digest.update(tensor.flatten().view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _serialize(snapshot: KVSnapshot) -> tuple[dict[str, torch.Tensor], dict[str, str]]:
+    num_layers, num_tokens, *_ = snapshot.k.shape
+    assert snapshot.k.shape == snapshot.v.shape
+    assert num_layers == snapshot.config.num_hidden_layers
+    assert num_tokens == snapshot.num_tokens
+    tensors = {
+        "tokens": torch.as_tensor(snapshot.tokens, dtype=torch.int64),
+        "k": snapshot.k.contiguous().cpu(),
+        "v": snapshot.v.contiguous().cpu(),
+    }
+    metadata = {
+        "format": FORMAT,
+        "version": VERSION,
+        "config": json.dumps(dataclasses.asdict(snapshot.config)),
+        "checksum": _checksum(tensors),
+    }
+    return tensors, metadata
+
+
+def _deserialize(
+    name: str,
+    metadata: dict[str, str],
+    get_tensor: Callable[[str], torch.Tensor],
+    config: ModelConfig | None,
+    verify: bool,
+) -> KVSnapshot:
+    if metadata.get("format") != FORMAT:
+        raise SnapshotMismatchError(f"{name} is not a KV snapshot")
+    if metadata.get("version") != VERSION:
+        raise SnapshotMismatchError(f"Unsupported KV snapshot version {metadata.get('version')}")
+    snapshot_config = ModelConfig(**json.loads(metadata["config"]))
+    if config is not None and snapshot_config != config:
+        raise SnapshotMismatchError(f"{name} was saved for a different model config")
+    tensors = {tensor_name: get_tensor(tensor_name) for tensor_name in ("tokens", "k", "v")}
+    if verify and _checksum(tensors) != metadata["checksum"]:
+        raise SnapshotMismatchError(f"Checksum mismatch in {name}")
+    return KVSnapshot(snapshot_config, tensors["tokens"].tolist(), tensors["k"], tensors["v"])
+
+
+def save_kv_snapshot(path: str, snapshot: KVSnapshot):
+    tensors, metadata = _serialize(snapshot)
+    save_file(tensors, path, metadata=metadata)
+
+
+def load_kv_snapshot(
+    path: str,
+    device: torch.device | str = "cpu",
+    config: ModelConfig | None = None,
+    verify: bool = True,
+) -> KVSnapshot:
+    """Load a snapshot, checking that it was produced by a model with the given config."""
+    if torch.device(device).type == "cpu":
+        # The keys and values are views into the mapped file rather than copies
+        mapped_file = map_safetensors(path)
+        metadata = mapped_file[1].get("__metadata__", {})
+        return _deserialize(path, metadata, lambda name: get_mapped_tensor(mapped_file, name), config, verify)
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        return _deserialize(path, f.metadata() or {}, f.get_tensor, config, verify)
+
+
+def kv_snapshot_to_bytes(snapshot: KVSnapshot) -> bytes:
+    """The snapshot file as bytes, e.g. to hand KV state to another process."""
+    tensors, metadata = _serialize(snapshot)
+    return save(tensors, metadata=metadata)
+
+
+def kv_snapshot_from_bytes(
+    data: bytes,
+    device: torch.device | str = "cpu",
+    config: ModelConfig | None = None,
+    verify: bool = True,
+) -> KVSnapshot:
+    (header_size,) = struct.unpack("<Q", data[:8])
+    metadata = json.loads(data[8 : 8 + header_size]).get("__metadata__", {})
+    tensors = load(data)
+    snapshot = _deserialize("KV snapshot data", metadata, tensors.__getitem__, config, verify)
+    return dataclasses.replace(snapshot, k=snapshot.k.to(device), v=snapshot.v.to(device))
+
+
+def common_prefix_length(a: list[int], b: list[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
@@ -0,0 +1,294 @@
+"""Memory footprint estimates and measured peak memory per generation phase.
+
+`estimate_memory` predicts the device memory of a model config, context
+length and batch size for the torch or triton backend, broken down into
+weights, KV cache, rope tables and the activations of one prefill chunk:
+
+python -m gpt_oss.torch.memory gpt-oss-120b/original/ --backend triton --context 32768 --batch-size 4
+
+`MemoryTracker` records the actual memory per phase (load, prefill, decode)
+in the token generators, so that the estimate can be validated.
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+from contextlib import contextmanager
+
+import torch
+
+from gpt_oss.torch.model import ModelConfig
+
+BF16 = 2
+FP32 = 4
+MXFP4_BLOCK_SIZE = 32
+
+
+def _dense_weight_bytes(config: ModelConfig, world_size: int) -> dict[str, int]:
+    hidden, head_dim = config.hidden_size, config.head_dim
+    qkv_dim = head_dim * (config.num_attention_heads + 2 * config.num_key_value_heads)
+    per_layer_attn = (
+        hidden * FP32  # norm
+        + (hidden * qkv_dim + qkv_dim) * BF16  # qkv
+        + config.num_attention_heads * BF16  # sinks
+        + (config.num_attention_heads * head_dim * hidden + hidden) * BF16  # out
+    )
+    per_layer_mlp = (
+        hidden * FP32  # norm
+        + (hidden * config.num_experts + config.num_experts) * BF16  # gate
+        + config.num_experts * (2 * config.intermediate_size // world_size + hidden) * BF16  # expert biases
+    )
+    return {
+        "embedding": config.vocab_size * hidden * BF16,
+        "unembedding": config.vocab_size * hidden * BF16,
+        "attention": config.num_hidden_layers * per_layer_attn + hidden * FP32,
+        "mlp_dense": config.num_hidden_layers * per_layer_mlp,
+    }
+
+
+def expert_values(config: ModelConfig, world_size: int = 1) -> int:
+    """Number of MoE weight values over all layers (mlp1 and mlp2), per tensor-parallel rank."""
+    per_expert = 3 * config.intermediate_size * config.hidden_size // world_size
+    return config.num_hidden_layers * config.num_experts * per_expert
+
+
+def kv_bytes_per_token(config: ModelConfig, dtype_bytes: int = BF16) -> int:
+    """KV cache bytes for one token in one layer (keys and values)."""
+    return 2 * config.num_key_value_heads * config.head_dim * dtype_bytes
+
+
+def _activation_bytes(config: ModelConfig, backend: str, tokens: int, num_keys: int, world_size: int) -> int:
+    # Peak of one block plus the logits; activations of earlier blocks are freed
+    hidden, head_dim = config.hidden_size, config.head_dim
+    heads, kv_heads = config.num_attention_heads, config.num_key_value_heads
+    qkv = tokens * head_dim * (heads + 2 * kv_heads) * BF16
+    residual = 3 * tokens * hidden * BF16
+    k = config.experts_per_token
+    intermediate = config.intermediate_size // world_size
+    if backend == "torch":
+        # sdpa materializes the scores, mask and softmax; the MLP gathers the selected expert weights per token
+        attention = 3 * heads * tokens * num_keys * BF16 + tokens * num_keys * BF16
+        rope = 2 * tokens * head_dim // 2 * FP32
+        mlp = tokens * k * 3 * intermediate * hidden * BF16 + tokens * k * 2 * intermediate * BF16
+        logits = tokens * config.vocab_size * BF16
+    else:
+        # The flash kernel repeats K and V for every query head; the MoE keeps per-expert rows
+        attention = 2 * num_keys * heads * head_dim * BF16 + 2 * tokens * heads * head_dim * BF16
+        rope = 2 * tokens * head_dim // 2 * FP32
+        mlp = tokens * k * (intermediate + hidden) * BF16
+        logits = tokens * config.vocab_size * (BF16 + FP32)
+    return residual + qkv + rope + max(attention, mlp) + logits
+
+
+def estimate_memory(
+    config: ModelConfig,
+    backend: str = "triton",
+    context: int = 4096,
+    batch_size: int = 1,
+    prefill_chunk: int | None = None,
+    world_size: int = 1,
+    block_size: int = 16,
+    expert_cache_bytes: int | None = None,
+    streaming_capacity: int | None = None,
+) -> dict[str, int]:
+    """Estimated device memory in bytes per component, plus the total.
+
+    `streaming_capacity` is the number of KV entries per sequence in streaming
+    mode (see `gpt_oss.torch.streaming`).
+    """
+    assert backend in ("torch", "triton"), f"Invalid backend: {backend}"
+    if backend == "triton":
+        # The triton model is not tensor parallel
+        world_size = 1
+        # In streaming mode its caches only hold the sinks and the window
+        if streaming_capacity is not None:
+            context = min(context, streaming_capacity)
+    estimate = _dense_weight_bytes(config, world_size)
+
+    values = expert_values(config, world_size)
+    if backend == "torch":
+        # Experts are dequantized to bf16 at load time
+        expert_bytes = values * BF16
+        if expert_cache_bytes is not None:
+            expert_bytes = min(expert_bytes, expert_cache_bytes)
+    else:
+        # Experts stay in MXFP4: half a byte per value plus one scale byte per block
+        expert_bytes = values // 2 + values // MXFP4_BLOCK_SIZE
+    estimate["experts"] = expert_bytes
+
+    if backend == "torch":
+        # One paged pool shared by all sequences
+        kv_tokens = math.ceil(context * batch_size / block_size) * block_size
+    else:
+        kv_tokens = context * batch_size
+    estimate["kv_cache"] = config.num_hidden_layers * kv_tokens * kv_bytes_per_token(config)
+    if streaming_capacity is not None:
+        # Keys are kept in float32 as well, for the re-rotation on eviction; the torch
+        # model has streaming caches next to its paged pool
+        streaming_tokens = config.num_hidden_layers * batch_size * min(context, streaming_capacity)
+        kv_entry_values = config.num_key_value_heads * config.head_dim
+        streaming_bytes = kv_entry_values * (FP32 if backend == "triton" else FP32 + BF16)
+        estimate["streaming_kv_cache"] = streaming_tokens * streaming_bytes
+    # The triton model shares one cos/sin table between all layers, sized to the cache
+    estimate["rope_tables"] = 2 * context * config.head_dim // 2 * FP32 if backend == "triton" else 0
+
+    chunk = min(prefill_chunk or context, context)
+    # The torch model runs one sequence at a time
+    tokens = chunk if backend == "torch" else chunk * batch_size
+    estimate["activations"] = _activation_bytes(config, backend, tokens, context, world_size)
+    estimate["total"] = sum(estimate.values())
+    return estimate
+
+
+def sliding_kv_cache_bytes(config: ModelConfig, context: int, batch_size: int = 1) -> int:
+    """KV cache that is actually live when sliding-window layers only keep their window."""
+    total = 0
+    for layer_idx in range(config.num_hidden_layers):
+        # Sliding window on every other layer, starting with the first one
+        tokens = min(context, config.sliding_window) if layer_idx % 2 == 0 else context
+        total += tokens * batch_size * kv_bytes_per_token(config)
+    return total
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(num_bytes) < 1024 or unit == "GiB":
+            return f"{num_bytes:.2f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+
+def current_rss() -> int | None:
+    """Resident set size of the process in bytes, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class MemoryTracker:
+    """Memory per phase: peak allocated device memory on CUDA, the RSS after the phase and its growth on CPU.
+
+    The CPU numbers are sampled at the start and end of the phase, the kernel
+    only tracks the peak over the lifetime of the process.
+    """
+
+    def __init__(self, device: torch.device):
+        self.device = device
+        self.phases: dict[str, dict[str, int]] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        is_cuda = self.device.type == "cuda"
+        if is_cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        rss_start = None if is_cuda else current_rss()
+        try:
+            yield
+        finally:
+            if is_cuda:
+                stats = {
+                    "peak_allocated": torch.cuda.max_memory_allocated(self.device),
+                    "peak_reserved": torch.cuda.max_memory_reserved(self.device),
+                }
+            elif rss_start is not None:
+                rss = current_rss()
+                stats = {"rss": rss, "rss_growth": rss - rss_start}
+            else:
+                # ru_maxrss is in KiB on Linux and only ever grows, so it is not specific to the phase
+                stats = {"lifetime_peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+            previous = self.phases.get(name, {})
+            self.phases[name] = {k: max(v, previous.get(k, 0)) for k, v in stats.items()}
+
+    def report(self) -> str:
+        lines = []
+        for name, stats in self.phases.items():
+            values = ", ".join(f"{k}={format_bytes(v)}" for k, v in stats.items())
+            lines.append(f"{name:>8}: {values}")
+        return "\n".join(lines)
+
+
+def load_config(path: str) -> ModelConfig:
+    if os.path.isdir(path):
+        path = os.path.join(path, "config.json")
+    with open(path, "r") as f:
+        return ModelConfig(**json.load(f))
+
+
+def main(args):
+    config = load_config(args.checkpoint)
+    expert_cache_bytes = None if args.expert_cache_gb is None else int(args.expert_cache_gb * 2**30)
+    estimate = estimate_memory(
+        config,
+        backend=args.backend,
+        context=args.context,
+        batch_size=args.batch_size,
+        prefill_chunk=args.prefill_chunk,
+        world_size=args.world_size,
+        expert_cache_bytes=expert_cache_bytes,
+    )
+    if args.json:
+        print(json.dumps(estimate, indent=2))
+        return
+    for name, num_bytes in estimate.items():
+        print(f"{name:>12}: {format_bytes(num_bytes)}")
+    print(f"KV cache per token and layer: {format_bytes(kv_bytes_per_token(config))}")
+    print(f"KV cache with sliding layers trimmed to the window: {format_bytes(sliding_kv_cache_bytes(config, args.context, args.batch_size))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the device memory needed to serve a model")
+    parser.add_argument(
+        "checkpoint",
+        metavar="PATH",
+        type=str,
+        help="Checkpoint directory or config.json",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        default="triton",
+        choices=["triton", "torch"],
+        help="Inference backend",
+    )
+    parser.add_argument(
+        "--context",
+        type=int,
+        default=4096,
+        help="Context length per sequence",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of concurrent sequences",
+    )
+    parser.add_argument(
+        "--prefill-chunk",
+        type=int,
+        default=None,
+        help="Tokens per prefill forward pass (default: the whole context)",
+    )
+    parser.add_argument(
+        "--world-size",
+        type=int,
+        default=1,
+        help="Tensor parallel ranks (torch backend)",
+    )
+    parser.add_argument(
+        "--expert-cache-gb",
+        type=float,
+        default=None,
+        help="Expert cache budget in GiB (torch backend)",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the estimate as JSON, in bytes",
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -6,7 +6,10 @@ from dataclasses import dataclass
 import torch
 import torch.distributed as dist
 
-from gpt_oss.torch.weights import Checkpoint
+from gpt_oss.torch.profiling import region
+from gpt_oss.torch.weights import Checkpoint, assign_parameter
+
+EXPERT_PARAM_NAMES = ("mlp1_weight", "mlp1_bias", "mlp2_weight", "mlp2_bias")
 
 
 @dataclass
@@ -122,9 +125,12 @@ class RotaryEmbedding(torch.nn.Module):
 
         return concentration, inv_freq
 
-    def _compute_cos_sin(self, num_tokens: int):
+    def _compute_cos_sin(self, num_tokens: int, positions: torch.Tensor | None = None):
         concentration, inv_freq = self._compute_concentration_and_inv_freq()
-        t = torch.arange(num_tokens, dtype=torch.float32, device=self.device)
+        if positions is None:
+            t = torch.arange(num_tokens, dtype=torch.float32, device=self.device)
+        else:
+            t = positions.to(device=inv_freq.device, dtype=torch.float32)
         freqs = torch.einsum("i,j->ij", t, inv_freq)
         cos = freqs.cos() * concentration
         sin = freqs.sin() * concentration
@@ -134,9 +140,10 @@ class RotaryEmbedding(torch.nn.Module):
         self,
         query: torch.Tensor,
         key: torch.Tensor,
+        positions: torch.Tensor | None = None,
     ) -> tuple[torch.Tensor, torch.Tensor]:
         num_tokens = query.shape[0]
-        cos, sin = self._compute_cos_sin(num_tokens)
+        cos, sin = self._compute_cos_sin(num_tokens, positions)
 
         query_shape = query.shape
         query = query.view(num_tokens, -1, self.head_dim)
@@ -150,19 +157,11 @@ class RotaryEmbedding(torch.nn.Module):
         return query, key
 
 
-def sdpa(Q, K, V, S, sm_scale, sliding_window=0):
-    # sliding_window == 0 means no sliding window
+def _masked_attention(Q, K, V, S, sm_scale, mask):
     n_tokens, n_heads, q_mult, d_head = Q.shape
-    assert K.shape == (n_tokens, n_heads, d_head)
-    assert V.shape == (n_tokens, n_heads, d_head)
     K = K[:, :, None, :].expand(-1, -1, q_mult, -1)
     V = V[:, :, None, :].expand(-1, -1, q_mult, -1)
     S = S.reshape(n_heads, q_mult, 1, 1).expand(-1, -1, n_tokens, -1)
-    mask = torch.triu(Q.new_full((n_tokens, n_tokens), -float("inf")), diagonal=1)
-    if sliding_window > 0:
-        mask += torch.tril(
-            mask.new_full((n_tokens, n_tokens), -float("inf")), diagonal=-sliding_window
-        )
     QK = torch.einsum("qhmd,khmd->hmqk", Q, K)
     QK *= sm_scale
     QK += mask[None, None, :, :]
@@ -173,6 +172,52 @@ def sdpa(Q, K, V, S, sm_scale, sliding_window=0):
     return attn.reshape(n_tokens, -1)
 
 
+def sdpa(Q, K, V, S, sm_scale, sliding_window=0, offset=0):
+    # sliding_window == 0 means no sliding window
+    # offset is the position of the first query relative to the first key, so
+    # K and V hold offset + n_tokens entries when attending over cached keys
+    n_tokens, n_heads, q_mult, d_head = Q.shape
+    n_keys = offset + n_tokens
+    assert K.shape == (n_keys, n_heads, d_head)
+    assert V.shape == (n_keys, n_heads, d_head)
+    mask = torch.triu(Q.new_full((n_tokens, n_keys), -float("inf")), diagonal=offset + 1)
+    if sliding_window > 0:
+        mask += torch.tril(
+            mask.new_full((n_tokens, n_keys), -float("inf")),
+            diagonal=offset - sliding_window,
+        )
+    return _masked_attention(Q, K, V, S, sm_scale, mask)
+
+
+def packed_sdpa(Q, K, V, S, sm_scale, seq_lens: list[int], sliding_window=0):
+    # Several sequences concatenated along the token dimension, each one starting
+    # at position 0: tokens only attend to earlier tokens of their own sequence,
+    # so each sequence is attended separately and the cost grows with the sum of
+    # the squared lengths rather than the square of the total
+    n_tokens, n_heads, q_mult, d_head = Q.shape
+    assert K.shape == (n_tokens, n_heads, d_head)
+    assert V.shape == (n_tokens, n_heads, d_head)
+    assert sum(seq_lens) == n_tokens
+    return torch.cat([
+        sdpa(q, k, v, S, sm_scale, sliding_window)
+        for q, k, v in zip(Q.split(seq_lens), K.split(seq_lens), V.split(seq_lens))
+    ])
+
+
+class PackedSequences:
+    """Stands in for the per-layer caches to run several sequences through the model without a KV cache."""
+
+    def __init__(self, seq_lens: list[int], device: torch.device | None = None):
+        self.seq_lens = list(seq_lens)
+        # Positions restart at 0 for every sequence
+        self.positions = torch.cat(
+            [torch.arange(n, dtype=torch.long, device=device) for n in self.seq_lens]
+        )
+
+    def attention(self, q, k, v, sinks, sm_scale, sliding_window=0):
+        return packed_sdpa(q, k, v, sinks, sm_scale, self.seq_lens, sliding_window)
+
+
 class AttentionBlock(torch.nn.Module):
     def __init__(
         self,
@@ -214,34 +259,43 @@ class AttentionBlock(torch.nn.Module):
             device=device,
         )
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        t = self.norm(x)
-        qkv = self.qkv(t)
-        q = qkv[:, : self.num_attention_heads * self.head_dim].contiguous()
-        k = qkv[
-            :,
-            self.num_attention_heads
-            * self.head_dim : (self.num_attention_heads + self.num_key_value_heads)
-            * self.head_dim,
-        ].contiguous()
-        v = qkv[
-            :,
-            (self.num_attention_heads + self.num_key_value_heads)
-            * self.head_dim : (self.num_attention_heads + 2 * self.num_key_value_heads)
-            * self.head_dim,
-        ].contiguous()
-
-        q = q.view(
-            -1,
-            self.num_key_value_heads,
-            self.num_attention_heads // self.num_key_value_heads,
-            self.head_dim,
-        )
-        k = k.view(-1, self.num_key_value_heads, self.head_dim)
-        v = v.view(-1, self.num_key_value_heads, self.head_dim)
-        q, k = self.rope(q, k)
-        t = sdpa(q, k, v, self.sinks, self.sm_scale, self.sliding_window)
-        t = self.out(t)
+    @region("attn")
+    def forward(self, x: torch.Tensor, cache=None) -> torch.Tensor:
+        with region("qkv"):
+            t = self.norm(x)
+            qkv = self.qkv(t)
+            q = qkv[:, : self.num_attention_heads * self.head_dim].contiguous()
+            k = qkv[
+                :,
+                self.num_attention_heads
+                * self.head_dim : (self.num_attention_heads + self.num_key_value_heads)
+                * self.head_dim,
+            ].contiguous()
+            v = qkv[
+                :,
+                (self.num_attention_heads + self.num_key_value_heads)
+                * self.head_dim : (self.num_attention_heads + 2 * self.num_key_value_heads)
+                * self.head_dim,
+            ].contiguous()
+
+            q = q.view(
+                -1,
+                self.num_key_value_heads,
+                self.num_attention_heads // self.num_key_value_heads,
+                self.head_dim,
+            )
+            k = k.view(-1, self.num_key_value_heads, self.head_dim)
+            v = v.view(-1, self.num_key_value_heads, self.head_dim)
+        with region("rope"):
+            positions = cache.positions if cache is not None else None
+            q, k = self.rope(q, k, positions=positions)
+        with region("attn_kernel"):
+            if cache is not None:
+                t = cache.attention(q, k, v, self.sinks, self.sm_scale, self.sliding_window)
+            else:
+                t = sdpa(q, k, v, self.sinks, self.sm_scale, self.sliding_window)
+        with region("c_proj"):
+            t = self.out(t)
         t = x + t
         return t
 
@@ -260,9 +314,12 @@ class MLPBlock(torch.nn.Module):
     def __init__(
         self,
         config: ModelConfig,
+        layer_idx: int = 0,
         device: torch.device | None = None,
+        offload_experts: bool = False,
     ):
         super().__init__()
+        self.layer_idx = layer_idx
         self.num_experts = config.num_experts
         self.experts_per_token = config.experts_per_token
         self.swiglu_limit = config.swiglu_limit
@@ -272,6 +329,10 @@ class MLPBlock(torch.nn.Module):
             config.hidden_size, config.num_experts, device=device, dtype=torch.bfloat16
         )
         assert config.intermediate_size % self.world_size == 0
+        # Offloaded experts are not materialized, they are served by an ExpertCache
+        self.expert_cache = None
+        self.telemetry = None
+        expert_device = torch.device("meta") if offload_experts else device
         self.mlp1_weight = torch.nn.Parameter(
             torch.empty(
                 (
@@ -279,14 +340,14 @@ class MLPBlock(torch.nn.Module):
                     config.intermediate_size * 2 // self.world_size,
                     config.hidden_size,
                 ),
-                device=device,
+                device=expert_device,
                 dtype=torch.bfloat16,
             )
         )
         self.mlp1_bias = torch.nn.Parameter(
             torch.empty(
                 (config.num_experts, config.intermediate_size * 2 // self.world_size),
-                device=device,
+                device=expert_device,
                 dtype=torch.bfloat16,
             )
         )
@@ -297,44 +358,68 @@ class MLPBlock(torch.nn.Module):
                     config.hidden_size,
                     config.intermediate_size // self.world_size,
                 ),
-                device=device,
+                device=expert_device,
                 dtype=torch.bfloat16,
             )
         )
         self.mlp2_bias = torch.nn.Parameter(
             torch.empty(
                 (config.num_experts, config.hidden_size),
-                device=device,
+                device=expert_device,
                 dtype=torch.bfloat16,
             )
         )
 
+    @region("mlp")
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        t = self.norm(x)
-        g = self.gate(t)
-        experts = torch.topk(g, k=self.experts_per_token, dim=-1, sorted=True)
-        expert_weights = torch.nn.functional.softmax(experts.values, dim=1)
-        expert_indices = experts.indices
+        with region("wg"):
+            t = self.norm(x)
+            g = self.gate(t)
+        with region("routing"):
+            experts = torch.topk(g, k=self.experts_per_token, dim=-1, sorted=True)
+            expert_weights = torch.nn.functional.softmax(experts.values, dim=1)
+            expert_indices = experts.indices
+            if self.telemetry is not None:
+                self.telemetry.record(self.layer_idx, expert_indices, expert_weights)
+
+        if self.expert_cache is not None:
+            with region("expert_cache"):
+                weights, expert_indices = self._gather_resident_experts(expert_indices)
+        else:
+            weights = self.mlp1_weight, self.mlp1_bias, self.mlp2_weight, self.mlp2_bias
+        all_mlp1_weight, all_mlp1_bias, all_mlp2_weight, all_mlp2_bias = weights
 
         # MLP #1
-        mlp1_weight = self.mlp1_weight[expert_indices, ...]
-        mlp1_bias = self.mlp1_bias[expert_indices, ...]
-        t = torch.einsum("beck,bk->bec", mlp1_weight, t) + mlp1_bias
-        t = swiglu(t, limit=self.swiglu_limit)
+        with region("w1"):
+            mlp1_weight = all_mlp1_weight[expert_indices, ...]
+            mlp1_bias = all_mlp1_bias[expert_indices, ...]
+            t = torch.einsum("beck,bk->bec", mlp1_weight, t) + mlp1_bias
+        with region("swiglu"):
+            t = swiglu(t, limit=self.swiglu_limit)
 
         # MLP #2
-        mlp2_weight = self.mlp2_weight[expert_indices, ...]
-        mlp2_bias = self.mlp2_bias[expert_indices, ...]
-        t = torch.einsum("beck,bek->bec", mlp2_weight, t)
-        if self.world_size > 1:
-            dist.all_reduce(t, op=dist.ReduceOp.SUM)
-        t += mlp2_bias
+        with region("w2"):
+            mlp2_weight = all_mlp2_weight[expert_indices, ...]
+            mlp2_bias = all_mlp2_bias[expert_indices, ...]
+            t = torch.einsum("beck,bek->bec", mlp2_weight, t)
+            if self.world_size > 1:
+                dist.all_reduce(t, op=dist.ReduceOp.SUM)
+            t += mlp2_bias
 
         # Weighted sum of experts
         t = torch.einsum("bec,be->bc", t, expert_weights)
 
         return x + t
 
+    def _gather_resident_experts(self, expert_indices: torch.Tensor):
+        """Fetch the selected experts from the expert cache and remap indices into the fetched set."""
+        selected = torch.unique(expert_indices)
+        local_indices = torch.empty(self.num_experts, dtype=torch.long, device=expert_indices.device)
+        local_indices[selected] = torch.arange(len(selected), device=expert_indices.device)
+        experts = [self.expert_cache.get(self.layer_idx, e) for e in selected.tolist()]
+        weights = tuple(torch.cat(tensors) for tensors in zip(*experts))
+        return weights, local_indices[expert_indices]
+
 
 class TransformerBlock(torch.nn.Module):
     def __init__(
@@ -342,14 +427,15 @@ class TransformerBlock(torch.nn.Module):
         config: ModelConfig,
         layer_idx: int,
         device: torch.device | None = None,
+        offload_experts: bool = False,
     ):
         super().__init__()
         self.layer_idx = layer_idx
         self.attn = AttentionBlock(config, layer_idx, device)
-        self.mlp = MLPBlock(config, device)
+        self.mlp = MLPBlock(config, layer_idx, device, offload_experts)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = self.attn(x)
+    def forward(self, x: torch.Tensor, cache=None) -> torch.Tensor:
+        x = self.attn(x, cache=cache)
         x = self.mlp(x)
         return x
 
@@ -359,14 +445,16 @@ class Transformer(torch.nn.Module):
         self,
         config: ModelConfig,
         device: torch.device | None = None,
+        offload_experts: bool = False,
     ):
         super().__init__()
+        self.config = config
         self.embedding = torch.nn.Embedding(
             config.vocab_size, config.hidden_size, device=device, dtype=torch.bfloat16
         )
         self.block = torch.nn.ModuleList(
             [
-                TransformerBlock(config, layer_idx, device)
+                TransformerBlock(config, layer_idx, device, offload_experts)
                 for layer_idx in range(config.num_hidden_layers)
             ]
         )
@@ -379,17 +467,56 @@ class Transformer(torch.nn.Module):
             dtype=torch.bfloat16,
         )
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = self.embedding(x)
-        for block in self.block:
-            x = block(x)
-        x = self.norm(x)
-        x = self.unembedding(x)
+    def forward(
+        self,
+        x: torch.Tensor,
+        caches: list | None = None,
+        logits_indices: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        # logits_indices selects the tokens whose logits are computed, all of them by default
+        caches = caches or [None] * len(self.block)
+        with region("embedding"):
+            x = self.embedding(x)
+        for block, cache in zip(self.block, caches):
+            with region("block", block.layer_idx):
+                x = block(x, cache=cache)
+        if logits_indices is not None:
+            x = x[logits_indices]
+        with region("norm_f"):
+            x = self.norm(x)
+        with region("unembedding"):
+            x = self.unembedding(x)
         return x
 
+    def prefill_packed(
+        self,
+        sequences: list[list[int]],
+        kv_cache=None,
+        tables: list | None = None,
+    ) -> torch.Tensor:
+        """Run several sequences in one forward pass and return the logits of their last tokens, [len(sequences), vocab].
+
+        With a `PagedKVCache`, the keys and values of every sequence are appended to
+        its block table in `tables`; sequences that start empty are attended to
+        with a single block-diagonal mask.
+        """
+        device = self.embedding.weight.device
+        seq_lens = [len(tokens) for tokens in sequences]
+        assert all(seq_lens), "Sequences must not be empty"
+        if kv_cache is not None:
+            caches = kv_cache.prepare(tables, seq_lens)
+        else:
+            caches = [PackedSequences(seq_lens, device)] * len(self.block)
+        x = torch.as_tensor([token for tokens in sequences for token in tokens], dtype=torch.int32, device=device)
+        last = torch.as_tensor(seq_lens, device=device).cumsum(0) - 1
+        return self(x, caches=caches, logits_indices=last)
+
     @staticmethod
     def from_checkpoint(
-        path: str, device: str | torch.device = "cuda"
+        path: str,
+        device: str | torch.device = "cuda",
+        expert_cache_bytes: int | None = None,
+        expert_cache_policy: str = "lru",
     ) -> "Transformer":
         if not isinstance(device, torch.device):
             device = torch.device(device)
@@ -399,9 +526,12 @@ class Transformer(torch.nn.Module):
             json_config = json.load(f)
             config = ModelConfig(**json_config)
 
+        offload_experts = expert_cache_bytes is not None
+        # Parameters are allocated by the checkpoint loader and assigned to the modules, not copied
         model = Transformer(
             config=config,
-            device=device,
+            device=torch.device("meta"),
+            offload_experts=offload_experts,
         )
         model.eval()
 
@@ -410,11 +540,7 @@ class Transformer(torch.nn.Module):
         world_size = dist.get_world_size() if dist.is_initialized() else 1
         per_rank_intermediate_size = config.intermediate_size // world_size
 
-        checkpoint = Checkpoint(path, device)
-
-        for name, param in model.named_parameters():
-            loaded_tensor = checkpoint.get(name)
-
+        def shard(name: str, loaded_tensor: torch.Tensor) -> torch.Tensor:
             # Note: it would be more efficient to do sharding before upcasting from MXFP4,
             # but for simplicity we do it after.
             if "mlp1" in name:  # both weight and bias
@@ -432,46 +558,172 @@ class Transformer(torch.nn.Module):
                     * per_rank_intermediate_size : (my_rank + 1)
                     * per_rank_intermediate_size,
                 ]
-            try:
-                param.data.copy_(loaded_tensor)
-            except:
-                print(f"{name=} {param.data.shape=} {loaded_tensor.shape=}")
-                raise
+            # A view of a shard would keep the whole tensor alive; this is a no-op without sharding
+            return loaded_tensor.contiguous()
+
+        checkpoint = Checkpoint(path, device)
+
+        for name, _ in list(model.named_parameters()):
+            if offload_experts and name.rpartition(".")[2] in EXPERT_PARAM_NAMES:
+                # Offloaded experts are loaded on demand by the expert cache
+                continue
+            assign_parameter(model, name, shard(name, checkpoint.get(name)))
+        for block in model.block:
+            # Rope tables are computed in the forward pass on this device, which is still meta
+            block.attn.rope.device = device
+
+        if offload_experts:
+            from gpt_oss.torch.expert_cache import ExpertCache
+
+            # Cold experts stay in the mmapped checkpoint and are dequantized when selected
+            cold_checkpoint = Checkpoint(path, torch.device("cpu"))
+
+            def load_expert(layer_idx: int, expert_idx: int):
+                names = [f"block.{layer_idx}.mlp.{param_name}" for param_name in EXPERT_PARAM_NAMES]
+                return tuple(
+                    shard(name, cold_checkpoint.get_expert(name, expert_idx)).to(device)
+                    for name in names
+                )
+
+            model.expert_cache = ExpertCache(load_expert, expert_cache_bytes, expert_cache_policy)
+            for block in model.block:
+                block.mlp.expert_cache = model.expert_cache
 
         return model
 
 
 class TokenGenerator:
     @torch.inference_mode()
-    def __init__(self, checkpoint: str, device: torch.device):
+    def __init__(
+        self,
+        checkpoint: str,
+        device: torch.device,
+        context: int = 8192,
+        block_size: int = 16,
+        prefix_cache: bool = True,
+        expert_cache_bytes: int | None = None,
+        router_telemetry: bool = False,
+        streaming=None,
+    ):
+        from gpt_oss.torch.memory import MemoryTracker
+        from gpt_oss.torch.paged_cache import PagedKVCache
+        from gpt_oss.torch.prefix_cache import RadixCache
+        from gpt_oss.torch.router_telemetry import attach_router_telemetry
+
         self.device = device
-        self.model = Transformer.from_checkpoint(checkpoint, device=self.device)
+        self.context = context
+        self.memory = MemoryTracker(device)
+        with self.memory.phase("load"):
+            self.model = Transformer.from_checkpoint(
+                checkpoint, device=self.device, expert_cache_bytes=expert_cache_bytes
+            )
+            config = self.model.config
+            num_blocks = math.ceil(context / block_size)
+            self.kv_cache = PagedKVCache(
+                num_layers=config.num_hidden_layers,
+                num_blocks=num_blocks,
+                block_size=block_size,
+                num_kv_heads=config.num_key_value_heads,
+                head_dim=config.head_dim,
+                device=self.device,
+            )
+        # Cached prefixes may use the whole pool, they are evicted when a sequence needs the blocks
+        self.prefix_cache = (
+            RadixCache(self.kv_cache.allocator, block_size, max_blocks=num_blocks)
+            if prefix_cache
+            else None
+        )
+        self.router_telemetry = attach_router_telemetry(self.model) if router_telemetry else None
+        # A gpt_oss.torch.streaming.StreamingConfig bounds the KV state of sessions
+        self.streaming = streaming
+
+    @torch.inference_mode()
+    def save_kv_snapshot(self, path: str, tokens: list[int]):
+        """Prefill `tokens` (reusing cached prefixes) and write their KV state to `path`."""
+        from gpt_oss.torch.kv_snapshot import KVSnapshot, save_kv_snapshot
+        from gpt_oss.torch.paged_cache import BlockTable
+
+        table, num_cached = self.kv_cache.new_sequence(), 0
+        if self.prefix_cache is not None:
+            num_cached, blocks = self.prefix_cache.match(tokens)
+            table = self.kv_cache.fork(BlockTable(blocks, num_cached))
+        try:
+            new_tokens = tokens[num_cached:]
+            if new_tokens:
+                if self.prefix_cache is not None:
+                    self.prefix_cache.ensure_free(self.kv_cache.num_blocks_needed(table, len(new_tokens)))
+                caches = self.kv_cache.prepare([table], [len(new_tokens)])
+                with self.memory.phase("prefill"):
+                    self.model(torch.as_tensor(new_tokens, dtype=torch.int32, device=self.device), caches=caches)
+            k, v = self.kv_cache.export_kv(table)
+            save_kv_snapshot(path, KVSnapshot(self.model.config, list(tokens), k, v))
+            if self.prefix_cache is not None:
+                self.prefix_cache.insert(tokens, table.blocks)
+        finally:
+            self.kv_cache.free(table)
+
+    @torch.inference_mode()
+    def load_kv_snapshot(self, path: str) -> list[int]:
+        """Restore a snapshot into the prefix cache, so that prompts starting with its tokens skip their prefill."""
+        from gpt_oss.torch.kv_snapshot import load_kv_snapshot
+
+        assert self.prefix_cache is not None, "Restored KV state is served through the prefix cache"
+        snapshot = load_kv_snapshot(path, device=self.device, config=self.model.config)
+        self.prefix_cache.ensure_free(-(-snapshot.num_tokens // self.kv_cache.block_size))
+        table = self.kv_cache.import_kv(snapshot.k, snapshot.v)
+        try:
+            self.prefix_cache.insert(snapshot.tokens, table.blocks)
+        finally:
+            self.kv_cache.free(table)
+        return snapshot.tokens
 
     @torch.inference_mode()
+    def score(self, prompt_tokens: list[int], continuation_tokens: list[int], top_n: int = 0):
+        """Logprobs of `continuation_tokens` following `prompt_tokens`, see `gpt_oss.torch.scoring`."""
+        from gpt_oss.torch.paged_cache import BlockTable
+        from gpt_oss.torch.scoring import score_logits, scoring_inputs
+
+        tokens, first = scoring_inputs(prompt_tokens, continuation_tokens)
+        table, num_cached = self.kv_cache.new_sequence(), 0
+        if self.prefix_cache is not None:
+            # Candidates scored against the same prompt share its KV entries
+            num_cached, blocks = self.prefix_cache.match(tokens[:first])
+            table = self.kv_cache.fork(BlockTable(blocks, num_cached))
+        try:
+            new_tokens = tokens[num_cached:]
+            if self.prefix_cache is not None:
+                self.prefix_cache.ensure_free(self.kv_cache.num_blocks_needed(table, len(new_tokens)))
+            caches = self.kv_cache.prepare([table], [len(new_tokens)])
+            logits_indices = torch.arange(first - num_cached, len(new_tokens), device=self.device)
+            with self.memory.phase("prefill"):
+                logits = self.model(
+                    torch.as_tensor(new_tokens, dtype=torch.int32, device=self.device),
+                    caches=caches,
+                    logits_indices=logits_indices,
+                )
+            if self.prefix_cache is not None:
+                self.prefix_cache.insert(tokens, table.blocks)
+        finally:
+            self.kv_cache.free(table)
+        return score_logits(logits, continuation_tokens, top_n)
+
+    def session(self):
+        """Start a conversation whose KV state is kept across generate calls, see `GenerationSession`."""
+        from gpt_oss.torch.session import GenerationSession
+        from gpt_oss.torch.streaming import StreamingSession
+
+        if self.streaming is not None:
+            return StreamingSession(self, self.streaming)
+        return GenerationSession(self)
+
     def generate(self,
                  prompt_tokens: list[int],
                  stop_tokens: list[int],
                  temperature: float = 1.0,
                  max_tokens: int = 0,
-                 return_logprobs: bool = False):
-        tokens = list(prompt_tokens)
-        num_generated_tokens = 0
-        while max_tokens == 0 or num_generated_tokens < max_tokens:
-            logits = self.model(torch.as_tensor(tokens, dtype=torch.int32, device=self.device))[-1]
-            if temperature == 0.0:
-                predicted_token = torch.argmax(logits, dim=-1).item()
-            else:
-                probs = torch.softmax(logits * (1.0 / temperature), dim=-1)
-                predicted_token = torch.multinomial(probs, num_samples=1).item()
-            tokens.append(predicted_token)
-            num_generated_tokens += 1
-
-            if return_logprobs:
-                logprobs = torch.log_softmax(logits, dim=-1)
-                selected_logprobs = logprobs[predicted_token].item()
-                yield predicted_token, selected_logprobs
-            else:
-                yield predicted_token
-
-            if predicted_token in stop_tokens:
-                break
+                 return_logprobs: bool = False,
+                 experts_per_token: int | list[int] | None = None):
+        with self.session() as session:
+            yield from session.generate(
+                prompt_tokens, stop_tokens, temperature, max_tokens, return_logprobs, experts_per_token
+            )
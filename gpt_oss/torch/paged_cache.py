@@ -0,0 +1,277 @@
+"""Paged KV cache for the reference PyTorch implementation.
+
+KV entries for all sequences live in a single pool of fixed-size blocks per
+layer. Each sequence owns a block table mapping its logical token positions to
+physical blocks, so memory is only consumed by tokens actually in flight.
+Blocks are reference counted, which lets forked sequences share their common
+prefix until one of them writes into a shared block (copy-on-write).
+"""
+
+from dataclasses import dataclass, field
+
+import torch
+
+from gpt_oss.torch.model import packed_sdpa, sdpa
+
+
+class OutOfBlocksError(RuntimeError):
+    pass
+
+
+class BlockAllocator:
+    def __init__(self, num_blocks: int):
+        self.num_blocks = num_blocks
+        self.ref_counts = [0] * num_blocks
+        # Pop from the end so that low block ids are handed out first
+        self.free_blocks = list(reversed(range(num_blocks)))
+
+    @property
+    def num_free_blocks(self) -> int:
+        return len(self.free_blocks)
+
+    def allocate(self) -> int:
+        if not self.free_blocks:
+            raise OutOfBlocksError(f"All {self.num_blocks} KV cache blocks are in use")
+        block = self.free_blocks.pop()
+        self.ref_counts[block] = 1
+        return block
+
+    def share(self, block: int) -> int:
+        assert self.ref_counts[block] > 0, f"Block {block} is not allocated"
+        self.ref_counts[block] += 1
+        return block
+
+    def free(self, block: int):
+        assert self.ref_counts[block] > 0, f"Block {block} is already free"
+        self.ref_counts[block] -= 1
+        if self.ref_counts[block] == 0:
+            self.free_blocks.append(block)
+
+
+@dataclass
+class BlockTable:
+    blocks: list[int] = field(default_factory=list)
+    num_tokens: int = 0
+
+
+def gather_kv(
+    cache: torch.Tensor, block_table: torch.Tensor, start: int, end: int
+) -> torch.Tensor:
+    """Gather positions [start, end) of one sequence from a [num_blocks, block_size, ...] pool."""
+    num_blocks, block_size, *rest = cache.shape
+    positions = torch.arange(start, end, device=cache.device)
+    slots = block_table[positions // block_size] * block_size + positions % block_size
+    return cache.view(num_blocks * block_size, *rest).index_select(0, slots)
+
+
+def paged_attention(
+    Q: torch.Tensor,
+    K_cache: torch.Tensor,
+    V_cache: torch.Tensor,
+    block_table: torch.Tensor,
+    offset: int,
+    S: torch.Tensor,
+    sm_scale: float,
+    sliding_window: int = 0,
+) -> torch.Tensor:
+    """Attention for the queries at positions [offset, offset + len(Q)) of one sequence.
+
+    The keys and values of those positions (and of all positions before them)
+    must already be written to the paged cache.
+    """
+    n_tokens = Q.shape[0]
+    # Keys that fall outside of the sliding window of every query are not read
+    start = max(0, offset - sliding_window + 1) if sliding_window > 0 else 0
+    K = gather_kv(K_cache, block_table, start, offset + n_tokens)
+    V = gather_kv(V_cache, block_table, start, offset + n_tokens)
+    return sdpa(Q, K, V, S, sm_scale, sliding_window, offset=offset - start)
+
+
+@dataclass
+class PagedBatch:
+    """Metadata shared by all layers for one forward pass over a batch of sequences."""
+
+    positions: torch.Tensor
+    slot_mapping: torch.Tensor
+    block_tables: list[torch.Tensor]
+    offsets: list[int]
+    num_new_tokens: list[int]
+
+
+class PagedLayerCache:
+    """Per-layer view of a `PagedKVCache` that the attention blocks write to and read from."""
+
+    def __init__(self, cache: "PagedKVCache", layer_idx: int, batch: PagedBatch):
+        self.cache = cache
+        self.layer_idx = layer_idx
+        self.batch = batch
+
+    @property
+    def positions(self) -> torch.Tensor:
+        return self.batch.positions
+
+    def attention(self, q, k, v, sinks, sm_scale, sliding_window=0):
+        k_cache = self.cache.k[self.layer_idx]
+        v_cache = self.cache.v[self.layer_idx]
+        k_cache.view(-1, *k.shape[1:]).index_copy_(0, self.batch.slot_mapping, k.to(k_cache.dtype))
+        v_cache.view(-1, *v.shape[1:]).index_copy_(0, self.batch.slot_mapping, v.to(v_cache.dtype))
+
+        if all(offset == 0 for offset in self.batch.offsets):
+            # Only new sequences: nothing to gather, attend within each one
+            return packed_sdpa(
+                q, k.to(k_cache.dtype), v.to(v_cache.dtype), sinks, sm_scale, self.batch.num_new_tokens, sliding_window
+            )
+
+        outputs = []
+        q_start = 0
+        for block_table, offset, n in zip(
+            self.batch.block_tables, self.batch.offsets, self.batch.num_new_tokens
+        ):
+            outputs.append(
+                paged_attention(
+                    q[q_start : q_start + n],
+                    k_cache,
+                    v_cache,
+                    block_table,
+                    offset,
+                    sinks,
+                    sm_scale,
+                    sliding_window,
+                )
+            )
+            q_start += n
+        return torch.cat(outputs, dim=0)
+
+
+class PagedKVCache:
+    def __init__(
+        self,
+        num_layers: int,
+        num_blocks: int,
+        block_size: int,
+        num_kv_heads: int,
+        head_dim: int = 64,
+        dtype: torch.dtype = torch.bfloat16,
+        device: torch.device | None = None,
+    ):
+        self.num_layers = num_layers
+        self.block_size = block_size
+        shape = (num_layers, num_blocks, block_size, num_kv_heads, head_dim)
+        self.k = torch.zeros(shape, dtype=dtype, device=device)
+        self.v = torch.zeros(shape, dtype=dtype, device=device)
+        self.allocator = BlockAllocator(num_blocks)
+
+    def new_sequence(self) -> BlockTable:
+        return BlockTable()
+
+    def fork(self, table: BlockTable) -> BlockTable:
+        """Create a sequence that shares all KV entries of `table`."""
+        return BlockTable(
+            [self.allocator.share(block) for block in table.blocks], table.num_tokens
+        )
+
+    def free(self, table: BlockTable):
+        for block in table.blocks:
+            self.allocator.free(block)
+        table.blocks = []
+        table.num_tokens = 0
+
+    def truncate(self, table: BlockTable, n: int):
+        """Keep only the first n tokens of a sequence, releasing the blocks after them."""
+        assert n <= table.num_tokens
+        num_blocks = -(-n // self.block_size)
+        for block in table.blocks[num_blocks:]:
+            self.allocator.free(block)
+        table.blocks = table.blocks[:num_blocks]
+        table.num_tokens = n
+
+    def num_blocks_needed(self, table: BlockTable, n: int) -> int:
+        """Number of blocks that appending n tokens to `table` takes from the allocator."""
+        start, end = table.num_tokens, table.num_tokens + n
+        needed = max(0, -(-end // self.block_size) - len(table.blocks))
+        if start % self.block_size != 0 and n > 0:
+            block = table.blocks[start // self.block_size]
+            needed += int(self.allocator.ref_counts[block] > 1)
+        return needed
+
+    def _check_free(self, num_blocks: int):
+        # Checked before any table is changed, so that a failed call leaves all of them as they were
+        if num_blocks > self.allocator.num_free_blocks:
+            raise OutOfBlocksError(
+                f"{num_blocks} KV cache blocks are needed, {self.allocator.num_free_blocks} are free"
+            )
+
+    def _copy_on_write(self, table: BlockTable, index: int):
+        block = table.blocks[index]
+        if self.allocator.ref_counts[block] == 1:
+            return
+        new_block = self.allocator.allocate()
+        self.k[:, new_block] = self.k[:, block]
+        self.v[:, new_block] = self.v[:, block]
+        self.allocator.free(block)
+        table.blocks[index] = new_block
+
+    def _append_slots(self, table: BlockTable, n: int) -> list[int]:
+        self._check_free(self.num_blocks_needed(table, n))
+        start, end = table.num_tokens, table.num_tokens + n
+        if start % self.block_size != 0 and n > 0:
+            # The first new token goes into a partially filled block
+            self._copy_on_write(table, start // self.block_size)
+        while len(table.blocks) * self.block_size < end:
+            table.blocks.append(self.allocator.allocate())
+        table.num_tokens = end
+        return [
+            table.blocks[pos // self.block_size] * self.block_size + pos % self.block_size
+            for pos in range(start, end)
+        ]
+
+    def _slots(self, table: BlockTable) -> torch.Tensor:
+        block_table = torch.as_tensor(table.blocks, dtype=torch.long, device=self.k.device)
+        positions = torch.arange(table.num_tokens, device=self.k.device)
+        return block_table[positions // self.block_size] * self.block_size + positions % self.block_size
+
+    def export_kv(self, table: BlockTable) -> tuple[torch.Tensor, torch.Tensor]:
+        """Return the keys and values of a sequence as [num_layers, num_tokens, num_kv_heads, head_dim]."""
+        slots = self._slots(table)
+        return self.k.flatten(1, 2).index_select(1, slots), self.v.flatten(1, 2).index_select(1, slots)
+
+    def import_kv(self, k: torch.Tensor, v: torch.Tensor) -> BlockTable:
+        """Create a sequence holding the given keys and values, see `export_kv`."""
+        table = self.new_sequence()
+        self._append_slots(table, k.shape[1])
+        slots = self._slots(table)
+        self.k.flatten(1, 2).index_copy_(1, slots, k.to(device=self.k.device, dtype=self.k.dtype))
+        self.v.flatten(1, 2).index_copy_(1, slots, v.to(device=self.v.device, dtype=self.v.dtype))
+        return table
+
+    def prepare(
+        self, tables: list[BlockTable], num_new_tokens: list[int]
+    ) -> list[PagedLayerCache]:
+        """Reserve slots for new tokens and return the per-layer caches for the forward pass.
+
+        The new tokens of all sequences are expected to be concatenated in the
+        order of `tables`.
+        """
+        assert len(tables) == len(num_new_tokens)
+        device = self.k.device
+        offsets = [table.num_tokens for table in tables]
+        self._check_free(sum(self.num_blocks_needed(table, n) for table, n in zip(tables, num_new_tokens)))
+        slots = []
+        for table, n in zip(tables, num_new_tokens):
+            slots += self._append_slots(table, n)
+        batch = PagedBatch(
+            positions=torch.cat(
+                [
+                    torch.arange(offset, offset + n, dtype=torch.long, device=device)
+                    for offset, n in zip(offsets, num_new_tokens)
+                ]
+            ),
+            slot_mapping=torch.as_tensor(slots, dtype=torch.long, device=device),
+            block_tables=[
+                torch.as_tensor(table.blocks, dtype=torch.long, device=device)
+                for table in tables
+            ],
+            offsets=offsets,
+            num_new_tokens=list(num_new_tokens),
+        )
+        return [PagedLayerCache(self, layer_idx, batch) for layer_idx in range(self.num_layers)]
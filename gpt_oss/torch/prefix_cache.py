@@ -0,0 +1,205 @@
+"""Radix tree prefix cache on top of the paged KV cache.
+
+The tree maps token prefixes to the KV blocks holding them, at block
+granularity: every edge is a whole number of blocks and only full blocks are
+cached. The tree owns one reference to every block it stores, so cached
+prefixes survive after the sequences that produced them are freed, and new
+sequences share them by forking the matched blocks. Leaves are evicted in LRU
+order, kept in a heap, once the cache exceeds its block budget or the pool runs
+out of blocks. Making room in the pool only evicts blocks that no live
+sequence shares, since evicting the others would not free them.
+"""
+
+import heapq
+import itertools
+from typing import Callable
+
+from gpt_oss.torch.paged_cache import BlockAllocator
+
+
+class RadixNode:
+    def __init__(
+        self,
+        tokens: tuple[int, ...] = (),
+        blocks: list[int] | None = None,
+        parent: "RadixNode | None" = None,
+    ):
+        self.tokens = tokens
+        self.blocks = blocks or []
+        self.parent = parent
+        # Keyed by the tokens of the first block of the child's edge
+        self.children: dict[tuple[int, ...], RadixNode] = {}
+        self.last_access = 0
+
+
+class RadixCache:
+    def __init__(self, allocator: BlockAllocator, block_size: int, max_blocks: int):
+        self.allocator = allocator
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.root = RadixNode()
+        self.num_blocks = 0
+        self.num_nodes = 0
+        self._clock = 0
+        # (last_access, tie breaker, node) of every leaf; entries of nodes that were accessed again, got children
+        # or were evicted since they were pushed are stale and skipped
+        self._lru: list[tuple[int, int, RadixNode]] = []
+        self._tie_breaker = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.query_tokens = 0
+        self.hit_tokens = 0
+
+    def _num_matching_blocks(self, edge: tuple[int, ...], tokens: tuple[int, ...]) -> int:
+        bs = self.block_size
+        n = 0
+        while (
+            (n + 1) * bs <= min(len(edge), len(tokens))
+            and edge[n * bs : (n + 1) * bs] == tokens[n * bs : (n + 1) * bs]
+        ):
+            n += 1
+        return n
+
+    def match(self, tokens: list[int]) -> tuple[int, list[int]]:
+        """Return the length of the longest cached prefix of `tokens` and its blocks.
+
+        The caller must take its own reference on the returned blocks (e.g. via
+        `PagedKVCache.fork`) before the cache is modified again.
+        """
+        bs = self.block_size
+        tokens = tuple(tokens)
+        self._clock += 1
+        node, pos, blocks = self.root, 0, []
+        while True:
+            child = node.children.get(tokens[pos : pos + bs])
+            if child is None:
+                break
+            n = self._num_matching_blocks(child.tokens, tokens[pos:])
+            self._touch(child)
+            blocks += child.blocks[:n]
+            pos += n * bs
+            if n < len(child.blocks):
+                break
+            node = child
+
+        self.query_tokens += len(tokens)
+        self.hit_tokens += pos
+        if pos > 0:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return pos, blocks
+
+    def _split(self, node: RadixNode, n: int) -> RadixNode:
+        """Split the edge into `node` after its first n blocks and return the new upper node."""
+        bs = self.block_size
+        head = RadixNode(node.tokens[: n * bs], node.blocks[:n], node.parent)
+        head.last_access = node.last_access
+        node.parent.children[head.tokens[:bs]] = head
+        node.tokens, node.blocks, node.parent = node.tokens[n * bs :], node.blocks[n:], head
+        head.children[node.tokens[:bs]] = node
+        self.num_nodes += 1
+        return head
+
+    def insert(self, tokens: list[int], blocks: list[int]):
+        """Cache the full blocks of a sequence whose KV entries for `tokens` are stored in `blocks`."""
+        bs = self.block_size
+        num_blocks = min(len(tokens) // bs, len(blocks))
+        tokens = tuple(tokens[: num_blocks * bs])
+        self._clock += 1
+        node, pos = self.root, 0
+        while pos < len(tokens):
+            key = tokens[pos : pos + bs]
+            child = node.children.get(key)
+            if child is None:
+                child = RadixNode(
+                    tokens[pos:],
+                    [self.allocator.share(block) for block in blocks[pos // bs : num_blocks]],
+                    node,
+                )
+                node.children[key] = child
+                self.num_blocks += len(child.blocks)
+                self.num_nodes += 1
+                self._touch(child)
+                break
+            n = self._num_matching_blocks(child.tokens, tokens[pos:])
+            if n < len(child.blocks):
+                child = self._split(child, n)
+            self._touch(child)
+            node, pos = child, pos + n * bs
+
+        self._evict(lambda: self.num_blocks <= self.max_blocks)
+
+    def _touch(self, node: RadixNode):
+        node.last_access = self._clock
+        self._push(node)
+
+    def _push(self, node: RadixNode):
+        heapq.heappush(self._lru, (node.last_access, next(self._tie_breaker), node))
+        # Drop the stale entries once they outnumber the nodes
+        if len(self._lru) > 2 * self.num_nodes + 64:
+            leaves, stack = [], list(self.root.children.values())
+            while stack:
+                other = stack.pop()
+                if other.children:
+                    stack.extend(other.children.values())
+                else:
+                    leaves.append((other.last_access, next(self._tie_breaker), other))
+            heapq.heapify(leaves)
+            self._lru = leaves
+
+    def _num_unshared_blocks(self, node: RadixNode) -> int:
+        """Number of trailing blocks of the edge that only the cache references."""
+        n = 0
+        while n < len(node.blocks) and self.allocator.ref_counts[node.blocks[-1 - n]] == 1:
+            n += 1
+        return n
+
+    def _evict(self, done: Callable[[], bool], unshared_only: bool = False):
+        """Evict leaves in LRU order until done() or no (unshared) leaf is left."""
+        skipped = []
+        while not done() and self._lru:
+            entry = heapq.heappop(self._lru)
+            last_access, _, leaf = entry
+            if leaf.parent is None or leaf.children or last_access != leaf.last_access:
+                continue
+            if unshared_only:
+                # Sequences fork a prefix of the edge, so the unshared blocks are at its end
+                n = self._num_unshared_blocks(leaf)
+                if n == 0:
+                    skipped.append(entry)
+                    continue
+                if n < len(leaf.blocks):
+                    self._split(leaf, len(leaf.blocks) - n)
+            self._remove(leaf)
+        for entry in skipped:
+            heapq.heappush(self._lru, entry)
+
+    def _remove(self, leaf: RadixNode):
+        for block in leaf.blocks:
+            self.allocator.free(block)
+        self.num_blocks -= len(leaf.blocks)
+        self.num_nodes -= 1
+        parent = leaf.parent
+        del parent.children[leaf.tokens[: self.block_size]]
+        leaf.parent = None
+        if parent is not self.root and not parent.children:
+            self._push(parent)
+
+    def ensure_free(self, num_blocks: int):
+        """Evict cached prefixes until the allocator has `num_blocks` free blocks, or only shared blocks are cached."""
+        self._evict(lambda: self.allocator.num_free_blocks >= num_blocks, unshared_only=True)
+
+    def clear(self):
+        self._evict(lambda: False)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / max(1, self.hits + self.misses),
+            "query_tokens": self.query_tokens,
+            "hit_tokens": self.hit_tokens,
+            "token_hit_rate": self.hit_tokens / max(1, self.query_tokens),
+            "cached_blocks": self.num_blocks,
+        }
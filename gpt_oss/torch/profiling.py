@@ -0,0 +1,145 @@
+"""Named profiling regions shared by the torch and triton models.
+
+`region` is a drop-in replacement for `torch.profiler.record_function`: the
+regions always show up in torch profiler traces, and while a `Profiler` is
+active their wall-clock time is also recorded per op and per layer. Regions
+without an explicit layer index inherit it from the enclosing region.
+
+with Profiler() as profiler:
+    model(tokens)
+print(profiler.summary_table())
+profiler.to_chrome_trace("trace.json")
+"""
+
+import json
+import time
+from contextlib import ContextDecorator
+from dataclasses import dataclass
+
+import torch
+from torch.profiler import record_function
+
+_active_profiler: "Profiler | None" = None
+
+
+@dataclass
+class RegionEvent:
+    name: str
+    layer_idx: int | None
+    depth: int
+    start: float
+    duration: float
+
+
+class Profiler:
+    def __init__(self, synchronize: bool = True):
+        # Synchronize CUDA at region boundaries so that timings include the kernels
+        self.synchronize = synchronize
+        self.events: list[RegionEvent] = []
+        self._stack: list[tuple[str, int | None, float] | None] = []
+        self._origin = 0.0
+
+    def __enter__(self) -> "Profiler":
+        global _active_profiler
+        assert _active_profiler is None, "Another profiler is already active"
+        _active_profiler = self
+        self._origin = self._now()
+        return self
+
+    def __exit__(self, *exc):
+        global _active_profiler
+        _active_profiler = None
+        return False
+
+    def _now(self) -> float:
+        if self.synchronize and torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _enter(self, name: str, layer_idx: int | None):
+        if torch.cuda.is_available() and torch.cuda.is_current_stream_capturing():
+            # Regions captured into a CUDA graph are not timed on replay
+            self._stack.append(None)
+            return
+        if layer_idx is None:
+            layer_idx = next((entry[1] for entry in reversed(self._stack) if entry is not None), None)
+        self._stack.append((name, layer_idx, self._now()))
+
+    def _exit(self):
+        entry = self._stack.pop()
+        if entry is None:
+            return
+        name, layer_idx, start = entry
+        self.events.append(
+            RegionEvent(name, layer_idx, len(self._stack), start - self._origin, self._now() - start)
+        )
+
+    def summary(self) -> dict:
+        ops: dict[str, dict[str, float]] = {}
+        layers: dict[int, dict[str, float]] = {}
+        for event in self.events:
+            op = ops.setdefault(event.name, {"count": 0, "total_ms": 0.0})
+            op["count"] += 1
+            op["total_ms"] += event.duration * 1e3
+            if event.layer_idx is not None:
+                layer = layers.setdefault(event.layer_idx, {})
+                layer[event.name] = layer.get(event.name, 0.0) + event.duration * 1e3
+        for op in ops.values():
+            op["mean_ms"] = op["total_ms"] / op["count"]
+        return {"ops": ops, "layers": dict(sorted(layers.items()))}
+
+    def summary_table(self) -> str:
+        summary = self.summary()
+        lines = [f"{'region':<16} {'count':>8} {'total ms':>12} {'mean ms':>10}"]
+        for name, op in sorted(summary["ops"].items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(f"{name:<16} {op['count']:>8} {op['total_ms']:>12.3f} {op['mean_ms']:>10.4f}")
+        if summary["layers"]:
+            names = sorted({name for layer in summary["layers"].values() for name in layer})
+            lines.append("")
+            lines.append(f"{'layer':<8}" + "".join(f"{name:>14}" for name in names))
+            for layer_idx, layer in summary["layers"].items():
+                lines.append(
+                    f"{layer_idx:<8}" + "".join(f"{layer.get(name, 0.0):>14.3f}" for name in names)
+                )
+        return "\n".join(lines)
+
+    def to_chrome_trace(self, path: str):
+        trace_events = [
+            {
+                "name": event.name if event.layer_idx is None else f"{event.name}[{event.layer_idx}]",
+                "cat": event.name,
+                "ph": "X",
+                "ts": event.start * 1e6,
+                "dur": event.duration * 1e6,
+                "pid": 0,
+                "tid": 0,
+                "args": {"layer": event.layer_idx, "depth": event.depth},
+            }
+            for event in self.events
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+class region(ContextDecorator):
+    def __init__(self, name: str, layer_idx: int | None = None):
+        self.name = name
+        self.layer_idx = layer_idx
+
+    def _recreate_cm(self):
+        # Decorated functions get a fresh region per call, so that nesting works
+        return region(self.name, self.layer_idx)
+
+    def __enter__(self) -> "region":
+        self._record_function = record_function(self.name)
+        self._record_function.__enter__()
+        self._profiler = _active_profiler
+        if self._profiler is not None:
+            self._profiler._enter(self.name, self.layer_idx)
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is not None:
+            self._profiler._exit()
+        self._record_function.__exit__(*exc)
+        return False
@@ -0,0 +1,106 @@
+"""Opt-in router telemetry for the MoE blocks of the torch and triton models.
+
+Expert selection counts and gate-weight entropy are accumulated in on-device
+counters without host synchronization (so recording also works inside CUDA
+graphs) and are flushed to host aggregates every `flush_interval` steps.
+"""
+
+import json
+
+import torch
+
+
+class RouterTelemetry:
+    def __init__(
+        self,
+        num_layers: int,
+        num_experts: int,
+        device: torch.device | None = None,
+        flush_interval: int = 64,
+    ):
+        self.num_layers = num_layers
+        self.num_experts = num_experts
+        self.flush_interval = flush_interval
+        self.steps = 0
+        self.counts = torch.zeros((num_layers, num_experts), dtype=torch.long, device=device)
+        self.entropy_sum = torch.zeros(num_layers, dtype=torch.float32, device=device)
+        self.num_tokens = torch.zeros(num_layers, dtype=torch.long, device=device)
+        self.host_counts = torch.zeros((num_layers, num_experts), dtype=torch.long)
+        self.host_entropy_sum = torch.zeros(num_layers, dtype=torch.float64)
+        self.host_num_tokens = torch.zeros(num_layers, dtype=torch.long)
+
+    def record(self, layer_idx: int, expert_indices: torch.Tensor, expert_weights: torch.Tensor):
+        """Record the routing decision of one layer: [n_tokens, k] indices and normalized weights."""
+        indices = expert_indices.flatten().long()
+        self.counts[layer_idx].index_add_(0, indices, torch.ones_like(indices))
+        p = expert_weights.float()
+        entropy = -(p * torch.log(p.clamp_min(1e-20))).sum(dim=-1)
+        self.entropy_sum[layer_idx] += entropy.sum()
+        self.num_tokens[layer_idx] += expert_indices.shape[0]
+
+    def record_logits(self, layer_idx: int, logits: torch.Tensor, experts_per_token: int):
+        """Record the routing decision of one layer from raw gate logits."""
+        experts = torch.topk(logits.float(), k=experts_per_token, dim=-1, sorted=True)
+        self.record(layer_idx, experts.indices, torch.softmax(experts.values, dim=-1))
+
+    def step(self):
+        self.steps += 1
+        if self.steps % self.flush_interval == 0:
+            self.flush()
+
+    def flush(self):
+        self.host_counts += self.counts.cpu()
+        self.host_entropy_sum += self.entropy_sum.cpu().double()
+        self.host_num_tokens += self.num_tokens.cpu()
+        self.counts.zero_()
+        self.entropy_sum.zero_()
+        self.num_tokens.zero_()
+
+    def reset(self):
+        self.flush()
+        self.host_counts.zero_()
+        self.host_entropy_sum.zero_()
+        self.host_num_tokens.zero_()
+        self.steps = 0
+
+    def summary(self) -> dict:
+        self.flush()
+        counts = self.host_counts.double()
+        mean_load = counts.mean(dim=-1)
+        layers = []
+        for layer_idx in range(self.num_layers):
+            num_tokens = int(self.host_num_tokens[layer_idx])
+            mean = float(mean_load[layer_idx])
+            layers.append({
+                "layer": layer_idx,
+                "tokens": num_tokens,
+                "expert_counts": self.host_counts[layer_idx].tolist(),
+                "gate_entropy": float(self.host_entropy_sum[layer_idx]) / max(1, num_tokens),
+                # Load of the busiest expert relative to a perfectly balanced router
+                "imbalance": float(counts[layer_idx].max()) / mean if mean > 0 else 0.0,
+                "load_cv": float(counts[layer_idx].std()) / mean if mean > 0 else 0.0,
+                "unused_experts": int((self.host_counts[layer_idx] == 0).sum()),
+            })
+        return {
+            "num_layers": self.num_layers,
+            "num_experts": self.num_experts,
+            "steps": self.steps,
+            "layers": layers,
+        }
+
+    def to_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def attach_router_telemetry(model: torch.nn.Module, flush_interval: int = 64) -> RouterTelemetry:
+    """Start recording the routing decisions of all MoE blocks of a torch or triton Transformer."""
+    telemetry = RouterTelemetry(
+        model.config.num_hidden_layers,
+        model.config.num_experts,
+        device=model.embedding.weight.device,
+        flush_interval=flush_interval,
+    )
+    for block in model.block:
+        block.mlp.telemetry = telemetry
+    return telemetry
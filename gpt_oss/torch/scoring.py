@@ -0,0 +1,39 @@
+"""Teacher-forced scoring: logprobs of a known continuation from one forward pass.
+
+Both token generators implement `score(prompt_tokens, continuation_tokens, top_n)`
+with the helpers below: the model is run over the prompt and all but the last
+continuation token, and only the logits predicting continuation tokens are
+computed.
+"""
+
+from dataclasses import dataclass, field
+
+import torch
+
+
+@dataclass
+class TokenScore:
+    token: int
+    logprob: float
+    # The top-N most likely tokens at this position as (token, logprob), most likely first
+    top: list[tuple[int, float]] = field(default_factory=list)
+
+
+def scoring_inputs(prompt_tokens: list[int], continuation_tokens: list[int]) -> tuple[list[int], int]:
+    """Tokens to run through the model and the index of the first one whose logits are needed."""
+    assert prompt_tokens, "Scoring needs at least one prompt token"
+    assert continuation_tokens, "Nothing to score"
+    tokens = list(prompt_tokens) + list(continuation_tokens)
+    # The logits after the last prompt token predict the first continuation token
+    return tokens[:-1], len(prompt_tokens) - 1
+
+
+def score_logits(logits: torch.Tensor, targets: list[int], top_n: int = 0) -> list[TokenScore]:
+    """Scores of `targets` given the logits [len(targets), vocab] predicting each of them."""
+    logprobs = torch.log_softmax(logits.float(), dim=-1)
+    selected = logprobs.gather(1, torch.as_tensor(targets, device=logits.device)[:, None])[:, 0].tolist()
+    tops = [[] for _ in targets]
+    if top_n > 0:
+        top = torch.topk(logprobs, top_n, dim=-1)
+        tops = [list(zip(indices, values)) for indices, values in zip(top.indices.tolist(), top.values.tolist())]
+    return [TokenScore(token, logprob, top) for token, logprob, top in zip(targets, selected, tops)]
@@ -0,0 +1,116 @@
+"""Generation sessions for the torch TokenGenerator.
+
+A session owns one sequence in the paged KV cache and keeps it across
+generate calls. Every call takes the full token sequence (e.g. the re-rendered
+conversation); the cached tokens are rolled back to the longest prefix shared
+with it and only the remaining tokens are prefilled. Any number of sessions can
+be open at the same time, they only compete for KV blocks.
+"""
+
+import torch
+
+from gpt_oss.torch.fast_mode import experts_per_token_override
+from gpt_oss.torch.kv_snapshot import common_prefix_length
+from gpt_oss.torch.paged_cache import BlockTable
+
+
+class GenerationSession:
+    def __init__(self, generator):
+        self.generator = generator
+        self.kv_cache = generator.kv_cache
+        self.table = self.kv_cache.new_sequence()
+        # Tokens whose keys and values are in the cache
+        self.tokens: list[int] = []
+        # KV entries computed with a reduced number of experts must not be shared with full requests
+        self.shareable = True
+        # Top-k of the current request, applied around each forward pass
+        self.experts_per_token = None
+
+    def _rewind(self, tokens: list[int], use_prefix_cache: bool) -> int:
+        """Drop cached tokens that are not a prefix of `tokens`; returns the number of tokens kept."""
+        # Keep at least one token to compute the logits of the first generated token
+        num_cached = min(common_prefix_length(self.tokens, tokens), len(tokens) - 1)
+        if num_cached < len(self.tokens):
+            self.kv_cache.truncate(self.table, num_cached)
+            self.tokens = self.tokens[:num_cached]
+        prefix_cache = self.generator.prefix_cache
+        if num_cached == 0 and use_prefix_cache and prefix_cache is not None:
+            num_cached, blocks = prefix_cache.match(tokens[:-1])
+            self.kv_cache.free(self.table)
+            self.table = self.kv_cache.fork(BlockTable(blocks, num_cached))
+            self.tokens = list(tokens[:num_cached])
+        return num_cached
+
+    def _forward(self, tokens: list[int], phase: str) -> torch.Tensor:
+        generator = self.generator
+        num_tokens = len(self.tokens) + len(tokens)
+        if num_tokens > generator.context:
+            raise ValueError(f"{num_tokens} tokens exceed the context length of {generator.context}")
+        if generator.prefix_cache is not None:
+            # Cached prefixes are evicted even when this session does not use them
+            generator.prefix_cache.ensure_free(self.kv_cache.num_blocks_needed(self.table, len(tokens)))
+        caches = self.kv_cache.prepare([self.table], [len(tokens)])
+        with generator.memory.phase(phase), experts_per_token_override(generator.model, self.experts_per_token):
+            logits = generator.model(torch.as_tensor(tokens, dtype=torch.int32, device=generator.device), caches=caches)[-1]
+        self.tokens += tokens
+        if generator.router_telemetry is not None:
+            generator.router_telemetry.step()
+        return logits
+
+    @torch.inference_mode()
+    def append(self, tokens: list[int]):
+        """Prefill tokens appended to the conversation (e.g. a tool output) without generating."""
+        if tokens:
+            self._forward(list(tokens), "prefill")
+
+    @torch.inference_mode()
+    def generate(self,
+                 tokens: list[int],
+                 stop_tokens: list[int],
+                 temperature: float = 1.0,
+                 max_tokens: int = 0,
+                 return_logprobs: bool = False,
+                 experts_per_token: int | list[int] | None = None):
+        assert tokens, "The prompt must not be empty"
+        self.experts_per_token = experts_per_token
+        if experts_per_token is not None:
+            self.shareable = False
+        tokens = list(tokens)
+        num_cached = self._rewind(tokens, use_prefix_cache=self.shareable)
+        tokens = tokens[num_cached:]
+        num_generated_tokens = 0
+        while max_tokens == 0 or num_generated_tokens < max_tokens:
+            logits = self._forward(tokens, "prefill" if num_generated_tokens == 0 else "decode")
+            if temperature == 0.0:
+                predicted_token = torch.argmax(logits, dim=-1).item()
+            else:
+                probs = torch.softmax(logits * (1.0 / temperature), dim=-1)
+                predicted_token = torch.multinomial(probs, num_samples=1).item()
+            # Only the new token has to be fed to the model on the next step
+            tokens = [predicted_token]
+            num_generated_tokens += 1
+
+            if return_logprobs:
+                logprobs = torch.log_softmax(logits, dim=-1)
+                selected_logprobs = logprobs[predicted_token].item()
+                yield predicted_token, selected_logprobs
+            else:
+                yield predicted_token
+
+            if predicted_token in stop_tokens:
+                break
+
+    def close(self):
+        """Release the KV blocks of the session, keeping its full blocks in the prefix cache."""
+        prefix_cache = self.generator.prefix_cache
+        if prefix_cache is not None and self.shareable:
+            prefix_cache.insert(self.tokens, self.table.blocks)
+        self.kv_cache.free(self.table)
+        self.tokens = []
+
+    def __enter__(self) -> "GenerationSession":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,258 @@
+"""Bounded-memory streaming mode: attention sinks plus a window of recent tokens.
+
+In long sessions the KV entries of the full-attention layers grow without
+bound. In streaming mode a cache keeps the first `num_sink_tokens` tokens,
+which collect a large share of the attention weight and must not be dropped,
+and the most recent `window` tokens. Older tokens are evicted, so memory and
+per-token cost stay constant however long the session gets. See
+https://arxiv.org/abs/2309.17453.
+
+Positions are relative to the cache rather than to the session: keys are
+rotated for their slot in the cache when they are written, and the keys that
+move down when older entries are evicted are rotated back by the number of
+evicted entries. Rotary positions therefore never exceed the cache capacity,
+which keeps them within the range the model was trained on. Entries are evicted
+in chunks of `evict_chunk` so that this re-rotation is amortized over many
+tokens. Keys are re-rotated in float32 (the torch cache stores them in float32,
+the triton cache keeps a float32 copy), so that the rounding to bfloat16 does
+not compound over the evictions of a long session.
+
+The sliding-window layers are unaffected as long as `window` is at least
+`sliding_window + evict_chunk + chunk_size`, which the caches check against
+the model config. Use `gpt_oss.torch.streaming_eval` to measure the quality of
+a setting on long transcripts.
+"""
+
+from dataclasses import dataclass
+
+import torch
+
+from gpt_oss.torch.fast_mode import experts_per_token_override
+from gpt_oss.torch.kv_snapshot import common_prefix_length
+from gpt_oss.torch.model import Transformer, sdpa
+from gpt_oss.torch.session import GenerationSession
+
+
+@dataclass
+class StreamingConfig:
+    num_sink_tokens: int = 4
+    window: int = 4096
+    # Entries evicted at once when the cache is full
+    evict_chunk: int = 64
+    # Prompts are prefilled in chunks of at most this many tokens
+    chunk_size: int = 256
+
+    def __post_init__(self):
+        assert 0 < self.evict_chunk <= self.window
+        assert 0 < self.chunk_size <= self.window
+
+    @property
+    def capacity(self) -> int:
+        return self.num_sink_tokens + self.window
+
+    def check_window(self, sliding_window: int):
+        """Check that evictions never drop keys the sliding-window layers of the model still read."""
+        required = sliding_window + self.evict_chunk + self.chunk_size
+        assert self.window >= required, (
+            f"A streaming window of {self.window} tokens is too small for a sliding window of {sliding_window}, "
+            f"evict_chunk={self.evict_chunk} and chunk_size={self.chunk_size}: it must be at least {required}"
+        )
+
+    def num_to_evict(self, num_cached: int, num_new: int) -> int:
+        """Number of entries to evict before appending num_new tokens to a cache holding num_cached."""
+        assert num_new <= self.window, f"At most {self.window} tokens can be appended at once"
+        excess = num_cached + num_new - self.capacity
+        if excess <= 0:
+            return 0
+        return min(max(excess, self.evict_chunk), num_cached - self.num_sink_tokens)
+
+    def can_truncate(self, num_cached: int, num_evicted: int, n: int) -> bool:
+        """Whether the n most recent of num_cached entries can be dropped to roll back the session."""
+        # Once tokens were evicted, dropping into the sinks would leave a gap in the positions
+        return num_evicted == 0 or n <= num_cached - self.num_sink_tokens
+
+
+def rotate_keys(x: torch.Tensor, shift: int, inv_freq: torch.Tensor) -> torch.Tensor:
+    """Move rotary embedded keys [..., head_dim] by shift positions.
+
+    Rotations compose, so this is the same as embedding the keys at their
+    position plus shift. The YaRN concentration is applied once at embedding
+    time and is not repeated.
+    """
+    angle = shift * inv_freq.to(device=x.device, dtype=torch.float32)
+    cos, sin = angle.cos(), angle.sin()
+    x1, x2 = torch.chunk(x.float(), 2, dim=-1)
+    o1 = x1 * cos - x2 * sin
+    o2 = x2 * cos + x1 * sin
+    return torch.cat((o1, o2), dim=-1).to(x.dtype)
+
+
+def evict_kv(
+    k: torch.Tensor,
+    v: torch.Tensor,
+    num_sink_tokens: int,
+    num_cached: int,
+    n: int,
+    inv_freq: torch.Tensor,
+    k_fp32: torch.Tensor | None = None,
+):
+    """Evict the n oldest entries after the sinks, in place.
+
+    k and v are [N, capacity, num_kv_heads, head_dim] with N the layers or the
+    batch entries, and hold num_cached entries along the second dimension.
+    k_fp32 is an optional float32 copy of k: it is rotated instead of k, which
+    receives the result rounded once.
+    """
+    assert num_sink_tokens + n <= num_cached
+    src = slice(num_sink_tokens + n, num_cached)
+    dst = slice(num_sink_tokens, num_cached - n)
+    # Both results are new tensors, so the overlapping ranges are safe to copy
+    if k_fp32 is None:
+        k[:, dst] = rotate_keys(k[:, src], -n, inv_freq)
+    else:
+        k_fp32[:, dst] = rotate_keys(k_fp32[:, src], -n, inv_freq)
+        k[:, dst] = k_fp32[:, dst].to(k.dtype)
+    v[:, dst] = v[:, src].clone()
+
+
+class StreamingLayerCache:
+    """Per-layer view of a `StreamingKVCache` for one forward pass."""
+
+    def __init__(self, cache: "StreamingKVCache", layer_idx: int, offset: int, positions: torch.Tensor):
+        self.cache = cache
+        self.layer_idx = layer_idx
+        self.offset = offset
+        self.positions = positions
+
+    def attention(self, q, k, v, sinks, sm_scale, sliding_window=0):
+        k_cache = self.cache.k[self.layer_idx]
+        v_cache = self.cache.v[self.layer_idx]
+        end = self.offset + k.shape[0]
+        k_cache[self.offset : end] = k.to(k_cache.dtype)
+        v_cache[self.offset : end] = v.to(v_cache.dtype)
+        # Keys that fall outside of the sliding window of every query are not read
+        start = max(0, self.offset - sliding_window + 1) if sliding_window > 0 else 0
+        return sdpa(
+            q,
+            k_cache[start:end].to(q.dtype),
+            v_cache[start:end],
+            sinks,
+            sm_scale,
+            sliding_window,
+            offset=self.offset - start,
+        )
+
+
+class StreamingKVCache:
+    """KV cache of one sequence holding at most `config.capacity` entries per layer."""
+
+    def __init__(self, model: Transformer, config: StreamingConfig, dtype: torch.dtype = torch.bfloat16):
+        model_config = model.config
+        config.check_window(model_config.sliding_window)
+        device = model.embedding.weight.device
+        self.config = config
+        shape = (
+            model_config.num_hidden_layers,
+            config.capacity,
+            model_config.num_key_value_heads,
+            model_config.head_dim,
+        )
+        # Keys are re-rotated on every eviction, float32 keeps the rounding errors from adding up
+        self.k = torch.zeros(shape, dtype=torch.float32, device=device)
+        self.v = torch.zeros(shape, dtype=dtype, device=device)
+        # All layers share the rotary embedding parameters
+        _, self.inv_freq = model.block[0].attn.rope._compute_concentration_and_inv_freq()
+        self.num_tokens = 0
+        self.num_evicted = 0
+
+    def reset(self):
+        self.num_tokens = 0
+        self.num_evicted = 0
+
+    def truncate(self, n: int):
+        """Drop the n most recent entries."""
+        assert n <= self.num_tokens and self.config.can_truncate(self.num_tokens, self.num_evicted, n)
+        self.num_tokens -= n
+
+    def prepare(self, num_new_tokens: int) -> list[StreamingLayerCache]:
+        """Make room for new tokens and return the per-layer caches for the forward pass."""
+        n = self.config.num_to_evict(self.num_tokens, num_new_tokens)
+        if n > 0:
+            evict_kv(self.k, self.v, self.config.num_sink_tokens, self.num_tokens, n, self.inv_freq)
+            self.num_tokens -= n
+            self.num_evicted += n
+        offset = self.num_tokens
+        positions = torch.arange(offset, offset + num_new_tokens, dtype=torch.long, device=self.k.device)
+        self.num_tokens += num_new_tokens
+        return [
+            StreamingLayerCache(self, layer_idx, offset, positions) for layer_idx in range(self.k.shape[0])
+        ]
+
+
+class StreamingSession(GenerationSession):
+    """A `GenerationSession` whose KV state is bounded by a `StreamingKVCache` instead of the paged cache.
+
+    Rolling back the conversation works as long as the dropped tokens are still
+    in the cache, otherwise the session starts over from an empty cache.
+    """
+
+    def __init__(self, generator, config: StreamingConfig):
+        self.generator = generator
+        self.cache = StreamingKVCache(generator.model, config)
+        # All tokens of the session, including the evicted ones
+        self.tokens: list[int] = []
+        self.shareable = False
+        self.experts_per_token = None
+
+    def _rewind(self, tokens: list[int], use_prefix_cache: bool) -> int:
+        num_cached = min(common_prefix_length(self.tokens, tokens), len(tokens) - 1)
+        num_dropped = len(self.tokens) - num_cached
+        if num_dropped > 0:
+            cache = self.cache
+            if cache.config.can_truncate(cache.num_tokens, cache.num_evicted, num_dropped):
+                cache.truncate(num_dropped)
+            else:
+                cache.reset()
+                num_cached = 0
+            self.tokens = self.tokens[:num_cached]
+        return num_cached
+
+    def _forward(self, tokens: list[int], phase: str) -> torch.Tensor:
+        generator = self.generator
+        chunk_size = self.cache.config.chunk_size
+        for start in range(0, len(tokens), chunk_size):
+            chunk = tokens[start : start + chunk_size]
+            caches = self.cache.prepare(len(chunk))
+            with generator.memory.phase(phase), experts_per_token_override(generator.model, self.experts_per_token):
+                logits = generator.model(
+                    torch.as_tensor(chunk, dtype=torch.int32, device=generator.device), caches=caches
+                )[-1]
+            self.tokens += chunk
+        if generator.router_telemetry is not None:
+            generator.router_telemetry.step()
+        return logits
+
+    def close(self):
+        self.cache.reset()
+        self.tokens = []
+
+
+@torch.inference_mode()
+def teacher_forced_logprobs(
+    model: Transformer, tokens: list[int], config: StreamingConfig
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Logprobs and greedy predictions of tokens[1:] when the tokens are fed to the model in streaming mode."""
+    assert len(tokens) > 1
+    cache = StreamingKVCache(model, config)
+    device = cache.k.device
+    inputs = torch.as_tensor(tokens[:-1], dtype=torch.int32, device=device)
+    targets = torch.as_tensor(tokens[1:], dtype=torch.long, device=device)
+    logprobs, predictions = [], []
+    for start in range(0, len(inputs), config.chunk_size):
+        chunk = inputs[start : start + config.chunk_size]
+        logits = model(chunk, caches=cache.prepare(len(chunk))).float()
+        logprobs.append(
+            torch.log_softmax(logits, dim=-1).gather(1, targets[start : start + len(chunk), None])[:, 0]
+        )
+        predictions.append(torch.argmax(logits, dim=-1))
+    return torch.cat(logprobs), torch.cat(predictions)
@@ -0,0 +1,185 @@
+"""Quality of the streaming mode on long transcripts.
+
+Every transcript is fed to the model with teacher forcing twice: with full
+attention and in streaming mode (see `gpt_oss.torch.streaming`). Both runs go
+through the same chunked forward passes, so they only differ once the
+streaming cache starts evicting tokens. The report compares the logprobs of
+the transcript tokens: perplexity of both runs, the mean absolute logprob
+difference and how often the greedy predictions agree, over all tokens and over
+the tokens whose context exceeds the cache capacity. The exit code is non-zero
+if streaming increases the mean negative log-likelihood by more than the
+threshold:
+
+python -m gpt_oss.torch.streaming_eval gpt-oss-20b/original/ transcript.txt --window 1024 4096 --sink-tokens 0 4
+"""
+
+import argparse
+import itertools
+import json
+import math
+import sys
+
+import torch
+
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.streaming import StreamingConfig, teacher_forced_logprobs
+
+
+def _metrics(full_logprobs, full_predictions, logprobs, predictions) -> dict:
+    if len(logprobs) == 0:
+        return {"num_tokens": 0}
+    full_nll = -full_logprobs.mean().item()
+    nll = -logprobs.mean().item()
+    return {
+        "num_tokens": len(logprobs),
+        "full_nll": full_nll,
+        "streaming_nll": nll,
+        "full_perplexity": math.exp(full_nll),
+        "streaming_perplexity": math.exp(nll),
+        "mean_abs_logprob_diff": (logprobs - full_logprobs).abs().mean().item(),
+        "top1_agreement": (predictions == full_predictions).float().mean().item(),
+    }
+
+
+def compare_streaming(model: Transformer, tokens: list[int], config: StreamingConfig, reference=None) -> dict:
+    """Compare streaming mode with full attention on one transcript.
+
+    `reference` are the full-attention results of `teacher_forced_logprobs`,
+    computed here if not given.
+    """
+    if reference is None:
+        reference = full_attention_logprobs(model, tokens, config.chunk_size)
+    full_logprobs, full_predictions = reference
+    logprobs, predictions = teacher_forced_logprobs(model, tokens, config)
+    # Target i is predicted from the first i + 1 tokens
+    first = config.capacity
+    return {
+        "all": _metrics(full_logprobs, full_predictions, logprobs, predictions),
+        "beyond_capacity": _metrics(
+            full_logprobs[first:], full_predictions[first:], logprobs[first:], predictions[first:]
+        ),
+    }
+
+
+def full_attention_logprobs(model: Transformer, tokens: list[int], chunk_size: int = 256):
+    # A window that holds the whole transcript never evicts, the margin only satisfies check_window
+    window = len(tokens) + model.config.sliding_window + chunk_size + 1
+    config = StreamingConfig(num_sink_tokens=0, window=window, evict_chunk=1, chunk_size=chunk_size)
+    return teacher_forced_logprobs(model, tokens, config)
+
+
+def main(args):
+    from gpt_oss.tokenizer import get_tokenizer
+
+    device = torch.device(args.device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    model = Transformer.from_checkpoint(args.checkpoint, device=device)
+    tokenizer = get_tokenizer()
+
+    results = []
+    failed = False
+    for path in args.transcripts:
+        with open(path) as f:
+            # Rendered conversations contain the special tokens of the harmony format
+            tokens = tokenizer.encode(f.read(), allowed_special="all")
+        if args.max_tokens is not None:
+            tokens = tokens[: args.max_tokens]
+        # Keyed by chunk size, which is capped by the window
+        references = {}
+        for window, num_sink_tokens in itertools.product(args.window, args.sink_tokens):
+            config = StreamingConfig(
+                num_sink_tokens=num_sink_tokens,
+                window=window,
+                evict_chunk=min(args.evict_chunk, window),
+                chunk_size=min(args.chunk_size, window),
+            )
+            if config.chunk_size not in references:
+                references[config.chunk_size] = full_attention_logprobs(model, tokens, config.chunk_size)
+            metrics = compare_streaming(model, tokens, config, references[config.chunk_size])
+            results.append({"transcript": path, "window": window, "sink_tokens": num_sink_tokens, **metrics})
+            m = metrics["all"]
+            nll_increase = m["streaming_nll"] - m["full_nll"]
+            regressed = nll_increase > args.threshold
+            failed |= regressed
+            print(
+                f"{path} window={window} sinks={num_sink_tokens}: "
+                f"ppl {m['full_perplexity']:.3f} -> {m['streaming_perplexity']:.3f} "
+                f"(nll {nll_increase:+.4f}), |dlogprob| {m['mean_abs_logprob_diff']:.4f}, "
+                f"top-1 agreement {m['top1_agreement']:.3f} over {m['num_tokens']} tokens"
+                + (" REGRESSED" if regressed else "")
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the streaming mode with full attention on long transcripts")
+    parser.add_argument(
+        "checkpoint",
+        metavar="DIR",
+        type=str,
+        help="Path to the SafeTensors checkpoint",
+    )
+    parser.add_argument(
+        "transcripts",
+        metavar="FILE",
+        type=str,
+        nargs="+",
+        help="Text files holding long transcripts, e.g. rendered harmony conversations",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        nargs="+",
+        default=[4096],
+        help="Recent-token windows to evaluate",
+    )
+    parser.add_argument(
+        "--sink-tokens",
+        type=int,
+        nargs="+",
+        default=[4],
+        help="Numbers of attention sink tokens to evaluate",
+    )
+    parser.add_argument(
+        "--evict-chunk",
+        type=int,
+        default=64,
+        help="Entries evicted at once when the cache is full",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=256,
+        help="Tokens per forward pass",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Only use the first tokens of every transcript",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.05,
+        help="Maximum allowed increase of the mean negative log-likelihood",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        help="Device to run on, CUDA if available by default",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        type=str,
+        default=None,
+        help="Write the metrics as JSON",
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(args))
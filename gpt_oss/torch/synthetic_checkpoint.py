@@ -0,0 +1,171 @@
+"""Write random checkpoints with the layout of the released gpt-oss weights.
+
+The tensor names, shapes and dtypes are taken from the torch Transformer, and
+MoE weights are stored as MXFP4 `.blocks`/`.scales` pairs like in the original
+checkpoints, so the result loads with `Checkpoint`, both `from_checkpoint`
+implementations and the Metal `create-local-model.py` converter. Useful to
+benchmark load paths and throughput without downloading the real weights:
+
+python -m gpt_oss.torch.synthetic_checkpoint --preset 20b --num-layers 4 /tmp/gpt-oss-synthetic/
+"""
+
+import argparse
+import dataclasses
+import itertools
+import json
+import os
+
+import torch
+from safetensors.torch import save_file
+
+from gpt_oss.torch.model import ModelConfig, Transformer
+from gpt_oss.torch.weights import BYTES_PER_BLOCK, PARAM_NAME_MAP
+
+PRESETS = {
+    "120b": ModelConfig(),
+    "20b": ModelConfig(num_hidden_layers=24, num_experts=32),
+    "tiny": ModelConfig(
+        num_hidden_layers=2,
+        num_experts=4,
+        experts_per_token=2,
+        vocab_size=201088,
+        hidden_size=64,
+        intermediate_size=64,
+        head_dim=64,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        sliding_window=8,
+    ),
+}
+
+# Values per MXFP4 block, sharing one E8M0 scale
+VALUES_PER_BLOCK = BYTES_PER_BLOCK * 2
+
+
+def _random_mxfp4(shape: torch.Size, generator: torch.Generator, scale_exponent: int) -> tuple[torch.Tensor, torch.Tensor]:
+    *prefix, n = shape
+    assert n % VALUES_PER_BLOCK == 0, f"Last dimension {n} is not a multiple of {VALUES_PER_BLOCK}"
+    blocks = torch.randint(
+        0, 256, (*prefix, n // VALUES_PER_BLOCK, BYTES_PER_BLOCK), dtype=torch.uint8, generator=generator
+    )
+    # E8M0 scales with a bias of 127, jittered so that not every block has the same magnitude
+    scales = torch.randint(
+        127 + scale_exponent - 1, 127 + scale_exponent + 2, (*prefix, n // VALUES_PER_BLOCK),
+        dtype=torch.uint8, generator=generator,
+    )
+    return blocks, scales
+
+
+def _checkpoint_tensors(name: str, param: torch.Tensor, generator: torch.Generator, std: float, scale_exponent: int):
+    match PARAM_NAME_MAP.get(name, name):
+        case (blocks_name, scales_name):
+            blocks, scales = _random_mxfp4(param.shape, generator, scale_exponent)
+            return {blocks_name: blocks, scales_name: scales}
+        case tensor_name:
+            assert not name.endswith(("mlp1_weight", "mlp2_weight")), (
+                f"{name} has no MXFP4 entry in PARAM_NAME_MAP, is num_hidden_layers too large?"
+            )
+            if name.endswith("norm.scale"):
+                tensor = 1.0 + std * torch.randn(param.shape, generator=generator)
+            else:
+                tensor = std * torch.randn(param.shape, generator=generator)
+            return {tensor_name: tensor.to(param.dtype)}
+
+
+def _checkpoint_bytes(name: str, param: torch.Tensor) -> int:
+    if isinstance(PARAM_NAME_MAP.get(name), tuple):
+        # MXFP4 weights take half a byte per value plus one scale byte per block
+        return param.numel() // 2 + param.numel() // VALUES_PER_BLOCK
+    return param.numel() * param.element_size()
+
+
+def write_synthetic_checkpoint(
+    path: str,
+    config: ModelConfig,
+    num_shards: int = 1,
+    seed: int = 0,
+    std: float = 0.02,
+    scale_exponent: int = -6,
+) -> list[str]:
+    """Write config.json and the weights split into at most `num_shards` safetensors files of similar size."""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "config.json"), "w") as f:
+        json.dump(dataclasses.asdict(config), f, indent=2)
+
+    # Build the model on the meta device to get the parameter names and shapes without allocating them
+    model = Transformer(config, device=torch.device("meta"))
+    params = list(model.named_parameters())
+    sizes = [_checkpoint_bytes(name, param) for name, param in params]
+    shard_bytes = sum(sizes) / num_shards
+    # Assign whole parameters to shards by their offset in the concatenated checkpoint
+    offsets = [0, *itertools.accumulate(sizes)][:-1]
+    shard_ids = [min(num_shards - 1, int(offset // shard_bytes)) for offset in offsets]
+    # A parameter larger than a shard leaves the following shard empty, so renumber the used ones
+    used = sorted(set(shard_ids))
+    filenames = [f"model--{i + 1:05d}-of-{len(used):05d}.safetensors" for i in range(len(used))]
+
+    generator = torch.Generator().manual_seed(seed)
+    for shard_idx, filename in zip(used, filenames):
+        # Only one shard is materialized at a time
+        shard = {}
+        for (name, param), param_shard in zip(params, shard_ids):
+            if param_shard == shard_idx:
+                shard |= _checkpoint_tensors(name, param, generator, std, scale_exponent)
+        save_file(shard, os.path.join(path, filename), metadata={"format": "pt"})
+    return filenames
+
+
+def main(args):
+    overrides = {
+        field.name: getattr(args, field.name)
+        for field in dataclasses.fields(ModelConfig)
+        if getattr(args, field.name, None) is not None
+    }
+    config = dataclasses.replace(PRESETS[args.preset], **overrides)
+    filenames = write_synthetic_checkpoint(args.path, config, args.num_shards, args.seed)
+    print(f"Wrote {len(filenames)} shards to {args.path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a random checkpoint with the gpt-oss tensor layout")
+    parser.add_argument(
+        "path",
+        metavar="DIR",
+        type=str,
+        help="Output checkpoint directory",
+    )
+    parser.add_argument(
+        "--preset",
+        type=str,
+        default="20b",
+        choices=list(PRESETS),
+        help="Model config to start from",
+    )
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=4,
+        help="Number of safetensors files",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed",
+    )
+    for flags, dest, help in [
+        (("--num-hidden-layers", "--num-layers"), "num_hidden_layers", "Number of transformer blocks"),
+        (("--num-experts",), "num_experts", "Number of experts per MoE block"),
+        (("--experts-per-token",), "experts_per_token", "Experts selected per token"),
+        (("--vocab-size",), "vocab_size", "Vocabulary size"),
+        (("--hidden-size",), "hidden_size", "Model width, a multiple of 32"),
+        (("--intermediate-size",), "intermediate_size", "Expert width, a multiple of 32"),
+        (("--head-dim",), "head_dim", "Attention head size"),
+        (("--num-attention-heads",), "num_attention_heads", "Number of query heads"),
+        (("--num-key-value-heads",), "num_key_value_heads", "Number of key/value heads"),
+        (("--sliding-window",), "sliding_window", "Sliding window of every other layer"),
+    ]:
+        parser.add_argument(*flags, dest=dest, type=int, default=None, help=help)
+    args = parser.parse_args()
+
+    main(args)
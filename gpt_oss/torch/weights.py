@@ -1,5 +1,8 @@
+import json
 import math
+import mmap
 import os
+import struct
 
 import torch
 from safetensors import safe_open
@@ -13,6 +16,19 @@ FP4_VALUES = [
     -0.0, -0.5, -1.0, -1.5, -2.0, -3.0, -4.0, -6.0,
 ]
 
+SAFETENSORS_DTYPES = {
+    "BOOL": torch.bool,
+    "U8": torch.uint8,
+    "I8": torch.int8,
+    "I16": torch.int16,
+    "I32": torch.int32,
+    "I64": torch.int64,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F32": torch.float32,
+    "F64": torch.float64,
+}
+
 # Map the names assumed in this implementation to the checkpoint names.
 PARAM_NAME_MAP = {
     f"block.{n}.mlp.mlp1_bias": f"block.{n}.mlp.mlp1_bias" for n in range(36)
@@ -25,6 +41,87 @@ PARAM_NAME_MAP = {
 }
 
 
+def dequantize_mxfp4(
+    blocks: torch.Tensor,
+    scales: torch.Tensor,
+    *,
+    dtype: torch.dtype = torch.bfloat16,
+    rows_per_chunk: int = 16384 * 512,
+) -> torch.Tensor:
+    scales = scales.to(torch.int32) - 127
+
+    assert blocks.shape[:-1] == scales.shape, (
+        f"{blocks.shape=} does not match {scales.shape=}"
+    )
+
+    lut = torch.tensor(FP4_VALUES, dtype=dtype, device=blocks.device)
+
+    *prefix_shape, G, B = blocks.shape
+    rows_total   = math.prod(prefix_shape) * G
+
+    blocks = blocks.reshape(rows_total, B)
+    scales = scales.reshape(rows_total, 1)
+
+    out = torch.empty(rows_total, B * 2, dtype=dtype, device=blocks.device)
+
+    for r0 in range(0, rows_total, rows_per_chunk):
+        r1 = min(r0 + rows_per_chunk, rows_total)
+
+        blk = blocks[r0:r1]
+        exp = scales[r0:r1]
+
+        # nibble indices -> int64
+        idx_lo = (blk & 0x0F).to(torch.long)
+        idx_hi = (blk >> 4).to(torch.long)
+
+        sub = out[r0:r1]
+        sub[:, 0::2] = lut[idx_lo]
+        sub[:, 1::2] = lut[idx_hi]
+
+        torch.ldexp(sub, exp, out=sub)
+        del idx_lo, idx_hi, blk, exp
+
+    return out.reshape(*prefix_shape, G, B * 2).view(*prefix_shape, G * B * 2)
+
+
+def assign_parameter(model: torch.nn.Module, name: str, tensor: torch.Tensor):
+    """Replace the parameter `name` of a model built on the meta device by `tensor`, without a copy."""
+    module_name, _, param_name = name.rpartition(".")
+    module = model.get_submodule(module_name)
+    param = getattr(module, param_name)
+    assert param.shape == tensor.shape, f"{name=} {param.shape=} {tensor.shape=}"
+    if tensor.dtype != param.dtype:
+        tensor = tensor.to(param.dtype)
+    module.register_parameter(param_name, torch.nn.Parameter(tensor, requires_grad=False))
+
+
+def map_safetensors(path: str) -> tuple[int, dict, mmap.mmap]:
+    """Map a safetensors file into memory; returns the start of its data, its header and the mapping."""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        # A private mapping: pages are shared with the page cache until they are written to
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return 8 + header_size, header, buffer
+
+
+def get_mapped_tensor(mapped_file: tuple[int, dict, mmap.mmap], name: str) -> torch.Tensor:
+    """A view into a file mapped by `map_safetensors`, so that CPU tensors are paged in on use instead of copied."""
+    data_start, header, buffer = mapped_file
+    info = header[name]
+    dtype = SAFETENSORS_DTYPES[info["dtype"]]
+    begin, end = info["data_offsets"]
+    if begin == end:
+        return torch.empty(info["shape"], dtype=dtype)
+    offset = data_start + begin
+    if offset % dtype.itemsize != 0:
+        # The header length is not padded: a view would be misaligned, so copy the bytes to an aligned tensor
+        data = torch.frombuffer(buffer, dtype=torch.uint8, count=end - begin, offset=offset).clone()
+        return data.view(dtype).view(info["shape"])
+    tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=offset)
+    return tensor.view(info["shape"])
+
+
 class Checkpoint:
     def __init__(self, path: str, device: torch.device):
         device_str = (
@@ -48,6 +145,7 @@ class Checkpoint:
                     tensor_name_to_file[key] = safetensor_file
 
         self.tensor_name_to_file = tensor_name_to_file
+        self.mapped_files = {}
 
     def get(self, name: str) -> torch.Tensor:
         match PARAM_NAME_MAP.get(name, name):
@@ -60,11 +158,41 @@ class Checkpoint:
 
     def _get_tensor(self, name: str) -> str:
         assert name in self.tensor_name_to_file, f"Tensor {name} not found in checkpoint."
+        if self.device_str == "cpu":
+            return self._get_mapped_tensor(name)
         with safe_open(
             self.tensor_name_to_file[name], framework="pt", device=self.device_str
         ) as f:
             return f.get_tensor(name)
 
+    def _get_mapped_tensor(self, name: str) -> torch.Tensor:
+        path = self.tensor_name_to_file[name]
+        if path not in self.mapped_files:
+            self.mapped_files[path] = map_safetensors(path)
+        return get_mapped_tensor(self.mapped_files[path], name)
+
+    def get_mxfp4(self, name: str) -> tuple[torch.Tensor, torch.Tensor]:
+        """The raw blocks [..., groups, 16] and E8M0 scales [..., groups] of an MoE weight, not dequantized."""
+        blocks_name, scales_name = PARAM_NAME_MAP[name]
+        return self._get_tensor(blocks_name), self._get_tensor(scales_name)
+
+    def get_expert(self, name: str, expert: int) -> torch.Tensor:
+        """Load the weights of a single expert, keeping a leading expert dimension of size 1."""
+        match PARAM_NAME_MAP.get(name, name):
+            case (blocks_name, scales_name):
+                blocks = self._get_tensor_slice(blocks_name, expert)
+                scales = self._get_tensor_slice(scales_name, expert)
+                return dequantize_mxfp4(blocks, scales, dtype=torch.bfloat16)
+            case tensor_name:
+                return self._get_tensor_slice(tensor_name, expert)
+
+    def _get_tensor_slice(self, name: str, index: int) -> torch.Tensor:
+        assert name in self.tensor_name_to_file, f"Tensor {name} not found in checkpoint."
+        with safe_open(
+            self.tensor_name_to_file[name], framework="pt", device=self.device_str
+        ) as f:
+            return f.get_slice(name)[index : index + 1]
+
     def _get_mxfp4_tensor(
         self,
         blocks_name: str,
@@ -81,40 +209,8 @@ class Checkpoint:
         )
 
         blocks = self._get_tensor(blocks_name)
-        scales = self._get_tensor(scales_name).to(torch.int32) - 127
-
-        assert blocks.shape[:-1] == scales.shape, (
-            f"{blocks.shape=} does not match {scales.shape=}"
-        )
-
-        lut = torch.tensor(FP4_VALUES, dtype=dtype, device=blocks.device)
-
-        *prefix_shape, G, B = blocks.shape
-        rows_total   = math.prod(prefix_shape) * G
-
-        blocks = blocks.reshape(rows_total, B)
-        scales = scales.reshape(rows_total, 1)
-
-        out = torch.empty(rows_total, B * 2, dtype=dtype, device=blocks.device)
-
-        for r0 in range(0, rows_total, rows_per_chunk):
-            r1 = min(r0 + rows_per_chunk, rows_total)
-
-            blk = blocks[r0:r1]
-            exp = scales[r0:r1]
-
-            # nibble indices -> int64
-            idx_lo = (blk & 0x0F).to(torch.long)
-            idx_hi = (blk >> 4).to(torch.long)
-
-            sub = out[r0:r1]
-            sub[:, 0::2] = lut[idx_lo]
-            sub[:, 1::2] = lut[idx_hi]
-
-            torch.ldexp(sub, exp, out=sub)
-            del idx_lo, idx_hi, blk, exp
-
-        return out.reshape(*prefix_shape, G, B * 2).view(*prefix_shape, G * B * 2)
+        scales = self._get_tensor(scales_name)
+        return dequantize_mxfp4(blocks, scales, dtype=dtype, rows_per_chunk=rows_per_chunk)
 
     def _get_mxfp4_tensor_copy(self, blocks_name: str, scales_name: str, dtype: torch.dtype = torch.bfloat16):
         "short version that uses a lot of memory"
@@ -13,6 +13,8 @@ import triton
 import triton.language as tl
 from triton.tools.tensor_descriptor import TensorDescriptor
 
+from gpt_oss.torch.attention_backends import attention_ref, register_attention_backend
+
 
 
 @triton.jit
@@ -35,11 +37,12 @@ def _attn_fwd(
     BANDWIDTH: tl.constexpr,
 ):
     tl.static_assert(BLOCK_N <= HEAD_DIM)
-    start_q = tl.load(Start_q).to(tl.int32)
     start_m = tl.program_id(0)
     off_hz = tl.program_id(1)
     off_z = off_hz // H
     off_h = off_hz % H
+    # Every batch row starts at its own position
+    start_q = tl.load(Start_q + off_z).to(tl.int32)
 
     # load attention sinks
     if Sinks is not None:
@@ -104,8 +107,9 @@ def _attn_fwd(
 class _attention(torch.autograd.Function):
     @staticmethod
     def forward(ctx, q, k, v, sinks, sm_scale, bandwidth, start_q):
-        assert len(start_q) == 1
         bs, n_ctx, n_kv_heads, repeat_kv, HEAD_DIM_Q = q.shape
+        assert len(start_q) in (1, bs)
+        start_q = start_q.expand(bs).contiguous()
         bs, n_kv_ctx, n_kv_heads, HEAD_DIM_K = k.shape
         bs, n_kv_ctx, n_kv_heads, HEAD_DIM_V = v.shape
         n_heads = n_kv_heads * repeat_kv
@@ -162,45 +166,12 @@ class _attention(torch.autograd.Function):
 attention = _attention.apply
 
 
-def attention_ref(
-    query: torch.Tensor,
-    key: torch.Tensor,
-    value: torch.Tensor,
-    sinks: torch.Tensor,
-    sm_scale: float = 0.125,
-    sliding_window: int | None = None,
-    start_q: torch.LongTensor = 0,
-):
-    batch_size, num_queries, num_key_value_heads, num_key_value_groups, head_dim = query.shape
-    batch_size, num_keys, num_key_value_heads, head_dim = key.shape
-
-    sinks = sinks.view(1, num_key_value_heads, num_key_value_groups, 1, 1).float()
-    key = key.unsqueeze(3)
-    value = value.unsqueeze(3)
-
-    pos_keys = torch.arange(num_keys, device=query.device)
-    pos_queries = torch.arange(num_queries, device=query.device) + start_q
-    mask = pos_keys[None, :] > pos_queries[:, None]
-    mask = mask.float().masked_fill(mask, float("-inf"))
-
-    if sliding_window:
-        too_old = pos_keys[None, :] < (pos_queries[:, None] - sliding_window + 1)
-        mask.masked_fill_(too_old, float("-inf"))
-
-    logits = torch.einsum("bqhmd,bkhmd->bhmqk", query.float(), key.float()) * sm_scale
-    logits = logits + mask[None, None, None, :, :]
-
-    logits_max = torch.max(logits, dim=-1, keepdim=True).values
-    logits_or_sinks_max = torch.maximum(sinks, logits_max)
-    sinks = torch.exp(sinks - logits_or_sinks_max)
-    unnormalized_scores = torch.exp(logits - logits_or_sinks_max)
-    normalizer = unnormalized_scores.sum(dim=-1, keepdim=True) + sinks
-    scores = unnormalized_scores / normalizer
+def _supports_triton(query: torch.Tensor, key: torch.Tensor) -> bool:
+    # Single-token decode is served better by the reference implementation
+    return query.is_cuda and query.shape[1] > 1 and query.shape[-1] in {16, 32, 64, 128, 256}
 
-    output = torch.einsum("bhmqk,bkhmd->bqhmd", scores, value.float())
 
-    output = output.reshape(batch_size, num_queries, num_key_value_heads * num_key_value_groups * head_dim).bfloat16()
-    return output
+register_attention_backend("triton", supports=_supports_triton)(attention)
 
 
 @pytest.mark.parametrize("batch_size", [1, 2])
@@ -0,0 +1,182 @@
+"""Contiguous KV cache of the triton model.
+
+Entries [0, offset) of every layer hold the keys and values of the tokens so
+far. Entries at and after the offset are stale, either zero or written by an
+earlier `extend`, so always finite: every attention backend masks keys after
+the position of the query (see `attention_ref`), so they get a weight of
+exactly zero, and the next `extend` overwrites them. Truncating the
+cache therefore only moves the offset, nothing is written to the KV tensors.
+
+Every batch row (slot) has its own offset, so the rows can hold different
+conversations of different lengths; rope and attention take the position of
+the first query per row. `CacheSlots` assigns the slots to conversations.
+
+In streaming mode the caches keep a float32 copy of the keys, which `evict`
+re-rotates so that the rounding of the bfloat16 keys does not compound.
+
+Decode steps only read the keys up to `num_keys`, a host-side bound on the
+length of every row that is baked into the CUDA graphs captured with it (see
+`attention_decode`); it is the capacity unless the caller lowers it.
+"""
+
+import itertools
+
+import torch
+
+from gpt_oss.torch.kv_snapshot import common_prefix_length
+from gpt_oss.torch.streaming import evict_kv
+
+
+class Cache:
+    def __init__(self, batch_size, n_ctx, n_kv_heads, d_head=64, device: torch.device | None = None, fp32_keys=False):
+        self.k = torch.zeros((batch_size, n_ctx, n_kv_heads, d_head), dtype=torch.bfloat16, device=device)
+        self.v = torch.zeros((batch_size, n_ctx, n_kv_heads, d_head), dtype=torch.bfloat16, device=device)
+        self.k_fp32 = torch.zeros(self.k.shape, dtype=torch.float32, device=device) if fp32_keys else None
+        self.offset = torch.zeros((batch_size,), dtype=torch.long, device=device)
+        self.num_keys = n_ctx
+
+    def slot(self, i: int) -> "Cache":
+        """View of batch row i, e.g. to prefill one conversation; it shares the storage and offset of this cache."""
+        view = Cache.__new__(Cache)
+        view.k, view.v, view.offset = self.k[i : i + 1], self.v[i : i + 1], self.offset[i : i + 1]
+        view.k_fp32 = None if self.k_fp32 is None else self.k_fp32[i : i + 1]
+        view.num_keys = self.num_keys
+        return view
+
+    def reset(self, slot: int | None = None):
+        rows = slice(None) if slot is None else slice(slot, slot + 1)
+        self.k[rows].zero_()
+        self.v[rows].zero_()
+        if self.k_fp32 is not None:
+            self.k_fp32[rows].zero_()
+        self.offset[rows].zero_()
+
+    def repeat_interleave(self, n):
+        """Repeat each cache entry n times along the batch dimension."""
+        self.k = self.k.repeat_interleave(n, dim=0)
+        self.v = self.v.repeat_interleave(n, dim=0)
+        if self.k_fp32 is not None:
+            self.k_fp32 = self.k_fp32.repeat_interleave(n, dim=0)
+        self.offset = self.offset.repeat_interleave(n, dim=0)
+
+    def truncate(self, n_ctx, slot: int | None = None):
+        """Truncate the cache (or one slot) to the first n_ctx tokens, in O(1): the entries after them become stale."""
+        assert n_ctx <= self.k.shape[1]
+        rows = slice(None) if slot is None else slice(slot, slot + 1)
+        self.offset[rows] = n_ctx
+        return self.k, self.v
+
+    def restore(self, k, v, slot: int | None = None):
+        """Load the keys and values [n_ctx, n_kv_heads, d_head] of a prefix into every batch entry, or into one slot."""
+        n_ctx = k.shape[0]
+        rows = slice(None) if slot is None else slice(slot, slot + 1)
+        self.k[rows, :n_ctx] = k
+        self.v[rows, :n_ctx] = v
+        if self.k_fp32 is not None:
+            self.k_fp32[rows, :n_ctx] = k
+        self.offset[rows] = n_ctx
+
+    def evict(self, num_sink_tokens, num_cached, n, inv_freq):
+        """Evict n entries after the first num_sink_tokens, see `gpt_oss.torch.streaming`."""
+        evict_kv(self.k, self.v, num_sink_tokens, num_cached, n, inv_freq, self.k_fp32)
+        self.offset.sub_(n)
+
+    def extend(self, k, v):
+        batch_size, n_ctx, *_rest = k.shape
+        assert batch_size == self.k.shape[0]
+        # Every row appends at its own offset
+        rows = torch.arange(batch_size, device=k.device, dtype=torch.long)[:, None]
+        indices = torch.arange(0, n_ctx, device=k.device, dtype=torch.long) + self.offset[:, None]
+        self.k[rows, indices] = k
+        self.v[rows, indices] = v
+        if self.k_fp32 is not None:
+            self.k_fp32[rows, indices] = k.float()
+        self.offset.add_(n_ctx)
+        return self.k, self.v
+
+
+class NoFreeSlotError(RuntimeError):
+    pass
+
+
+class CacheSlots:
+    """Host-side bookkeeping of the slots of multi-slot caches: the tokens each one holds and who uses it.
+
+    A conversation keeps its slot across calls: a busy slot whose tokens are a
+    prefix of the tokens of a call continues that conversation. New
+    conversations take the free slot sharing the longest prefix with them, so a
+    released conversation that comes back (e.g. the next turn) skips most of its
+    prefill, or the least recently used busy slot if there is no free one.
+
+    One entry of every slot is kept free: batched decode steps append a token
+    to every slot, including the ones that are not decoding, and roll it back
+    afterwards.
+    """
+
+    def __init__(self, num_slots: int, n_ctx: int, steal: bool = True):
+        self.num_slots = num_slots
+        self.n_ctx = n_ctx
+        # Take over the least recently used busy slot when all are busy, instead of raising NoFreeSlotError
+        self.steal = steal
+        self.tokens: list[list[int]] = [[] for _ in range(num_slots)]
+        self.busy = [False] * num_slots
+        self.last_used = [0] * num_slots
+        self.clock = itertools.count(1)
+
+    @property
+    def max_tokens(self) -> int:
+        return self.n_ctx - 1
+
+    @property
+    def num_free_slots(self) -> int:
+        return self.busy.count(False)
+
+    def lengths(self) -> list[int]:
+        return [len(tokens) for tokens in self.tokens]
+
+    def find(self, tokens: list[int]) -> int | None:
+        """The busy slot continuing the conversation `tokens`, if any."""
+        candidates = [
+            slot
+            for slot in range(self.num_slots)
+            if self.busy[slot] and self.tokens[slot] and tokens[: len(self.tokens[slot])] == self.tokens[slot]
+        ]
+        return max(candidates, key=lambda slot: len(self.tokens[slot]), default=None)
+
+    def acquire(self, tokens: list[int], new: bool = False) -> tuple[int, int]:
+        """Slot for the conversation `tokens` and the number of its tokens already in that slot.
+
+        A `new` conversation does not continue a busy slot, e.g. a second response to the same prompt.
+        """
+        slot = None if new else self.find(tokens)
+        if slot is None:
+            free = [slot for slot in range(self.num_slots) if not self.busy[slot]]
+            if free:
+                slot = max(free, key=lambda slot: (common_prefix_length(self.tokens[slot], tokens), -self.last_used[slot]))
+            elif self.steal:
+                slot = min(range(self.num_slots), key=lambda slot: self.last_used[slot])
+            else:
+                raise NoFreeSlotError(f"All {self.num_slots} cache slots are in use")
+        self.busy[slot] = True
+        self.last_used[slot] = next(self.clock)
+        return slot, common_prefix_length(self.tokens[slot], tokens)
+
+    def release(self, slot: int):
+        """Make a slot available to other conversations; its tokens stay cached until it is reused."""
+        self.busy[slot] = False
+
+    def truncate(self, slot: int, n: int):
+        assert n <= len(self.tokens[slot])
+        del self.tokens[slot][n:]
+
+    def append(self, slot: int, tokens: list[int]):
+        assert len(self.tokens[slot]) + len(tokens) <= self.max_tokens, (
+            f"Slot {slot} holds at most {self.max_tokens} tokens"
+        )
+        self.tokens[slot] += tokens
+
+    def sync(self, caches: list[Cache]):
+        """Set the offsets of the caches to the lengths of the slots, e.g. to roll back a batched decode step."""
+        offsets = torch.as_tensor(self.lengths(), dtype=torch.long)
+        for cache in caches:
+            cache.offset.copy_(offsets)
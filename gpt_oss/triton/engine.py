@@ -0,0 +1,86 @@
+"""`ModelRunner` of the triton model, to serve it with `gpt_oss.torch.engine.Engine`.
+
+Every sequence holds one slot (batch row) of the triton caches, taken when it
+is first scheduled and returned when it finishes or is preempted, so at most
+`num_slots` sequences have KV state at a time; the others wait in the engine.
+Prefill chunks run one slot at a time. When every sequence of a step decodes
+a single token, the step is one forward pass over all slots, and the rows
+that are not part of it are rolled back afterwards.
+"""
+
+from dataclasses import dataclass
+
+import torch
+
+from gpt_oss.torch.engine import ModelRunner
+from gpt_oss.triton.cache import Cache
+
+
+@dataclass
+class SlotHandle:
+    slot: int | None = None
+    num_tokens: int = 0
+
+
+class TritonModelRunner(ModelRunner):
+    def __init__(self, model, num_slots: int, context: int):
+        self.model = model
+        self.device = model.embedding.weight.device
+        self.context = context
+        self.caches = [
+            Cache(num_slots, context, model.config.num_key_value_heads, model.config.head_dim, device=self.device)
+            for _ in range(len(model.block))
+        ]
+        self.free_slots = list(range(num_slots))
+
+    @property
+    def max_context(self) -> int:
+        # Batched decode steps append a token to every row, including the ones that are rolled back
+        return self.context - 1
+
+    def new_sequence(self):
+        return SlotHandle()
+
+    def free(self, handle):
+        if handle.slot is not None:
+            self.free_slots.append(handle.slot)
+        handle.slot, handle.num_tokens = None, 0
+
+    def can_append(self, handles, num_new_tokens) -> bool:
+        num_new_slots = sum(handle.slot is None for handle in handles)
+        fit = all(handle.num_tokens + n <= self.max_context for handle, n in zip(handles, num_new_tokens))
+        return fit and num_new_slots <= len(self.free_slots)
+
+    def forward(self, handles, tokens) -> torch.Tensor:
+        for handle in handles:
+            if handle.slot is None:
+                handle.slot = self.free_slots.pop()
+                for cache in self.caches:
+                    cache.truncate(0, slot=handle.slot)
+        if all(len(t) == 1 for t in tokens):
+            logits = self._decode(handles, [t[0] for t in tokens])
+        else:
+            logits = torch.stack([self._prefill(handle, t) for handle, t in zip(handles, tokens)])
+        for handle, t in zip(handles, tokens):
+            handle.num_tokens += len(t)
+        return logits
+
+    def _prefill(self, handle: SlotHandle, tokens: list[int]) -> torch.Tensor:
+        logits = self.model(
+            torch.as_tensor(tokens, dtype=torch.int32, device=self.device)[None, :],
+            caches=[cache.slot(handle.slot) for cache in self.caches],
+            logits_indices=torch.tensor([len(tokens) - 1], device=self.device),
+        )
+        return logits[0, -1]
+
+    def _decode(self, handles: list[SlotHandle], tokens: list[int]) -> torch.Tensor:
+        slots = torch.tensor([handle.slot for handle in handles], device=self.device)
+        input_tokens = torch.zeros(self.caches[0].k.shape[0], 1, dtype=torch.int32, device=self.device)
+        input_tokens[slots, 0] = torch.tensor(tokens, dtype=torch.int32, device=self.device)
+        offsets = self.caches[0].offset.clone()
+        offsets[slots] += 1
+        logits = self.model(input_tokens, caches=self.caches)[:, -1]
+        # Roll back the dummy tokens of the other rows
+        for cache in self.caches:
+            cache.offset.copy_(offsets)
+        return logits[slots]
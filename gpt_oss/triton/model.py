@@ -3,12 +3,21 @@ import math
 import os
 
 import torch
-from torch.profiler import record_function
 
+from gpt_oss.torch.attention_backends import attention, attention_decode, decode_num_keys
+from gpt_oss.torch.fast_mode import experts_per_token_override, get_experts_per_token
+from gpt_oss.torch.kv_snapshot import KVSnapshot, common_prefix_length, load_kv_snapshot, save_kv_snapshot
+from gpt_oss.torch.memory import MemoryTracker
 from gpt_oss.torch.model import ModelConfig, RMSNorm
-from gpt_oss.torch.weights import Checkpoint
-from gpt_oss.triton.attention import attention, attention_ref
-from gpt_oss.triton.moe import quantize_mx4, moe
+from gpt_oss.torch.profiling import region
+from gpt_oss.torch.router_telemetry import attach_router_telemetry
+from gpt_oss.torch.scoring import TokenScore, score_logits, scoring_inputs
+from gpt_oss.torch.streaming import StreamingConfig
+from gpt_oss.torch.weights import Checkpoint, assign_parameter
+# Registers the triton kernel as an attention backend
+import gpt_oss.triton.attention  # noqa: F401
+from gpt_oss.triton.cache import Cache
+from gpt_oss.triton.moe import quantize_mx4, repack_mx4, moe
 
 
 class RotaryEmbedding(torch.nn.Module):
@@ -18,7 +27,6 @@ class RotaryEmbedding(torch.nn.Module):
         base: int,
         dtype: torch.dtype,
         initial_context_length: int = 4096,
-        max_context_length: int = 131072,
         scaling_factor: float = 1.0,
         ntk_alpha: float = 1.0,
         ntk_beta: float = 32.0,
@@ -29,12 +37,33 @@ class RotaryEmbedding(torch.nn.Module):
         self.base = base
         self.dtype = dtype
         self.initial_context_length = initial_context_length
-        self.max_context_length = max_context_length
         self.scaling_factor = scaling_factor
         self.ntk_alpha = ntk_alpha
         self.ntk_beta = ntk_beta
+        self.set_device(device)
+
+    def set_device(self, device: torch.device | None):
+        """Move to a device, dropping the tables computed so far."""
         self.device = device
-        self.cos, self.sin = self._compute_cos_sin(0, self.max_context_length)
+        self.cos = torch.empty((0, self.head_dim // 2), dtype=torch.float32, device=device)
+        self.sin = torch.empty_like(self.cos)
+        self.retired_tables = []
+        # Whether a CUDA graph reads the current tables
+        self.captured = False
+
+    def reserve(self, num_positions: int):
+        """Extend the cos/sin tables to cover positions [0, num_positions)."""
+        num_computed = self.cos.shape[0]
+        if num_positions > num_computed:
+            # Doubling, so that growing one position at a time copies the tables a logarithmic number of times
+            num_positions = max(num_positions, 2 * num_computed)
+            cos, sin = self._compute_cos_sin(num_computed, num_positions - num_computed)
+            # CUDA graphs captured earlier keep reading the previous tables, which must stay allocated
+            if self.captured:
+                self.retired_tables.append((self.cos, self.sin))
+                self.captured = False
+            self.cos = torch.cat([self.cos, cos])
+            self.sin = torch.cat([self.sin, sin])
 
     def _compute_concentration_and_inv_freq(self) -> torch.Tensor:
         """See YaRN paper: https://arxiv.org/abs/2309.00071"""
@@ -84,21 +113,21 @@ class RotaryEmbedding(torch.nn.Module):
         sin = freqs.sin() * concentration
         return cos, sin
 
-    @record_function("rotate")
+    @region("rotate")
     def _rotate(
         self,
         x: torch.Tensor,
         cos: torch.Tensor,
         sin: torch.Tensor,
     ) -> torch.Tensor:
-        cos = cos[None, :, None, :].to(x.dtype)
-        sin = sin[None, :, None, :].to(x.dtype)
+        cos = cos[:, :, None, :].to(x.dtype)
+        sin = sin[:, :, None, :].to(x.dtype)
         x1, x2 = torch.chunk(x, 2, dim=-1)
         o1 = x1 * cos - x2 * sin
         o2 = x2 * cos + x1 * sin
         return torch.cat((o1, o2), dim=-1)
 
-    @record_function("rope")
+    @region("rope")
     def forward(
         self,
         query: torch.Tensor,
@@ -108,50 +137,30 @@ class RotaryEmbedding(torch.nn.Module):
         batch_size, num_tokens, num_heads, head_dim = query.shape
         batch_size, num_tokens, num_key_value_heads, head_dim = key.shape
 
-        idx = torch.arange(num_tokens, device=query.device, dtype=torch.long) + offset
-        idx = idx % self.max_context_length
-        cos = self.cos.index_select(0, idx)
-        sin = self.sin.index_select(0, idx)
+        # offset holds the position of the first token, either shared by the batch or one per row;
+        # the tables must already cover all positions, see `reserve`
+        if self.cos.is_cuda and torch.cuda.is_current_stream_capturing():
+            self.captured = True
+        idx = torch.arange(num_tokens, device=query.device, dtype=torch.long) + offset[:, None]
+        cos = self.cos.index_select(0, idx.flatten()).view(*idx.shape, -1)
+        sin = self.sin.index_select(0, idx.flatten()).view(*idx.shape, -1)
 
         query = self._rotate(query, cos, sin)
         key = self._rotate(key, cos, sin)
         return query, key
 
 
-class Cache:
-    def __init__(self, batch_size, n_ctx, n_kv_heads, d_head=64, device: torch.device | None = None):
-        self.k = torch.zeros((batch_size, n_ctx, n_kv_heads, d_head), dtype=torch.bfloat16, device=device)
-        self.v = torch.zeros((batch_size, n_ctx, n_kv_heads, d_head), dtype=torch.bfloat16, device=device)
-        self.offset = torch.zeros((1,), dtype=torch.long, device=device)
-
-    def reset(self):
-        self.k.zero_()
-        self.v.zero_()
-        self.offset.zero_()
-
-    def repeat_interleave(self, n):
-        """Repeat each cache entry n times along the batch dimension."""
-        self.k = self.k.repeat_interleave(n, dim=0)
-        self.v = self.v.repeat_interleave(n, dim=0)
-
-    def truncate(self, n_ctx):
-        """Truncate the cache to the first n_ctx tokens."""
-        batch_size, _, n_kv_heads, d_head = self.k.shape
-        assert batch_size == self.v.shape[0]
-        assert n_ctx <= self.k.shape[1]
-        self.k[:, n_ctx:, :, :].zero_()
-        self.v[:, n_ctx:, :, :].zero_()
-        self.offset.fill_(n_ctx)
-        return self.k, self.v
-
-    def extend(self, k, v):
-        batch_size, n_ctx, *_rest = k.shape
-        assert batch_size == self.k.shape[0]
-        indices = torch.arange(0, n_ctx, device=k.device, dtype=torch.long) + self.offset
-        self.k.index_copy_(1, indices, k)
-        self.v.index_copy_(1, indices, v)
-        self.offset.add_(n_ctx)
-        return self.k, self.v
+def make_rope(config: ModelConfig, device: torch.device | None = None) -> RotaryEmbedding:
+    return RotaryEmbedding(
+        config.head_dim,
+        config.rope_theta,
+        torch.float32,
+        initial_context_length=config.initial_context_length,
+        scaling_factor=config.rope_scaling_factor,
+        ntk_alpha=config.rope_ntk_alpha,
+        ntk_beta=config.rope_ntk_beta,
+        device=device,
+    )
 
 
 class AttentionBlock(torch.nn.Module):
@@ -160,6 +169,7 @@ class AttentionBlock(torch.nn.Module):
         config: ModelConfig,
         layer_idx: int = 0,
         device: torch.device | None = None,
+        rope: RotaryEmbedding | None = None,
     ):
         super().__init__()
         self.head_dim = config.head_dim
@@ -185,23 +195,15 @@ class AttentionBlock(torch.nn.Module):
             dtype=torch.bfloat16,
         )
         self.sm_scale = 1 / math.sqrt(config.head_dim)
-        self.rope = RotaryEmbedding(
-            config.head_dim,
-            config.rope_theta,
-            torch.float32,
-            initial_context_length=config.initial_context_length,
-            scaling_factor=config.rope_scaling_factor,
-            ntk_alpha=config.rope_ntk_alpha,
-            ntk_beta=config.rope_ntk_beta,
-            device=device,
-        )
+        # The Transformer passes one rope shared by all layers
+        self.rope = rope if rope is not None else make_rope(config, device)
 
-    @record_function("attn")
+    @region("attn")
     def forward(self, x: torch.Tensor, cache: Cache | None = None) -> torch.Tensor:
         batch_size, n_ctx, dim = x.shape
 
         t = self.norm(x)
-        with record_function("qkv"):
+        with region("qkv"):
             qkv = self.qkv(t)
             qkv_parts = (
                 self.num_attention_heads * self.head_dim,
@@ -215,6 +217,8 @@ class AttentionBlock(torch.nn.Module):
         k = k.view(batch_size, n_ctx, self.num_key_value_heads, self.head_dim)
         v = v.view(batch_size, n_ctx, self.num_key_value_heads, self.head_dim)
 
+        # Positions go up to the capacity of the cache; the tables are only extended outside of graph replays
+        self.rope.reserve(cache.k.shape[1] if cache is not None else n_ctx)
         if cache is not None:
             offset = cache.offset.clone()
             q, k = self.rope(q, k, offset=offset)
@@ -230,9 +234,10 @@ class AttentionBlock(torch.nn.Module):
             self.num_key_value_heads,
             self.head_dim,
         )
-        with record_function("attn_kernel"):
-            if n_ctx == 1:
-                t = attention_ref(
+        with region("attn_kernel"):
+            if cache is not None and n_ctx == 1:
+                # Only the window or the first cache.num_keys entries, not the whole capacity
+                t = attention_decode(
                     q,
                     k,
                     v,
@@ -240,8 +245,10 @@ class AttentionBlock(torch.nn.Module):
                     self.sm_scale,
                     self.sliding_window,
                     offset,
+                    num_keys=cache.num_keys,
                 )
             else:
+                # Dispatches to the fastest registered backend for this shape, see gpt_oss.torch.attention_backends
                 t = attention(
                     q,
                     k,
@@ -251,20 +258,8 @@ class AttentionBlock(torch.nn.Module):
                     self.sliding_window,
                     offset,
                 )
-                if n_ctx < 64:
-                    t1 = attention_ref(
-                        q,
-                        k,
-                        v,
-                        self.sinks,
-                        self.sm_scale,
-                        self.sliding_window,
-                        offset,
-                    )
-                    torch.testing.assert_close(t, t1)
-                    t = t1
-
-        with record_function("c_proj"):
+
+        with region("c_proj"):
             t = self.out(t)
         t = x + t
         return t
@@ -282,6 +277,7 @@ class MLPBlock(torch.nn.Module):
         self.num_experts = config.num_experts
         self.experts_per_token = config.experts_per_token
         self.swiglu_limit = config.swiglu_limit
+        self.telemetry = None
         self.norm = RMSNorm(config.hidden_size, device=device)
         self.gate = torch.nn.ParameterDict({
             "weight": torch.nn.Parameter(
@@ -299,7 +295,8 @@ class MLPBlock(torch.nn.Module):
                 )
             ),
         })
-        self.mlp1_weight_tensor, self.mlp1_weight_mx = quantize_mx4(
+        self.set_expert_weights(
+            "mlp1_weight",
             torch.empty(
                 (
                     config.num_experts,
@@ -310,7 +307,6 @@ class MLPBlock(torch.nn.Module):
                 dtype=torch.bfloat16,
             ),
         )
-        self.mlp1_weight = torch.nn.Parameter(self.mlp1_weight_tensor.storage.data, requires_grad=False)
         self.mlp1_bias = torch.nn.Parameter(
             torch.empty(
                 (config.num_experts, config.intermediate_size * 2),
@@ -318,7 +314,8 @@ class MLPBlock(torch.nn.Module):
                 dtype=torch.bfloat16,
             )
         )
-        self.mlp2_weight_tensor, self.mlp2_weight_mx = quantize_mx4(
+        self.set_expert_weights(
+            "mlp2_weight",
             torch.empty(
                 (
                     config.num_experts,
@@ -329,7 +326,6 @@ class MLPBlock(torch.nn.Module):
                 dtype=torch.bfloat16,
             ),
         )
-        self.mlp2_weight = torch.nn.Parameter(self.mlp2_weight_tensor.storage.data, requires_grad=False)
         self.mlp2_bias = torch.nn.Parameter(
             torch.empty(
                 (config.num_experts, config.hidden_size),
@@ -338,7 +334,26 @@ class MLPBlock(torch.nn.Module):
             )
         )
 
-    @record_function("mlp")
+    def set_expert_weights(self, name: str, weight: torch.Tensor):
+        """Quantize `weight` [num_experts, in_features, out_features] to MXFP4 and use it as `name`."""
+        if weight.is_meta:
+            # Quantized when the weights are loaded, see Transformer.from_checkpoint
+            tensor, scales, data = None, None, weight
+        else:
+            tensor, scales = quantize_mx4(weight)
+            data = tensor.storage.data
+        setattr(self, f"{name}_tensor", tensor)
+        setattr(self, f"{name}_mx", scales)
+        self.register_parameter(name, torch.nn.Parameter(data, requires_grad=False))
+
+    def set_expert_blocks(self, name: str, blocks: torch.Tensor, scales: torch.Tensor):
+        """Use the MXFP4 checkpoint weight [num_experts, out_features, ...] as `name`, see gpt_oss.triton.mxfp4."""
+        tensor, scales = repack_mx4(blocks, scales)
+        setattr(self, f"{name}_tensor", tensor)
+        setattr(self, f"{name}_mx", scales)
+        self.register_parameter(name, torch.nn.Parameter(tensor.storage.data, requires_grad=False))
+
+    @region("mlp")
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         batch_size, n_ctx, dim = x.shape
         t = self.norm(x)
@@ -355,6 +370,8 @@ class MLPBlock(torch.nn.Module):
             experts_per_token=self.experts_per_token,
             num_experts=self.num_experts,
             swiglu_limit=self.swiglu_limit,
+            telemetry=self.telemetry,
+            layer_idx=self.layer_idx,
         )
         t = t.view(batch_size, n_ctx, dim)
 
@@ -367,10 +384,11 @@ class TransformerBlock(torch.nn.Module):
         config: ModelConfig,
         layer_idx: int,
         device: torch.device | None = None,
+        rope: RotaryEmbedding | None = None,
     ):
         super().__init__()
         self.layer_idx = layer_idx
-        self.attn = AttentionBlock(config, layer_idx, device)
+        self.attn = AttentionBlock(config, layer_idx, device, rope)
         self.mlp = MLPBlock(config, layer_idx, device)
 
     def forward(self, x: torch.Tensor, cache: Cache | None = None) -> torch.Tensor:
@@ -390,9 +408,11 @@ class Transformer(torch.nn.Module):
         self.embedding = torch.nn.Embedding(
             config.vocab_size, config.hidden_size, device=device, dtype=torch.bfloat16
         )
+        # Sized lazily to the positions that are used, instead of one full-context table per layer
+        self.rope = make_rope(config, device)
         self.block = torch.nn.ModuleList(
             [
-                TransformerBlock(config, layer_idx, device)
+                TransformerBlock(config, layer_idx, device, self.rope)
                 for layer_idx in range(config.num_hidden_layers)
             ]
         )
@@ -405,16 +425,24 @@ class Transformer(torch.nn.Module):
             dtype=torch.bfloat16,
         )
 
-    def forward(self, x: torch.Tensor, caches: list[Cache] | None = None) -> torch.Tensor:
+    def forward(
+        self,
+        x: torch.Tensor,
+        caches: list[Cache] | None = None,
+        logits_indices: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        # logits_indices selects the positions whose logits are computed, all of them by default
         caches=caches or [None] * len(self.block)
-        with record_function("embedding"):
+        with region("embedding"):
             x = self.embedding(x)
         for block, cache in zip(self.block, caches):
-            with record_function("block"):
+            with region("block", block.layer_idx):
                 x = block(x, cache=cache)
-        with record_function("norm_f"):
+        if logits_indices is not None:
+            x = x[:, logits_indices]
+        with region("norm_f"):
             x = self.norm(x)
-        with record_function("unembedding"):
+        with region("unembedding"):
             x = self.unembedding(x)
         return x.float()
 
@@ -431,82 +459,276 @@ class Transformer(torch.nn.Module):
                 json_config = json.load(f)
                 config = ModelConfig(**json_config)
 
-        model = Transformer(config=config, device=device)
+        # Parameters are allocated by the checkpoint loader and assigned to the modules, not copied
+        model = Transformer(config=config, device=torch.device("meta"))
         model.eval()
 
         checkpoint = Checkpoint(path, device)
 
-        for name, param in model.named_parameters():
-            torch.cuda.empty_cache()
-            loaded_tensor = checkpoint.get(name)
+        for name, _ in list(model.named_parameters()):
+            if name.endswith(("mlp1_weight", "mlp2_weight")):
+                # Repacked as MXFP4, never materialized in bf16
+                _, block_index, _, param_name = name.split(".")
+                model.block[int(block_index)].mlp.set_expert_blocks(param_name, *checkpoint.get_mxfp4(name))
+                continue
 
-            if "mlp1" in name:
-                if "weight" in name:
-                    loaded_tensor, scales = quantize_mx4(loaded_tensor.mT.contiguous())
-                    _, block_index, _, _ = name.split(".")
-                    model.block[int(block_index)].mlp.mlp1_weight_mx = scales
-                    param.data.copy_(loaded_tensor.storage.data)
-                else:
-                    param.data.copy_(loaded_tensor)
-
-            elif "mlp2_weight" in name:
-                loaded_tensor, scales = quantize_mx4(loaded_tensor.mT.contiguous())
-                _, block_index, _, _ = name.split(".")
-                model.block[int(block_index)].mlp.mlp2_weight_mx = scales
-                param.data.copy_(loaded_tensor.storage.data)
-
-            elif "gate" in name and loaded_tensor.ndim == 2:
-                loaded_tensor = loaded_tensor.mT.contiguous()
-                param.data.copy_(loaded_tensor)
+            loaded_tensor = checkpoint.get(name)
+            if "gate" in name and loaded_tensor.ndim == 2:
+                assign_parameter(model, name, loaded_tensor.mT.contiguous())
 
             else:
-                param.data.copy_(loaded_tensor)
+                assign_parameter(model, name, loaded_tensor)
 
-        # NOTE: Required to avoid OOM errors
+        model.rope.set_device(device)
+
+        # Return the blocks of the temporary expert tensors to the driver
         torch.cuda.empty_cache()
         return model
 
 
 class TokenGenerator:
     @torch.inference_mode()
-    def __init__(self, checkpoint: str, context: int, device: torch.device):
+    def __init__(
+        self,
+        checkpoint: str,
+        context: int,
+        device: torch.device,
+        router_telemetry: bool = False,
+        streaming: StreamingConfig | None = None,
+    ):
         self.device = device
-        self.model = Transformer.from_checkpoint(checkpoint, device=self.device)
-        self.caches = [Cache(1, context, self.model.config.num_key_value_heads, device=self.device) for _ in range(len(self.model.block))]
-        self.input_token = torch.zeros(1, dtype=torch.int32, device=self.device)
-        # warmup
-        self.model(self.input_token[None, :], caches=self.caches)
-        # capture for sampling
-        self.graph = torch.cuda.CUDAGraph()
-        with torch.cuda.graph(self.graph):
-            self.logits = self.model(self.input_token[None, :], caches=self.caches)[0]
+        # In streaming mode the caches only hold the attention sinks and the recent window
+        self.streaming = streaming
+        self.context = context if streaming is None else streaming.capacity
+        self.memory = MemoryTracker(device)
+        with self.memory.phase("load"):
+            self.model = Transformer.from_checkpoint(checkpoint, device=self.device)
+            if streaming is not None:
+                streaming.check_window(self.model.config.sliding_window)
+            # Attached before graph capture so that replays also record routing decisions
+            self.router_telemetry = attach_router_telemetry(self.model) if router_telemetry else None
+            self.caches = [
+                Cache(1, self.context, self.model.config.num_key_value_heads, device=self.device, fp32_keys=streaming is not None)
+                for _ in range(len(self.model.block))
+            ]
+            self.input_token = torch.zeros(1, dtype=torch.int32, device=self.device)
+            # One decode graph per experts-per-token setting and cache length bound, captured on first use
+            self.graphs = {}
+            self.kv_snapshot = None
+            self.active_session = None
+            self.graph, self.logits = self._get_graph()
+        if self.router_telemetry is not None:
+            self.router_telemetry.reset()
+
+    def _get_graph(self, num_keys: int = 1) -> tuple[torch.cuda.CUDAGraph, torch.Tensor]:
+        """Decode graph for the current experts-per-token setting and caches holding num_keys entries after the step."""
+        # Attention reads a power-of-two bound of the cache, so there are a few graphs per setting
+        num_keys = decode_num_keys(num_keys, self.context)
+        key = (tuple(get_experts_per_token(self.model)), num_keys)
+        if key not in self.graphs:
+            # The warmup pass appends to the caches, which may hold the state of a session
+            offsets = [cache.offset.clone() for cache in self.caches]
+            for cache in self.caches:
+                cache.num_keys = num_keys
+            try:
+                # warmup
+                self.model(self.input_token[None, :], caches=self.caches)
+                # capture for sampling
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    logits = self.model(self.input_token[None, :], caches=self.caches)[0]
+                self.graphs[key] = graph, logits
+            finally:
+                for cache, offset in zip(self.caches, offsets):
+                    cache.offset.copy_(offset)
+                    cache.num_keys = self.context
+        return self.graphs[key]
 
     @torch.inference_mode()
+    def save_kv_snapshot(self, path: str, tokens: list[int]):
+        """Prefill `tokens` and write their KV state to `path`."""
+        self.active_session = None
+        for cache in self.caches:
+            cache.reset()
+        with self.memory.phase("prefill"):
+            self.model(torch.as_tensor(tokens, dtype=torch.int32, device=self.device)[None, :], self.caches)
+        k = torch.stack([cache.k[0, : len(tokens)] for cache in self.caches])
+        v = torch.stack([cache.v[0, : len(tokens)] for cache in self.caches])
+        save_kv_snapshot(path, KVSnapshot(self.model.config, list(tokens), k, v))
+
+    def load_kv_snapshot(self, path: str) -> list[int]:
+        """Keep a snapshot on the device; prompts sharing a prefix with it skip the prefill of that prefix."""
+        self.kv_snapshot = load_kv_snapshot(path, device=self.device, config=self.model.config)
+        return self.kv_snapshot.tokens
+
+    @torch.inference_mode()
+    def score(self, prompt_tokens: list[int], continuation_tokens: list[int], top_n: int = 0) -> list[TokenScore]:
+        """Logprobs of `continuation_tokens` following `prompt_tokens`, see `gpt_oss.torch.scoring`."""
+        tokens, first = scoring_inputs(prompt_tokens, continuation_tokens)
+        # Scoring overwrites the caches of the active session
+        self.active_session = None
+        for cache in self.caches:
+            cache.reset()
+        with self.memory.phase("prefill"):
+            logits = self.model(
+                torch.as_tensor(tokens, dtype=torch.int32, device=self.device)[None, :],
+                self.caches,
+                logits_indices=torch.arange(first, len(tokens), device=self.device),
+            )[0]
+        return score_logits(logits, continuation_tokens, top_n)
+
+    def session(self) -> "GenerationSession":
+        """Start a conversation whose KV state is kept across generate calls."""
+        return GenerationSession(self)
+
     def generate(self,
                  prompt_tokens: list[int],
                  stop_tokens: list[int] | None = None,
                  temperature: float = 1.0,
                  max_tokens: int = 0,
-                 return_logprobs: bool = False):
-        stop_tokens = stop_tokens or []
-        for cache in self.caches:
+                 return_logprobs: bool = False,
+                 experts_per_token: int | list[int] | None = None):
+        # A fresh session takes over the caches, so the whole prompt is prefilled
+        yield from self.session().generate(
+            prompt_tokens, stop_tokens, temperature, max_tokens, return_logprobs, experts_per_token
+        )
+
+
+class GenerationSession:
+    """KV state of one conversation, kept across generate calls.
+
+    Every call takes the full token sequence (e.g. the re-rendered
+    conversation); only the part after the longest prefix shared with the
+    tokens already in the cache is prefilled. The generator has a single set of
+    caches, so starting another session or calling `TokenGenerator.generate`
+    invalidates this one, which then starts over from an empty cache.
+
+    In streaming mode, tokens before the recent window are evicted from the
+    caches; rolling back over them also starts over from an empty cache.
+    """
+
+    def __init__(self, generator: TokenGenerator):
+        self.generator = generator
+        # Tokens of the conversation, the keys and values of all but the evicted ones are in the caches
+        self.tokens: list[int] = []
+        self.num_evicted = 0
+        # Top-k of the current request, applied around each forward pass and graph replay
+        self.experts_per_token = None
+        self._claim()
+
+    def _reset(self):
+        for cache in self.generator.caches:
             cache.reset()
-        prompt_tokens = torch.as_tensor(prompt_tokens, dtype=torch.int32, device=self.device)
-        self.model(prompt_tokens[None, :-1], self.caches)
-        predicted_token = prompt_tokens[-1]
+        self.tokens = []
+        self.num_evicted = 0
+
+    def _claim(self):
+        generator = self.generator
+        if generator.active_session is not self:
+            self._reset()
+            generator.active_session = self
+
+    def _make_room(self, num_new_tokens: int):
+        """Evict old entries in streaming mode so that num_new_tokens fit into the caches."""
+        streaming = self.generator.streaming
+        if streaming is None:
+            return
+        num_cached = len(self.tokens) - self.num_evicted
+        n = streaming.num_to_evict(num_cached, num_new_tokens)
+        if n > 0:
+            _, inv_freq = self.generator.model.block[0].attn.rope._compute_concentration_and_inv_freq()
+            for cache in self.generator.caches:
+                cache.evict(streaming.num_sink_tokens, num_cached, n, inv_freq)
+            self.num_evicted += n
+
+    def _rewind(self, tokens: list[int]) -> int:
+        """Drop cached tokens that are not a prefix of `tokens`; returns the number of tokens kept."""
+        generator = self.generator
+        # Keep at least one token to compute the logits of the first generated token
+        num_cached = min(common_prefix_length(self.tokens, tokens), len(tokens) - 1)
+        num_dropped = len(self.tokens) - num_cached
+        if num_dropped > 0:
+            num_entries = len(self.tokens) - self.num_evicted
+            streaming = generator.streaming
+            if streaming is None or streaming.can_truncate(num_entries, self.num_evicted, num_dropped):
+                for cache in generator.caches:
+                    cache.truncate(num_entries - num_dropped)
+                self.tokens = self.tokens[:num_cached]
+            else:
+                self._reset()
+                num_cached = 0
+        if num_cached == 0 and generator.kv_snapshot is not None:
+            num_cached = common_prefix_length(generator.kv_snapshot.tokens, tokens[:-1])
+            if generator.streaming is not None:
+                num_cached = min(num_cached, generator.context)
+            if num_cached > 0:
+                for layer_idx, cache in enumerate(generator.caches):
+                    cache.restore(generator.kv_snapshot.k[layer_idx, :num_cached], generator.kv_snapshot.v[layer_idx, :num_cached])
+                self.tokens = list(tokens[:num_cached])
+        return num_cached
+
+    def _prefill(self, tokens: list[int]):
+        generator = self.generator
+        chunk_size = len(tokens) if generator.streaming is None else generator.streaming.chunk_size
+        for start in range(0, len(tokens), max(chunk_size, 1)):
+            chunk = tokens[start : start + chunk_size]
+            self._make_room(len(chunk))
+            with (
+                region("prefill"),
+                generator.memory.phase("prefill"),
+                experts_per_token_override(generator.model, self.experts_per_token),
+            ):
+                generator.model(torch.as_tensor(chunk, dtype=torch.int32, device=generator.device)[None, :], generator.caches)
+            self.tokens += chunk
+
+    @torch.inference_mode()
+    def append(self, tokens: list[int]):
+        """Prefill tokens appended to the conversation (e.g. a tool output) without generating."""
+        self._claim()
+        self._prefill(list(tokens))
+
+    @torch.inference_mode()
+    def generate(self,
+                 tokens: list[int],
+                 stop_tokens: list[int] | None = None,
+                 temperature: float = 1.0,
+                 max_tokens: int = 0,
+                 return_logprobs: bool = False,
+                 experts_per_token: int | list[int] | None = None):
+        assert tokens, "The prompt must not be empty"
+        generator = self.generator
+        stop_tokens = stop_tokens or []
+        self.experts_per_token = experts_per_token
+        self._claim()
+        tokens = list(tokens)
+        num_cached = self._rewind(tokens)
+        self._prefill(tokens[num_cached:-1])
+        if generator.router_telemetry is not None:
+            generator.router_telemetry.step()
+        predicted_token = tokens[-1]
         num_generated_tokens = 0
         while max_tokens == 0 or num_generated_tokens < max_tokens:
-            self.input_token[0] = predicted_token
-            self.graph.replay()
+            generator.input_token[0] = predicted_token
+            self._make_room(1)
+            # The graph of the setting, which is captured with it on first use
+            with experts_per_token_override(generator.model, self.experts_per_token):
+                generator.graph, generator.logits = generator._get_graph(len(self.tokens) - self.num_evicted + 1)
+            # Graph replays run no Python, so decode steps are timed as a whole
+            with region("decode_graph"), generator.memory.phase("decode"):
+                generator.graph.replay()
+            self.tokens.append(predicted_token)
+            if generator.router_telemetry is not None:
+                generator.router_telemetry.step()
+            logits = generator.logits[-1, :]
             if temperature == 0.0:
-                predicted_token = torch.argmax(self.logits[-1, :], dim=-1).item()
+                predicted_token = torch.argmax(logits, dim=-1).item()
             else:
-                probs = torch.softmax(self.logits * (1.0 / temperature), dim=-1)
-                predicted_token = torch.multinomial(probs[-1, :], num_samples=1).item()
+                probs = torch.softmax(logits * (1.0 / temperature), dim=-1)
+                predicted_token = torch.multinomial(probs, num_samples=1).item()
             num_generated_tokens += 1
 
             if return_logprobs:
-                logprobs = torch.log_softmax(self.logits[-1, :], dim=-1)
+                logprobs = torch.log_softmax(logits, dim=-1)
                 selected_logprobs = logprobs[predicted_token].item()
                 yield predicted_token, selected_logprobs
             else:
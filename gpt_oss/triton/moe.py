@@ -1,5 +1,4 @@
 import torch
-from torch.profiler import record_function
 
 import triton_kernels
 import triton_kernels.swiglu
@@ -12,14 +11,27 @@ from triton_kernels.tensor import convert_layout
 from triton_kernels.tensor_details.layout import StridedLayout, HopperMXScaleLayout, HopperMXValueLayout
 from triton_kernels.tensor import wrap_torch_tensor, FP4
 
+from gpt_oss.torch.profiling import region
+from gpt_oss.triton.mxfp4 import transpose_mxfp4
 
-def quantize_mx4(w):
-    w, w_scale = downcast_to_mxfp(w.to(torch.bfloat16), torch.uint8, axis=1)
+
+def _wrap_mx4(w, w_scale):
     w = convert_layout(wrap_torch_tensor(w, dtype=FP4), HopperMXValueLayout, mx_axis=1)
     w_scale = convert_layout(wrap_torch_tensor(w_scale), StridedLayout)
     return w, w_scale
 
 
+def quantize_mx4(w):
+    w, w_scale = downcast_to_mxfp(w.to(torch.bfloat16), torch.uint8, axis=1)
+    return _wrap_mx4(w, w_scale)
+
+
+def repack_mx4(blocks, scales):
+    """Same result as quantize_mx4 of the dequantized checkpoint weight transposed, without leaving MXFP4."""
+    w, w_scale = transpose_mxfp4(blocks, scales)
+    return _wrap_mx4(w, w_scale)
+
+
 def swiglu(x, alpha: float = 1.702, limit: float = 7.0, interleaved: bool = True):
     if interleaved:
         x_glu, x_linear = x[..., ::2], x[..., 1::2]
@@ -31,7 +43,7 @@ def swiglu(x, alpha: float = 1.702, limit: float = 7.0, interleaved: bool = True
     return out_glu * (x_linear + 1)
 
 
-def moe(x, wg, w1, w1_mx, w2, w2_mx, bg, b1, b2, experts_per_token=4, num_experts=128, swiglu_limit=7.0, fused_act=True, interleaved=True):
+def moe(x, wg, w1, w1_mx, w2, w2_mx, bg, b1, b2, experts_per_token=4, num_experts=128, swiglu_limit=7.0, fused_act=True, interleaved=True, telemetry=None, layer_idx=0):
     if x.numel() == 0:
         return x
 
@@ -39,22 +51,25 @@ def moe(x, wg, w1, w1_mx, w2, w2_mx, bg, b1, b2, experts_per_token=4, num_expert
     pc2 = PrecisionConfig(weight_scale=w2_mx, flex_ctx=FlexCtx(rhs_data=InFlexData()))
     pcg = PrecisionConfig(flex_ctx=FlexCtx(rhs_data=InFlexData()))
 
-    with record_function("wg"):
+    with region("wg"):
         logits = matmul_ogs(x, wg, bg, precision_config=pcg)
-    with record_function("routing"):
+    with region("routing"):
         rdata, gather_indx, scatter_indx = routing(logits, experts_per_token, simulated_ep=1)
+    if telemetry is not None:
+        with region("router_telemetry"):
+            telemetry.record_logits(layer_idx, logits, experts_per_token)
 
     if fused_act:
         assert interleaved, "Fused activation requires interleaved weights"
-        with record_function("w1+swiglu"):
+        with region("w1+swiglu"):
             act = FusedActivation(FnSpecs("swiglu", triton_kernels.swiglu.swiglu_fn, ("alpha", "limit")), (1.702, swiglu_limit), 2)
             x = matmul_ogs(x, w1, b1, rdata, gather_indx=gather_indx, precision_config=pc1, fused_activation=act)
     else:
-        with record_function("w1"):
+        with region("w1"):
             x = matmul_ogs(x, w1, b1, rdata, gather_indx=gather_indx, precision_config=pc1)
-        with record_function("swiglu"):
+        with region("swiglu"):
             x = swiglu(x, limit=swiglu_limit, interleaved=interleaved)
 
-    with record_function("w2"):
+    with region("w2"):
         x = matmul_ogs(x, w2, b2, rdata, scatter_indx=scatter_indx, precision_config=pc2, gammas=rdata.gate_scal)
     return x
@@ -0,0 +1,70 @@
+"""MXFP4 expert weights in the layout of the triton MoE kernels, in pure torch.
+
+Checkpoints store every MoE weight [num_experts, out_features, in_features] as
+blocks [num_experts, out_features, in_features // 32, 16] of packed FP4
+values, the even element in the low nibble, and one E8M0 scale per block of
+32 values. The triton model wants the transpose [num_experts, in_features,
+out_features] quantized along the in_features axis, which is what
+`downcast_to_mxfp(w, torch.uint8, axis=1)` returns: values [num_experts,
+in_features // 2, out_features] packed along that axis the same way, and
+scales [num_experts, in_features // 32, out_features].
+
+The blocks already group the in_features in the same 32s, so the conversion
+is a transpose of bytes (`transpose_mxfp4`) instead of a dequantization to
+bf16 followed by a quantization. `quantize_mxfp4_ref` mirrors
+`downcast_to_mxfp` to check on CPU that both give the same bits.
+"""
+
+import torch
+
+from gpt_oss.torch.weights import BYTES_PER_BLOCK
+
+# E8M0 scales and the exponent of float32 share the bias of 127
+E8M0_BIAS = 127
+
+
+def transpose_mxfp4(blocks: torch.Tensor, scales: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """Checkpoint blocks [..., rows, groups, 16] and scales [..., rows, groups] to values [..., groups * 16, rows] and scales [..., groups, rows]."""
+    *prefix, rows, groups, block_bytes = blocks.shape
+    assert block_bytes == BYTES_PER_BLOCK
+    assert scales.shape == blocks.shape[:-1], f"{blocks.shape=} does not match {scales.shape=}"
+    values = blocks.reshape(*prefix, rows, groups * BYTES_PER_BLOCK).mT.contiguous()
+    return values, scales.mT.contiguous()
+
+
+def quantize_mxfp4_ref(x: torch.Tensor, axis: int) -> tuple[torch.Tensor, torch.Tensor]:
+    """Reference of `downcast_to_mxfp(x, torch.uint8, axis)` with the default round-up scales.
+
+    Every 32 values along `axis` share the scale that brings their maximum
+    magnitude to at most 6, rounded up to a power of two; the scaled values are
+    rounded to the nearest FP4 value, ties away from zero, and two of them are
+    packed per byte.
+    """
+    x = x.float().movedim(axis, -1)
+    *prefix, n = x.shape
+    assert n % (2 * BYTES_PER_BLOCK) == 0
+    x = x.reshape(*prefix, n // (2 * BYTES_PER_BLOCK), 2 * BYTES_PER_BLOCK)
+
+    dequant_scale = x.abs().amax(dim=-1, keepdim=True) / 6.0
+    # Round up to a power of two by carrying a non-zero mantissa into the exponent
+    exponent_bits = (dequant_scale.view(torch.int32) + 0x007FFFFF) & 0x7F800000
+    dequant_scale = exponent_bits.view(torch.float32)
+    quant_scale = torch.where(dequant_scale == 0, 0.0, 1.0 / dequant_scale)
+    bits = (x * quant_scale).view(torch.int32)
+
+    signs = (bits >> 28) & 0x8
+    exponents = (bits >> 23) & 0xFF
+    mantissas = bits & 0x7FFFFF
+    # Below 1, the implicit leading bit moves into the mantissa of a subnormal
+    shift = (E8M0_BIAS - 1 - exponents).clamp(min=0, max=31)
+    mantissas = torch.where(exponents < E8M0_BIAS, (0x400000 | (mantissas >> 1)) >> shift, mantissas)
+    # Rebias the exponent from 127 to 1; subnormals have an exponent of 0
+    exponents = exponents.clamp(min=E8M0_BIAS - 1) - (E8M0_BIAS - 1)
+    # Keep one mantissa bit plus the one after it to round, and saturate at 6
+    magnitudes = torch.clamp((((exponents << 2) | (mantissas >> 21)) + 1) >> 1, max=0x7)
+    nibbles = (signs | magnitudes).to(torch.uint8)
+
+    values = nibbles[..., 0::2] | (nibbles[..., 1::2] << 4)
+    values = values.reshape(*prefix, n // 2).movedim(-1, axis).contiguous()
+    scales = (exponent_bits >> 23).to(torch.uint8)[..., 0].movedim(-1, axis).contiguous()
+    return values, scales
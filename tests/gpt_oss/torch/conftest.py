@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from gpt_oss.torch.model import ModelConfig, TokenGenerator, Transformer
+from gpt_oss.torch.synthetic_checkpoint import write_synthetic_checkpoint
+
+
+@pytest.fixture
+def tiny_config() -> ModelConfig:
+    return ModelConfig(
+        num_hidden_layers=2,
+        num_experts=4,
+        experts_per_token=2,
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=32,
+        head_dim=16,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        sliding_window=4,
+    )
+
+
+@pytest.fixture
+def tiny_model(tiny_config) -> Transformer:
+    torch.manual_seed(0)
+    model = Transformer(tiny_config, device=torch.device("cpu"))
+    for param in model.parameters():
+        param.data.normal_(0.0, 0.1)
+    return model.eval()
+
+
+@pytest.fixture
+def tiny_checkpoint(tmp_path, tiny_config) -> str:
+    path = str(tmp_path / "checkpoint")
+    write_synthetic_checkpoint(path, tiny_config)
+    return path
+
+
+@pytest.fixture
+def make_generator(tiny_checkpoint):
+    """TokenGenerators on the tiny checkpoint, by default with a 64-token context in blocks of 4."""
+
+    def make(**kwargs) -> TokenGenerator:
+        kwargs = {"context": 64, "block_size": 4, **kwargs}
+        return TokenGenerator(tiny_checkpoint, torch.device("cpu"), **kwargs)
+
+    return make
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+import torch
+
+from gpt_oss.torch.attention_backends import (
+    ATTENTION_BACKENDS,
+    AttentionAutotuner,
+    attention_decode,
+    attention_ref,
+    attention_sdpa,
+    decode_num_keys,
+    register_attention_backend,
+)
+
+
+def make_inputs(batch_size=2, num_queries=4, num_keys=16, start_q=3):
+    torch.manual_seed(0)
+    q = torch.randn(batch_size, num_queries, 2, 4, 16).bfloat16()
+    k = torch.randn(batch_size, num_keys, 2, 16).bfloat16()
+    v = torch.randn(batch_size, num_keys, 2, 16).bfloat16()
+    sinks = torch.randn(8).bfloat16()
+    return q, k, v, sinks, 0.25, None, torch.tensor([start_q])
+
+
+@pytest.mark.parametrize("sliding_window", [None, 4])
+@pytest.mark.parametrize("start_q", [0, 5])
+def test_sdpa_matches_ref(sliding_window, start_q):
+    q, k, v, sinks, sm_scale, _, start = make_inputs(start_q=start_q)
+    expected = attention_ref(q, k, v, sinks, sm_scale, sliding_window, start)
+    actual = attention_sdpa(q, k, v, sinks, sm_scale, sliding_window, start)
+    torch.testing.assert_close(actual, expected, atol=1e-2, rtol=1e-2)
+
+
+@pytest.mark.parametrize("backend", [attention_ref, attention_sdpa])
+def test_per_row_start_q(backend):
+    q, k, v, sinks, sm_scale, _, _ = make_inputs(num_queries=2)
+    start_q = torch.tensor([3, 9])
+    output = backend(q, k, v, sinks, sm_scale, 4, start_q)
+    for row in range(2):
+        expected = backend(q[row : row + 1], k[row : row + 1], v[row : row + 1], sinks, sm_scale, 4, start_q[row : row + 1])
+        torch.testing.assert_close(output[row : row + 1], expected)
+
+
+@pytest.mark.parametrize("sliding_window", [None, 4])
+@pytest.mark.parametrize("start_q", [[0, 2], [3, 9], [15, 6]])
+@pytest.mark.parametrize("num_keys", [None, 16])
+def test_decode_matches_ref(sliding_window, start_q, num_keys):
+    q, k, v, sinks, sm_scale, _, _ = make_inputs(num_queries=1, num_keys=32)
+    start = torch.tensor(start_q)
+    expected = attention_ref(q, k, v, sinks, sm_scale, sliding_window, start)
+    actual = attention_decode(q, k, v, sinks, sm_scale, sliding_window, start, num_keys=num_keys)
+    torch.testing.assert_close(actual, expected, atol=1e-2, rtol=1e-2)
+
+
+def test_decode_ignores_keys_past_the_bound():
+    q, k, v, sinks, sm_scale, _, start = make_inputs(num_queries=1, num_keys=32, start_q=5)
+    expected = {window: attention_ref(q, k[:, :8], v[:, :8], sinks, sm_scale, window, start) for window in (None, 4)}
+    # Stale entries are never read, not even multiplied by a zero weight
+    k[:, 8:] = float("nan")
+    v[:, 8:] = float("nan")
+    torch.testing.assert_close(attention_decode(q, k, v, sinks, sm_scale, None, start, num_keys=8), expected[None])
+    torch.testing.assert_close(attention_decode(q, k, v, sinks, sm_scale, 4, start), expected[4])
+
+
+def test_decode_num_keys():
+    assert decode_num_keys(1, 4096) == 256
+    assert decode_num_keys(257, 4096) == 512
+    assert decode_num_keys(512, 4096) == 512
+    assert decode_num_keys(3000, 4096) == 4096
+    assert decode_num_keys(3000, 2000) == 2000
+
+
+def test_autotuner_persists_winner(tmp_path):
+    cache_path = str(tmp_path / "autotune.json")
+    args = make_inputs()
+    tuner = AttentionAutotuner(backends=["ref", "sdpa"], cache_path=cache_path, warmup=0, repeats=1)
+    output = tuner(*args)
+    torch.testing.assert_close(output, attention_ref(*args))
+
+    table = json.loads(open(cache_path).read())
+    (entry,) = table["cpu"].values()
+    assert set(entry["timings_ms"]) == {"ref", "sdpa"}
+
+    # A new autotuner reuses the stored decision without benchmarking
+    reloaded = AttentionAutotuner(backends=["ref", "sdpa"], cache_path=cache_path)
+    reloaded.tune = None
+    assert reloaded.select(*args).name == entry["best"]
+
+
+def test_incorrect_backend_is_excluded(tmp_path):
+    register_attention_backend("broken")(lambda q, k, v, *args: torch.zeros_like(attention_ref(q, k, v, *args)))
+    try:
+        tuner = AttentionAutotuner(backends=["broken", "ref"], cache_path=str(tmp_path / "autotune.json"), warmup=0, repeats=1)
+        with pytest.warns(UserWarning):
+            assert tuner.select(*make_inputs()).name == "ref"
+    finally:
+        del ATTENTION_BACKENDS["broken"]
+
+
+def test_long_inputs_are_checked_on_a_slice(tmp_path):
+    args = make_inputs(batch_size=1, num_queries=80, num_keys=1200, start_q=1000)
+    q, k, *_, start_q = AttentionAutotuner.check_slice(*args)
+    assert q.shape[1] == 64 and k.shape[1] == 1024 and start_q.tolist() == [960]
+    # The reference materializes all scores and is not timed on long inputs
+    tuner = AttentionAutotuner(backends=["ref", "sdpa"], cache_path=str(tmp_path / "autotune.json"), warmup=0, repeats=1)
+    assert set(tuner.tune(*args)["timings_ms"]) == {"sdpa"}
+
+
+def test_forced_backend(tmp_path, monkeypatch):
+    monkeypatch.setenv("GPT_OSS_ATTENTION_BACKEND", "sdpa")
+    tuner = AttentionAutotuner(cache_path=str(tmp_path / "autotune.json"))
+    assert tuner.select(*make_inputs()).name == "sdpa"
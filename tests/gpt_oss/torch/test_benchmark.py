@@ -0,0 +1,24 @@
+from gpt_oss.torch.benchmark import BENCHMARKS, compare, format_results, run_benchmarks
+
+
+def test_every_benchmark_runs():
+    patterns = [r"config=tiny,tokens=1\]", r"mxfp4_dequant\[config=tiny\]", r"sdpa_\w+\[config=tiny,", r"cache_decode\[config=tiny,context=256,"]
+    results = run_benchmarks(patterns, warmup=0, repeats=1)
+    assert {result["benchmark"] for result in results.values()} == {bench.name for bench in BENCHMARKS}
+    for result in results.values():
+        assert result["repeats"] == 1
+        assert result["median_ms"] > 0
+
+
+def test_compare_against_baseline():
+    baseline = {"a": {"median_ms": 1.0}, "b": {"median_ms": 1.0}, "only_in_baseline": {"median_ms": 1.0}}
+    results = {
+        "a": {"median_ms": 1.05, "min_ms": 1.0},
+        "b": {"median_ms": 1.5, "min_ms": 1.4},
+        "new": {"median_ms": 2.0, "min_ms": 2.0},
+    }
+    comparisons = {c["name"]: c for c in compare(results, baseline, threshold=0.1)}
+    assert set(comparisons) == {"a", "b"}
+    assert not comparisons["a"]["regression"]
+    assert comparisons["b"]["regression"]
+    assert "REGRESSION" in format_results(results, list(comparisons.values()))
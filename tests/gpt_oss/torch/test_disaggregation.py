@@ -0,0 +1,50 @@
+import queue
+import threading
+
+import pytest
+import torch
+
+from gpt_oss.torch.disaggregation import DisaggregatedGenerator, _decode_worker
+from gpt_oss.torch.kv_snapshot import KVSnapshot, kv_snapshot_to_bytes
+
+
+def test_disaggregated_generation_matches_token_generator(tiny_checkpoint, make_generator):
+    generator = make_generator(prefix_cache=False)
+    prompts = [[1, 2, 3, 4, 5, 6, 7, 8, 9], [3, 1, 4], [5], [2, 7, 1, 8, 2, 8]]
+    expected = [list(generator.generate(prompt, [], temperature=0.0, max_tokens=5)) for prompt in prompts]
+
+    with DisaggregatedGenerator(
+        tiny_checkpoint, context=64, block_size=4, num_prefill_workers=2, num_decode_workers=2
+    ) as disaggregated:
+        # All requests are in flight at the same time
+        request_ids = [disaggregated.submit(prompt, [], temperature=0.0, max_tokens=5) for prompt in prompts]
+        generated = [list(disaggregated.stream(request_id)) for request_id in request_ids]
+    assert generated == expected
+
+
+def test_stream_fails_when_a_worker_exits(tmp_path):
+    # The workers cannot load the checkpoint and exit
+    with DisaggregatedGenerator(str(tmp_path / "missing"), context=64, block_size=4) as disaggregated:
+        request_id = disaggregated.submit([1, 2, 3], [], temperature=0.0, max_tokens=1)
+        with pytest.raises(RuntimeError, match="exited"):
+            list(disaggregated.stream(request_id))
+
+
+def test_decode_worker_aborts_requests(tiny_config, tiny_checkpoint):
+    inbox, outbox = queue.Queue(), queue.Queue()
+    # One-token prompts, so the prefill hands over an empty prefix
+    shape = (tiny_config.num_hidden_layers, 0, tiny_config.num_key_value_heads, tiny_config.head_dim)
+    empty = torch.zeros(shape, dtype=torch.bfloat16)
+    data = kv_snapshot_to_bytes(KVSnapshot(tiny_config, [], empty, empty))
+    # Request 0 is aborted once it runs, request 1 before it arrives
+    for message in [(0, [1], [], 0.0, 0, data), ("abort", 0), ("abort", 1), (1, [2], [], 0.0, 0, data)]:
+        inbox.put(message)
+    inbox.put((2, [3], [], 0.0, 2, data))
+    worker = threading.Thread(target=_decode_worker, args=(tiny_checkpoint, "cpu", 64, 4, 8, inbox, outbox))
+    worker.start()
+    outputs = [outbox.get(timeout=60) for _ in range(2)]
+    inbox.put(None)
+    worker.join()
+    assert [output[0] for output in outputs] == [2, 2]
+    assert outputs[-1][3] == "length"
+    assert outbox.empty()
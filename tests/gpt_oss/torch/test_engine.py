@@ -0,0 +1,218 @@
+import asyncio
+
+import pytest
+import torch
+
+from gpt_oss.responses_api.batching import SequenceStep
+from gpt_oss.responses_api.inference.torch import get_infer_next_token
+from gpt_oss.torch.engine import AsyncEngine, Engine, KVImportRunner, ModelRunner, TorchModelRunner
+from gpt_oss.torch.fast_mode import experts_per_token_override, get_experts_per_token
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.paged_cache import OutOfBlocksError
+
+
+class CountingRunner(ModelRunner):
+    """Holds `capacity` KV entries; greedy decoding always continues with the last token plus one."""
+
+    def __init__(self, capacity: int = 64, vocab_size: int = 32):
+        self.capacity = capacity
+        self.vocab_size = vocab_size
+        self.used = 0
+        self.batches = []
+
+    @property
+    def max_context(self) -> int:
+        return self.capacity
+
+    def new_sequence(self):
+        return []
+
+    def free(self, handle):
+        self.used -= len(handle)
+        handle.clear()
+
+    def can_append(self, handles, num_new_tokens) -> bool:
+        return self.used + sum(num_new_tokens) <= self.capacity
+
+    def forward(self, handles, tokens):
+        self.batches.append([len(t) for t in tokens])
+        logits = torch.zeros(len(handles), self.vocab_size)
+        for i, (handle, new_tokens) in enumerate(zip(handles, tokens)):
+            handle.extend(new_tokens)
+            self.used += len(new_tokens)
+            logits[i, (handle[-1] + 1) % self.vocab_size] = 1.0
+        return logits
+
+
+class ImportingRunner(CountingRunner, KVImportRunner):
+    def import_kv(self, k, v):
+        self.used += k.shape[1]
+        return [0] * k.shape[1]
+
+
+def run_to_completion(engine: Engine, max_steps: int = 1000) -> dict[int, list[int]]:
+    generated = {}
+    for _ in range(max_steps):
+        if not engine.has_unfinished():
+            break
+        for output in engine.step():
+            generated.setdefault(output.request_id, []).append(output.token)
+    assert not engine.has_unfinished(), f"Requests still unfinished after {max_steps} steps"
+    return generated
+
+
+def test_token_budget_and_chunked_prefill():
+    runner = CountingRunner()
+    engine = Engine(runner, max_num_tokens=8)
+    long_request = engine.add_request(list(range(20)), temperature=0.0, max_tokens=4)
+    short_request = engine.add_request([5, 6, 7], temperature=0.0, max_tokens=4)
+    generated = run_to_completion(engine)
+    assert all(sum(batch) <= 8 for batch in runner.batches)
+    # The long prompt is split into chunks and decoding of one sequence overlaps the prefill of the other
+    assert runner.batches[0] == [8]
+    assert any(len(batch) == 2 for batch in runner.batches)
+    assert generated[long_request] == [20, 21, 22, 23]
+    assert generated[short_request] == [8, 9, 10, 11]
+    assert runner.used == 0
+
+
+def test_requests_join_and_leave_the_running_batch():
+    runner = CountingRunner()
+    engine = Engine(runner)
+    first = engine.add_request([1, 2], stop_tokens=[5], temperature=0.0)
+    engine.step()
+    engine.step()
+    second = engine.add_request([10], temperature=0.0, max_tokens=3)
+    generated = run_to_completion(engine)
+    assert runner.batches[:3] == [[2], [1], [1, 1]]
+    # The first request stops at token 5, after which only the second one is decoded
+    assert generated[first] == [5]
+    assert generated[second] == [11, 12, 13]
+    assert runner.batches[-1] == [1]
+
+
+def test_preemption_when_the_cache_is_full():
+    runner = CountingRunner(capacity=12)
+    engine = Engine(runner)
+    requests = [engine.add_request([i * 4, i * 4 + 1, i * 4 + 2], temperature=0.0, max_tokens=5) for i in range(2)]
+    generated = run_to_completion(engine)
+    assert generated[requests[0]] == [3, 4, 5, 6, 7]
+    assert generated[requests[1]] == [7, 8, 9, 10, 11]
+    assert runner.used == 0
+
+
+def test_imported_prefixes_that_fill_the_cache():
+    runner = ImportingRunner(capacity=12)
+    engine = Engine(runner)
+    kv = torch.zeros(1, 5, 1, 4), torch.zeros(1, 5, 1, 4)
+    requests = [engine.add_request([i] * 8, temperature=0.0, max_tokens=2, kv=kv) for i in range(2)]
+    # Together the prefixes leave too little room to admit either sequence
+    assert runner.used == 10
+    generated = run_to_completion(engine)
+    assert generated == {requests[0]: [1, 2], requests[1]: [2, 3]}
+    assert runner.used == 0
+
+
+def test_kv_import_needs_runner_support():
+    engine = Engine(CountingRunner())
+    kv = torch.zeros(1, 2, 1, 4), torch.zeros(1, 2, 1, 4)
+    with pytest.raises(AssertionError, match="CountingRunner cannot import KV state"):
+        engine.add_request([1, 2, 3], kv=kv)
+    assert not engine.has_unfinished()
+
+
+@torch.inference_mode()
+def test_async_engine_matches_token_generator(tiny_checkpoint, make_generator):
+    generator = make_generator(prefix_cache=False)
+    prompts = [[1, 2, 3, 4, 5, 6, 7, 8, 9], [3, 1, 4], [2, 7, 1, 8, 2, 8]]
+    expected = [list(generator.generate(prompt, [], temperature=0.0, max_tokens=5)) for prompt in prompts]
+
+    model = Transformer.from_checkpoint(tiny_checkpoint, device="cpu")
+    engine = AsyncEngine(Engine(TorchModelRunner(model, num_blocks=32, block_size=4), max_num_tokens=8))
+
+    async def collect(prompt):
+        return [token async for token in engine.generate(prompt, [], temperature=0.0, max_tokens=5)]
+
+    async def main():
+        try:
+            return await asyncio.gather(*(collect(prompt) for prompt in prompts))
+        finally:
+            await engine.close()
+
+    assert asyncio.run(main()) == expected
+    assert engine.engine.runner.kv_cache.allocator.num_free_blocks == 32
+
+
+def greedy_next_token(model: Transformer, tokens: list[int]) -> int:
+    with torch.inference_mode():
+        return model(torch.as_tensor(tokens, dtype=torch.int32))[-1].argmax().item()
+
+
+def test_responses_backend_recomputes_what_does_not_fit(tiny_model):
+    # Three blocks of 16 tokens hold one of the two sequences at a time
+    backend = get_infer_next_token(tiny_model, num_blocks=3).batched
+    tokens = {"a": [i * 7 % 64 for i in range(20)], "b": [i * 5 % 64 for i in range(20)]}
+    for _ in range(2):
+        next_tokens = backend.step({sequence_id: SequenceStep(t) for sequence_id, t in tokens.items()})
+        assert next_tokens == {sequence_id: greedy_next_token(tiny_model, t) for sequence_id, t in tokens.items()}
+        for sequence_id, token in next_tokens.items():
+            tokens[sequence_id].append(token)
+    for sequence_id in tokens:
+        backend.release(sequence_id)
+
+
+def test_responses_backend_fails_only_the_sequence_that_does_not_fit(tiny_model):
+    backend = get_infer_next_token(tiny_model, num_blocks=3).batched
+    short, long = [1, 2, 3], list(range(60))
+    next_tokens = backend.step({"short": SequenceStep(short), "long": SequenceStep(long)})
+    assert next_tokens["short"] == greedy_next_token(tiny_model, short)
+    assert isinstance(next_tokens["long"], OutOfBlocksError)
+
+
+def test_responses_backend_runs_each_experts_per_token_setting(tiny_model):
+    backend = get_infer_next_token(tiny_model, num_blocks=8).batched
+    tokens = [i * 3 % 64 for i in range(12)]
+    next_tokens = backend.step(
+        {
+            "full": SequenceStep(tokens),
+            "fast": SequenceStep(tokens, experts_per_token=1),
+            "invalid": SequenceStep(tokens, experts_per_token=[1]),
+        }
+    )
+    assert next_tokens["full"] == greedy_next_token(tiny_model, tokens)
+    with experts_per_token_override(tiny_model, 1):
+        assert next_tokens["fast"] == greedy_next_token(tiny_model, tokens)
+    # One value per layer is expected
+    assert isinstance(next_tokens["invalid"], ValueError)
+    assert get_experts_per_token(tiny_model) == [2, 2]
+
+
+def test_responses_backend_conversations_keep_their_own_kv(tiny_model):
+    infer_next_token = get_infer_next_token(tiny_model, num_blocks=8)
+    num_tokens = []
+    tiny_model.register_forward_pre_hook(lambda module, args: num_tokens.append(args[0].numel()))
+    conversations = [[i * 7 % 64 for i in range(20)], [i * 5 % 64 for i in range(20)]]
+    for _ in range(2):
+        for tokens in conversations:
+            tokens.append(infer_next_token(tokens))
+    # After its prompt, every conversation continues with one new token per call
+    assert num_tokens == [20, 20, 1, 1]
+    assert conversations[0][-2:] == [greedy_next_token(tiny_model, conversations[0][:i]) for i in (20, 21)]
+    infer_next_token.release(conversations[0])
+    tokens = conversations[0][:21]
+    assert infer_next_token(tokens) == conversations[0][21]
+    assert num_tokens[-1] == 21
+
+
+def test_run_pending_fails_only_the_sequence_that_does_not_fit():
+    runner = CountingRunner(capacity=12)
+    engine = Engine(runner, max_num_tokens=4)
+    idle = engine.new_sequence([9, 9, 9])
+    engine.run_pending([idle])
+    seqs = [engine.new_sequence([1, 2, 3, 4, 5, 6]), engine.new_sequence(list(range(10))), engine.new_sequence(list(range(13)))]
+    results = engine.run_pending(seqs, others=[idle])
+    assert [logits.argmax().item() for logits in results[:2]] == [7, 10]
+    assert isinstance(results[2], OutOfBlocksError)
+    # The idle sequence made room and is recomputed when it is next run
+    assert idle.num_computed == 0
+    assert not engine.has_unfinished()
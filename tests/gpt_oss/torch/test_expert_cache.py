@@ -0,0 +1,69 @@
+import torch
+
+from gpt_oss.torch.expert_cache import ExpertCache
+from gpt_oss.torch.model import MLPBlock
+
+
+def make_cache(budget_experts: int, policy: str = "lru"):
+    loads = []
+
+    def load_expert(layer_idx, expert_idx):
+        loads.append((layer_idx, expert_idx))
+        return (torch.full((4,), float(expert_idx)),)
+
+    # Every expert takes 16 bytes
+    return ExpertCache(load_expert, budget_experts * 16, policy), loads
+
+
+def test_lru_eviction():
+    cache, loads = make_cache(budget_experts=2)
+    cache.get(0, 1)
+    cache.get(0, 2)
+    cache.get(0, 1)
+    cache.get(0, 3)
+    assert set(cache.experts) == {(0, 1), (0, 3)}
+    assert cache.resident_bytes == 32
+    assert loads == [(0, 1), (0, 2), (0, 3)]
+    assert cache.stats()["hits"] == 1
+
+
+def test_lfu_eviction():
+    cache, _ = make_cache(budget_experts=2, policy="lfu")
+    for _ in range(3):
+        cache.get(0, 1)
+    cache.get(0, 2)
+    cache.get(0, 2)
+    cache.get(0, 3)
+    cache.get(0, 4)
+    # Expert 1 is the most frequently used one and is never evicted
+    assert (0, 1) in cache.experts
+
+
+def test_warmup_loads_hottest_experts():
+    cache, loads = make_cache(budget_experts=3)
+    counts = torch.tensor([[0, 5, 1, 0], [9, 0, 0, 2]])
+    cache.warmup(counts)
+    assert set(cache.experts) == {(1, 0), (0, 1), (1, 3)}
+    assert cache.misses == 0
+
+
+@torch.inference_mode()
+def test_offloaded_mlp_matches_resident_mlp(tiny_config):
+    torch.manual_seed(0)
+    resident = MLPBlock(tiny_config, layer_idx=3, device=torch.device("cpu"))
+    for param in resident.parameters():
+        param.data.normal_(0.0, 0.1)
+    offloaded = MLPBlock(tiny_config, layer_idx=3, device=torch.device("cpu"), offload_experts=True)
+    offloaded.norm.load_state_dict(resident.norm.state_dict())
+    offloaded.gate.load_state_dict(resident.gate.state_dict())
+
+    def load_expert(layer_idx, expert_idx):
+        assert layer_idx == 3
+        return tuple(
+            param[expert_idx : expert_idx + 1].clone()
+            for param in (resident.mlp1_weight, resident.mlp1_bias, resident.mlp2_weight, resident.mlp2_bias)
+        )
+
+    offloaded.expert_cache = ExpertCache(load_expert, budget_bytes=0)
+    x = torch.randn(5, tiny_config.hidden_size, dtype=torch.bfloat16)
+    torch.testing.assert_close(offloaded(x), resident(x))
@@ -0,0 +1,47 @@
+import pytest
+import torch
+
+from gpt_oss.torch.fast_mode import (
+    evaluate_fast_mode,
+    experts_per_token_override,
+    get_experts_per_token,
+    parse_experts_per_token,
+    set_experts_per_token,
+)
+
+
+def test_parse_experts_per_token():
+    assert parse_experts_per_token("2") == 2
+    assert parse_experts_per_token("4,2") == [4, 2]
+
+
+def test_set_experts_per_token_global_and_per_layer(tiny_model):
+    set_experts_per_token(tiny_model, 1)
+    assert get_experts_per_token(tiny_model) == [1, 1]
+    set_experts_per_token(tiny_model, [2, 1])
+    assert get_experts_per_token(tiny_model) == [2, 1]
+    set_experts_per_token(tiny_model, None)
+    assert get_experts_per_token(tiny_model) == [2, 2]
+    with pytest.raises(AssertionError):
+        set_experts_per_token(tiny_model, [1])
+
+
+def test_override_restores_previous_setting(tiny_model):
+    set_experts_per_token(tiny_model, [2, 1])
+    with experts_per_token_override(tiny_model, 1):
+        assert get_experts_per_token(tiny_model) == [1, 1]
+    assert get_experts_per_token(tiny_model) == [2, 1]
+    with experts_per_token_override(tiny_model, None):
+        assert get_experts_per_token(tiny_model) == [2, 1]
+
+
+def test_evaluate_fast_mode(tiny_model):
+    prompts = [[1, 2, 3, 4], [5, 6, 7]]
+    results = evaluate_fast_mode(tiny_model, prompts, 2, torch.device("cpu"))
+    # Same setting as the full model: no divergence
+    assert results["top1_agreement"] == 1.0
+    assert results["max_abs_logit_diff"] == 0.0
+    results = evaluate_fast_mode(tiny_model, prompts, 1, torch.device("cpu"))
+    assert results["num_tokens"] == 7
+    assert results["mean_kl_divergence"] >= 0.0
+    assert get_experts_per_token(tiny_model) == [2, 2]
@@ -0,0 +1,85 @@
+import dataclasses
+
+import pytest
+import torch
+
+from gpt_oss.torch.kv_snapshot import (
+    KVSnapshot,
+    SnapshotMismatchError,
+    kv_snapshot_from_bytes,
+    kv_snapshot_to_bytes,
+    load_kv_snapshot,
+    save_kv_snapshot,
+)
+from gpt_oss.torch.paged_cache import PagedKVCache
+
+
+def make_snapshot(config, num_tokens=5):
+    k = torch.randn(2, num_tokens, 2, 16).bfloat16()
+    v = torch.randn(2, num_tokens, 2, 16).bfloat16()
+    return KVSnapshot(config, list(range(num_tokens)), k, v)
+
+
+def test_round_trip(tmp_path, tiny_config):
+    path = str(tmp_path / "prefix.kv")
+    snapshot = make_snapshot(tiny_config)
+    save_kv_snapshot(path, snapshot)
+    loaded = load_kv_snapshot(path, config=tiny_config)
+    assert loaded.tokens == snapshot.tokens
+    assert loaded.config == tiny_config
+    torch.testing.assert_close(loaded.k, snapshot.k, rtol=0, atol=0)
+    torch.testing.assert_close(loaded.v, snapshot.v, rtol=0, atol=0)
+
+
+def test_config_mismatch(tmp_path, tiny_config):
+    path = str(tmp_path / "prefix.kv")
+    save_kv_snapshot(path, make_snapshot(tiny_config))
+    with pytest.raises(SnapshotMismatchError):
+        load_kv_snapshot(path, config=dataclasses.replace(tiny_config, rope_theta=10000.0))
+
+
+def test_checksum_detects_corruption(tmp_path, tiny_config):
+    path = tmp_path / "prefix.kv"
+    save_kv_snapshot(str(path), make_snapshot(tiny_config))
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotMismatchError):
+        load_kv_snapshot(str(path))
+
+
+def test_paged_cache_export_import(tiny_config):
+    cache = PagedKVCache(num_layers=2, num_blocks=8, block_size=4, num_kv_heads=2, head_dim=16)
+    snapshot = make_snapshot(tiny_config, num_tokens=6)
+    table = cache.import_kv(snapshot.k, snapshot.v)
+    assert table.num_tokens == 6
+    assert len(table.blocks) == 2
+    k, v = cache.export_kv(table)
+    torch.testing.assert_close(k, snapshot.k, rtol=0, atol=0)
+    torch.testing.assert_close(v, snapshot.v, rtol=0, atol=0)
+
+
+def test_restored_prefix_matches_fresh_generation(tmp_path, make_generator):
+    prompt = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+    expected = list(make_generator().generate(prompt, [], temperature=0.0, max_tokens=4))
+
+    path = str(tmp_path / "prefix.kv")
+    make_generator().save_kv_snapshot(path, prompt[:9])
+    generator = make_generator()
+    assert generator.load_kv_snapshot(path) == prompt[:9]
+    assert list(generator.generate(prompt, [], temperature=0.0, max_tokens=4)) == expected
+    # The two full blocks of the snapshot were served from the prefix cache
+    assert generator.prefix_cache.hit_tokens == 8
+
+
+def test_bytes_round_trip(tiny_config):
+    snapshot = make_snapshot(tiny_config)
+    data = kv_snapshot_to_bytes(snapshot)
+    loaded = kv_snapshot_from_bytes(data, config=tiny_config)
+    assert loaded.tokens == snapshot.tokens
+    torch.testing.assert_close(loaded.k, snapshot.k, rtol=0, atol=0)
+    torch.testing.assert_close(loaded.v, snapshot.v, rtol=0, atol=0)
+    corrupted = bytearray(data)
+    corrupted[-1] ^= 0xFF
+    with pytest.raises(SnapshotMismatchError):
+        kv_snapshot_from_bytes(bytes(corrupted))
@@ -0,0 +1,60 @@
+import torch
+
+from gpt_oss.torch.memory import (
+    MemoryTracker,
+    estimate_memory,
+    expert_values,
+    kv_bytes_per_token,
+    sliding_kv_cache_bytes,
+)
+from gpt_oss.torch.model import Transformer
+
+
+def test_torch_weights_match_parameters(tiny_config):
+    model = Transformer(tiny_config, device=torch.device("meta"))
+    num_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    estimate = estimate_memory(tiny_config, backend="torch", context=64)
+    weights = sum(estimate[k] for k in ("embedding", "unembedding", "attention", "mlp_dense", "experts"))
+    assert weights == num_bytes
+
+
+def test_triton_experts_are_mxfp4(tiny_config):
+    estimate = estimate_memory(tiny_config, backend="triton", context=64)
+    values = expert_values(tiny_config)
+    assert estimate["experts"] == values // 2 + values // 32
+    # cos and sin for every position of the context, shared by all layers
+    assert estimate["rope_tables"] == 2 * 64 * 8 * 4
+
+
+def test_kv_cache(tiny_config):
+    per_token = kv_bytes_per_token(tiny_config)
+    assert per_token == 2 * 2 * 16 * 2
+    estimate = estimate_memory(tiny_config, backend="triton", context=64, batch_size=3)
+    assert estimate["kv_cache"] == 2 * 64 * 3 * per_token
+    # The first layer keeps only the sliding window
+    assert sliding_kv_cache_bytes(tiny_config, context=64) == (4 + 64) * per_token
+    assert estimate["total"] == sum(v for k, v in estimate.items() if k != "total")
+
+
+def test_streaming_kv_cache(tiny_config):
+    per_token = kv_bytes_per_token(tiny_config)
+    triton = estimate_memory(tiny_config, backend="triton", context=64, streaming_capacity=16)
+    # The caches hold the capacity, with a float32 copy of the keys
+    assert triton["kv_cache"] == 2 * 16 * per_token
+    assert triton["streaming_kv_cache"] == 2 * 16 * 2 * 16 * 4
+    torch_estimate = estimate_memory(tiny_config, backend="torch", context=64, streaming_capacity=16)
+    assert torch_estimate["kv_cache"] == 2 * 64 * per_token
+    assert torch_estimate["streaming_kv_cache"] == 2 * 16 * 2 * 16 * (4 + 2)
+
+
+def test_memory_tracker_phases():
+    tracker = MemoryTracker(torch.device("cpu"))
+    with tracker.phase("load"):
+        weights = torch.ones(16 * 2**20, dtype=torch.uint8)
+    with tracker.phase("decode"):
+        pass
+    assert set(tracker.phases) == {"load", "decode"}
+    assert "load" in tracker.report()
+    # Sampled around the phase, not the peak over the lifetime of the process
+    assert tracker.phases["load"]["rss_growth"] >= weights.numel()
+    assert tracker.phases["decode"]["rss_growth"] < weights.numel()
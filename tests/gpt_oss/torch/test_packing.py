@@ -0,0 +1,58 @@
+import pytest
+import torch
+
+from gpt_oss.torch.model import Transformer, _masked_attention, packed_sdpa
+from gpt_oss.torch.paged_cache import PagedKVCache
+
+SEQUENCES = [[1, 2, 3, 4, 5, 6, 7], [8], [9, 10, 11], [12, 13, 14, 15, 16, 17]]
+
+
+def block_diagonal_sdpa(q, k, v, sinks, sm_scale, seq_lens, sliding_window):
+    # One attention over all tokens with a mask that keeps every sequence to itself
+    seq_ids = torch.repeat_interleave(torch.arange(len(seq_lens)), torch.as_tensor(seq_lens))
+    idx = torch.arange(sum(seq_lens))
+    allowed = (seq_ids[:, None] == seq_ids[None, :]) & (idx[None, :] <= idx[:, None])
+    if sliding_window > 0:
+        allowed &= idx[:, None] - idx[None, :] < sliding_window
+    mask = q.new_zeros(allowed.shape).masked_fill(~allowed, -float("inf"))
+    return _masked_attention(q, k, v, sinks, sm_scale, mask)
+
+
+@pytest.mark.parametrize("sliding_window", [0, 2])
+def test_packed_sdpa_matches_block_diagonal_mask(sliding_window):
+    seq_lens = [5, 1, 3]
+    q = torch.randn(sum(seq_lens), 2, 2, 16)
+    k = torch.randn(sum(seq_lens), 2, 16)
+    v = torch.randn(sum(seq_lens), 2, 16)
+    sinks = torch.randn(4)
+    expected = block_diagonal_sdpa(q, k, v, sinks, 0.25, seq_lens, sliding_window)
+    torch.testing.assert_close(packed_sdpa(q, k, v, sinks, 0.25, seq_lens, sliding_window), expected)
+
+
+@pytest.fixture
+def model(tiny_checkpoint):
+    return Transformer.from_checkpoint(tiny_checkpoint, device="cpu")
+
+
+@torch.inference_mode()
+def test_packed_prefill_matches_separate_forward_passes(model):
+    logits = model.prefill_packed(SEQUENCES)
+    assert logits.shape == (len(SEQUENCES), model.config.vocab_size)
+    for tokens, packed in zip(SEQUENCES, logits):
+        expected = model(torch.as_tensor(tokens, dtype=torch.int32))[-1]
+        torch.testing.assert_close(packed, expected, atol=2e-2, rtol=2e-2)
+
+
+@torch.inference_mode()
+def test_packed_prefill_populates_kv_caches(model):
+    kv_cache = PagedKVCache(num_layers=2, num_blocks=16, block_size=4, num_kv_heads=2, head_dim=16)
+    tables = [kv_cache.new_sequence() for _ in SEQUENCES]
+    model.prefill_packed(SEQUENCES, kv_cache, tables)
+    assert [table.num_tokens for table in tables] == [len(tokens) for tokens in SEQUENCES]
+
+    # Decoding one more token per sequence reads the packed keys and values from the cache
+    next_tokens = [[20], [21], [22], [23]]
+    logits = model.prefill_packed(next_tokens, kv_cache, tables)
+    for tokens, next_token, decoded in zip(SEQUENCES, next_tokens, logits):
+        expected = model(torch.as_tensor(tokens + next_token, dtype=torch.int32))[-1]
+        torch.testing.assert_close(decoded, expected, atol=2e-2, rtol=2e-2)
@@ -0,0 +1,132 @@
+import pytest
+import torch
+
+from gpt_oss.torch.model import sdpa
+from gpt_oss.torch.paged_cache import (
+    BlockAllocator,
+    OutOfBlocksError,
+    PagedKVCache,
+    paged_attention,
+)
+
+
+def test_allocator_ref_counts():
+    allocator = BlockAllocator(2)
+    a = allocator.allocate()
+    allocator.share(a)
+    allocator.free(a)
+    assert allocator.num_free_blocks == 1
+    b = allocator.allocate()
+    with pytest.raises(OutOfBlocksError):
+        allocator.allocate()
+    allocator.free(a)
+    allocator.free(b)
+    assert allocator.num_free_blocks == 2
+
+
+def test_blocks_allocated_on_demand():
+    cache = PagedKVCache(num_layers=1, num_blocks=8, block_size=4, num_kv_heads=1, head_dim=2)
+    table = cache.new_sequence()
+    cache.prepare([table], [5])
+    assert len(table.blocks) == 2
+    cache.prepare([table], [3])
+    assert len(table.blocks) == 2 and table.num_tokens == 8
+    cache.prepare([table], [1])
+    assert len(table.blocks) == 3
+    cache.free(table)
+    assert cache.allocator.num_free_blocks == 8
+
+
+def test_prepare_fails_before_changing_any_table():
+    cache = PagedKVCache(num_layers=1, num_blocks=3, block_size=4, num_kv_heads=1, head_dim=2)
+    first, second = cache.new_sequence(), cache.new_sequence()
+    cache.prepare([first], [2])
+    # The first sequence fits in the free blocks, both do not
+    with pytest.raises(OutOfBlocksError):
+        cache.prepare([first, second], [6, 5])
+    assert first.blocks == [0] and first.num_tokens == 2
+    assert second.blocks == [] and second.num_tokens == 0
+    assert cache.allocator.num_free_blocks == 2
+
+
+def test_fork_copy_on_write():
+    cache = PagedKVCache(num_layers=1, num_blocks=8, block_size=4, num_kv_heads=1, head_dim=2, dtype=torch.float32)
+    parent = cache.new_sequence()
+    cache.prepare([parent], [6])
+    cache.k[0, parent.blocks[1], 1] = 1.0
+    child = cache.fork(parent)
+    assert child.blocks == parent.blocks
+    cache.prepare([child], [1])
+    # The full first block stays shared, the partially filled one is copied
+    assert child.blocks[0] == parent.blocks[0]
+    assert child.blocks[1] != parent.blocks[1]
+    assert torch.equal(cache.k[0, child.blocks[1], 1], cache.k[0, parent.blocks[1], 1])
+    cache.free(parent)
+    cache.free(child)
+    assert cache.allocator.num_free_blocks == 8
+
+
+@pytest.mark.parametrize("sliding_window", [0, 3])
+@pytest.mark.parametrize("offset", [0, 5])
+def test_paged_attention_matches_sdpa(sliding_window, offset):
+    torch.manual_seed(0)
+    n_tokens, n_heads, q_mult, d_head, block_size = 3, 2, 2, 8, 4
+    n_keys = offset + n_tokens
+    Q = torch.randn(n_tokens, n_heads, q_mult, d_head)
+    K = torch.randn(n_keys, n_heads, d_head)
+    V = torch.randn(n_keys, n_heads, d_head)
+    S = torch.randn(n_heads * q_mult)
+
+    # Scatter the keys over non-contiguous blocks
+    block_table = torch.tensor([3, 0, 2])
+    K_cache = torch.zeros(4, block_size, n_heads, d_head)
+    V_cache = torch.zeros(4, block_size, n_heads, d_head)
+    for pos in range(n_keys):
+        K_cache[block_table[pos // block_size], pos % block_size] = K[pos]
+        V_cache[block_table[pos // block_size], pos % block_size] = V[pos]
+
+    expected = sdpa(Q, K, V, S, 0.125, sliding_window, offset=offset)
+    actual = paged_attention(Q, K_cache, V_cache, block_table, offset, S, 0.125, sliding_window)
+    torch.testing.assert_close(actual, expected)
+
+
+@torch.inference_mode()
+def test_incremental_decode_matches_full_forward(tiny_model):
+    config = tiny_model.config
+    tokens = torch.randint(0, config.vocab_size, (11,), dtype=torch.int32)
+    cache = PagedKVCache(
+        num_layers=config.num_hidden_layers,
+        num_blocks=8,
+        block_size=4,
+        num_kv_heads=config.num_key_value_heads,
+        head_dim=config.head_dim,
+    )
+
+    expected = tiny_model(tokens).float()
+
+    table = cache.new_sequence()
+    prefill = tiny_model(tokens[:7], caches=cache.prepare([table], [7])).float()
+    decoded = [
+        tiny_model(tokens[i : i + 1], caches=cache.prepare([table], [1])).float()
+        for i in range(7, len(tokens))
+    ]
+    actual = torch.cat([prefill] + decoded)
+    torch.testing.assert_close(actual, expected, atol=2e-2, rtol=2e-2)
+
+
+@torch.inference_mode()
+def test_batched_sequences_match_individual_forward(tiny_model):
+    config = tiny_model.config
+    a = torch.randint(0, config.vocab_size, (6,), dtype=torch.int32)
+    b = torch.randint(0, config.vocab_size, (3,), dtype=torch.int32)
+    cache = PagedKVCache(
+        num_layers=config.num_hidden_layers,
+        num_blocks=8,
+        block_size=4,
+        num_kv_heads=config.num_key_value_heads,
+        head_dim=config.head_dim,
+    )
+    tables = [cache.new_sequence(), cache.new_sequence()]
+    logits = tiny_model(torch.cat([a, b]), caches=cache.prepare(tables, [6, 3])).float()
+    torch.testing.assert_close(logits[:6], tiny_model(a).float(), atol=2e-2, rtol=2e-2)
+    torch.testing.assert_close(logits[6:], tiny_model(b).float(), atol=2e-2, rtol=2e-2)
@@ -0,0 +1,100 @@
+from gpt_oss.torch.paged_cache import BlockAllocator
+from gpt_oss.torch.prefix_cache import RadixCache
+
+
+def make_cache(num_blocks=16, max_blocks=16, block_size=2):
+    allocator = BlockAllocator(num_blocks)
+    return allocator, RadixCache(allocator, block_size, max_blocks)
+
+
+def insert_sequence(allocator, cache, tokens):
+    blocks = [allocator.allocate() for _ in range(len(tokens) // cache.block_size)]
+    cache.insert(tokens, blocks)
+    # The sequence releases its own references, the cache keeps the blocks alive
+    for block in blocks:
+        allocator.free(block)
+    return blocks
+
+
+def test_match_longest_block_aligned_prefix():
+    allocator, cache = make_cache()
+    blocks = insert_sequence(allocator, cache, [1, 2, 3, 4, 5, 6])
+    assert cache.match([1, 2, 3, 4, 5, 6, 7]) == (6, blocks)
+    assert cache.match([1, 2, 3, 9]) == (2, blocks[:1])
+    # Partial blocks are never matched
+    assert cache.match([1]) == (0, [])
+    assert cache.match([7, 8]) == (0, [])
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2
+    assert stats["hit_tokens"] == 8
+
+
+def test_forked_conversations_share_common_prefix():
+    allocator, cache = make_cache()
+    a = insert_sequence(allocator, cache, [1, 2, 3, 4, 5, 6])
+    b = insert_sequence(allocator, cache, [1, 2, 3, 4, 7, 8])
+    assert cache.match([1, 2, 3, 4, 7, 8]) == (6, a[:2] + b[2:])
+    assert cache.match([1, 2, 3, 4, 5, 6]) == (6, a)
+    # The shared prefix is stored once: a[:2] + a[2:] + b[2:]
+    assert cache.num_blocks == 4
+    assert allocator.num_free_blocks == 16 - 4
+
+
+def test_lru_eviction_under_budget():
+    allocator, cache = make_cache(max_blocks=3)
+    insert_sequence(allocator, cache, [1, 2, 3, 4])
+    insert_sequence(allocator, cache, [5, 6])
+    cache.match([1, 2, 3, 4])
+    insert_sequence(allocator, cache, [7, 8])
+    # [5, 6] is the least recently used leaf
+    assert cache.match([5, 6]) == (0, [])
+    assert cache.match([1, 2, 3, 4])[0] == 4
+    assert cache.match([7, 8])[0] == 2
+    assert cache.num_blocks == 3
+
+
+def test_ensure_free_evicts_until_blocks_are_available():
+    allocator, cache = make_cache(num_blocks=4, max_blocks=4)
+    insert_sequence(allocator, cache, [1, 2, 3, 4])
+    insert_sequence(allocator, cache, [5, 6, 7, 8])
+    assert allocator.num_free_blocks == 0
+    cache.ensure_free(2)
+    assert allocator.num_free_blocks == 2
+    cache.clear()
+    assert allocator.num_free_blocks == 4 and cache.num_blocks == 0
+
+
+def test_ensure_free_skips_blocks_of_live_sequences():
+    allocator, cache = make_cache(num_blocks=4, max_blocks=4)
+    # A live sequence still holds [1, 2, 3, 4]
+    live = [allocator.allocate() for _ in range(2)]
+    cache.insert([1, 2, 3, 4], live)
+    insert_sequence(allocator, cache, [5, 6])
+    cache.match([5, 6])
+    cache.ensure_free(4)
+    # Only [5, 6] could be freed, although it was used more recently
+    assert allocator.num_free_blocks == 2
+    assert cache.match([1, 2, 3, 4]) == (4, live)
+
+
+def test_ensure_free_keeps_the_shared_part_of_an_edge():
+    allocator, cache = make_cache(num_blocks=4, max_blocks=4)
+    blocks = insert_sequence(allocator, cache, [1, 2, 3, 4, 5, 6])
+    # A sequence forked the first block
+    allocator.share(blocks[0])
+    cache.ensure_free(3)
+    assert allocator.num_free_blocks == 3
+    assert cache.match([1, 2, 3, 4, 5, 6]) == (2, blocks[:1])
+    assert cache.num_blocks == 1
+
+
+def test_many_leaves_are_evicted_in_lru_order():
+    allocator, cache = make_cache(num_blocks=64, max_blocks=64)
+    for i in range(32):
+        insert_sequence(allocator, cache, [i, i])
+    for i in range(0, 32, 2):
+        cache.match([i, i])
+    cache.ensure_free(64 - 16)
+    assert [i for i in range(32) if cache.match([i, i])[0]] == list(range(0, 32, 2))
+    cache.clear()
+    assert allocator.num_free_blocks == 64 and cache.num_blocks == 0 and not cache.root.children
@@ -0,0 +1,43 @@
+import json
+
+import torch
+
+from gpt_oss.torch.profiling import Profiler, region
+
+
+def test_nested_regions_inherit_layer():
+    with Profiler() as profiler:
+        with region("block", 3):
+            with region("attn"):
+                pass
+        with region("norm_f"):
+            pass
+    events = {event.name: event for event in profiler.events}
+    assert events["attn"].layer_idx == 3
+    assert events["attn"].depth == 1
+    assert events["norm_f"].layer_idx is None
+    # Regions outside of a profiler are not recorded
+    with region("attn"):
+        pass
+    assert len(profiler.events) == 3
+
+
+@torch.inference_mode()
+def test_torch_model_summary_and_trace(tmp_path, tiny_model):
+    tokens = torch.arange(6, dtype=torch.int32)
+    with Profiler() as profiler:
+        tiny_model(tokens)
+        tiny_model(tokens)
+
+    summary = profiler.summary()
+    for name in ("embedding", "block", "attn", "qkv", "rope", "attn_kernel", "mlp", "routing", "w1", "w2"):
+        assert name in summary["ops"]
+    assert summary["ops"]["block"]["count"] == 2 * tiny_model.config.num_hidden_layers
+    assert set(summary["layers"]) == {0, 1}
+    assert "mlp" in profiler.summary_table()
+
+    path = tmp_path / "trace.json"
+    profiler.to_chrome_trace(str(path))
+    trace = json.loads(path.read_text())
+    assert {event["ph"] for event in trace["traceEvents"]} == {"X"}
+    assert "attn[1]" in {event["name"] for event in trace["traceEvents"]}
@@ -0,0 +1,45 @@
+import json
+import math
+
+import torch
+
+from gpt_oss.torch.model import MLPBlock
+from gpt_oss.torch.router_telemetry import RouterTelemetry
+
+
+def test_counts_entropy_and_imbalance():
+    telemetry = RouterTelemetry(num_layers=2, num_experts=4, flush_interval=2)
+    indices = torch.tensor([[0, 1], [0, 2]])
+    weights = torch.tensor([[0.5, 0.5], [1.0, 0.0]])
+    telemetry.record(1, indices, weights)
+    telemetry.step()
+    # Counters stay on device until the flush interval is reached
+    assert telemetry.host_counts.sum() == 0
+    telemetry.step()
+    assert telemetry.host_counts[1].tolist() == [2, 1, 1, 0]
+
+    layer = telemetry.summary()["layers"][1]
+    assert layer["tokens"] == 2
+    assert math.isclose(layer["gate_entropy"], math.log(2) / 2, rel_tol=1e-5)
+    assert math.isclose(layer["imbalance"], 2.0)
+    assert layer["unused_experts"] == 1
+
+
+def test_record_logits_and_json_export(tmp_path):
+    telemetry = RouterTelemetry(num_layers=1, num_experts=4)
+    telemetry.record_logits(0, torch.tensor([[0.0, 3.0, 2.0, 1.0]]), experts_per_token=2)
+    path = tmp_path / "router.json"
+    telemetry.to_json(str(path))
+    stats = json.loads(path.read_text())
+    assert stats["layers"][0]["expert_counts"] == [0, 1, 1, 0]
+
+
+@torch.inference_mode()
+def test_mlp_block_records_routing(tiny_config):
+    mlp = MLPBlock(tiny_config, layer_idx=0, device=torch.device("cpu"))
+    for param in mlp.parameters():
+        param.data.normal_(0.0, 0.1)
+    mlp.telemetry = RouterTelemetry(num_layers=1, num_experts=4)
+    mlp(torch.randn(5, 32, dtype=torch.bfloat16))
+    summary = mlp.telemetry.summary()
+    assert sum(summary["layers"][0]["expert_counts"]) == 5 * 2
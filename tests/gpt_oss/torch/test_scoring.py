@@ -0,0 +1,19 @@
+def test_score_matches_generated_logprobs(make_generator):
+    generator = make_generator()
+    prompt = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    generated = list(generator.generate(prompt, [], temperature=0.0, max_tokens=5, return_logprobs=True))
+    continuation = [token for token, _ in generated]
+
+    scores = generator.score(prompt, continuation, top_n=3)
+    assert [score.token for score in scores] == continuation
+    for score, (token, logprob) in zip(scores, generated):
+        assert abs(score.logprob - logprob) < 2e-2
+        # Greedy decoding picked the most likely token
+        assert score.top[0][0] == token
+        assert len(score.top) == 3
+
+    # Scoring another candidate for the same prompt reuses its cached KV entries
+    hit_tokens = generator.prefix_cache.hit_tokens
+    generator.score(prompt, [10, 11])
+    assert generator.prefix_cache.hit_tokens == hit_tokens + 8
+    assert generator.kv_cache.allocator.num_free_blocks + generator.prefix_cache.num_blocks == 16
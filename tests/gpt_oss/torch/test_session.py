@@ -0,0 +1,65 @@
+import pytest
+
+from gpt_oss.torch.fast_mode import get_experts_per_token
+
+
+def test_session_matches_fresh_generation(make_generator):
+    generator = make_generator(context=128, prefix_cache=False)
+    session = generator.session()
+    conversation = [1, 2, 3, 4, 5, 6, 7]
+    for turn in range(3):
+        expected = list(generator.generate(conversation, [], temperature=0.0, max_tokens=3))
+        reply = list(session.generate(conversation, [], temperature=0.0, max_tokens=3))
+        assert reply == expected
+        # The KV state covers the conversation and all generated tokens but the last one
+        assert session.tokens == conversation + reply[:-1]
+        conversation = conversation + reply + [10 + turn, 11 + turn]
+    session.close()
+    assert generator.kv_cache.allocator.num_free_blocks == generator.kv_cache.allocator.num_blocks
+
+
+def test_session_rolls_back_diverging_suffix(make_generator):
+    generator = make_generator(context=128, prefix_cache=False)
+    with generator.session() as session:
+        list(session.generate([1, 2, 3, 4, 5, 6, 7, 8, 9], [], temperature=0.0, max_tokens=2))
+        # The re-rendered conversation differs from the cached tokens after position 5
+        conversation = [1, 2, 3, 4, 5, 20, 21]
+        reply = list(session.generate(conversation, [], temperature=0.0, max_tokens=2))
+        assert session.tokens[:7] == conversation
+    assert reply == list(generator.generate(conversation, [], temperature=0.0, max_tokens=2))
+
+
+def test_append_then_generate(make_generator):
+    generator = make_generator(context=128, prefix_cache=False)
+    with generator.session() as session:
+        session.append([1, 2, 3, 4, 5])
+        assert session.tokens == [1, 2, 3, 4, 5]
+        reply = list(session.generate([1, 2, 3, 4, 5, 6], [], temperature=0.0, max_tokens=2))
+    assert reply == list(generator.generate([1, 2, 3, 4, 5, 6], [], temperature=0.0, max_tokens=2))
+
+
+def test_prompt_longer_than_context(make_generator):
+    generator = make_generator(context=8)
+    with pytest.raises(ValueError, match="exceed the context length of 8"):
+        list(generator.generate(list(range(1, 10)), [], temperature=0.0, max_tokens=1))
+    assert generator.kv_cache.allocator.num_free_blocks == generator.kv_cache.allocator.num_blocks
+
+
+def test_reduced_experts_do_not_leak_into_other_sessions(make_generator):
+    generator = make_generator(context=128, prefix_cache=False)
+    prompt = [1, 2, 3, 4, 5, 6, 7]
+    expected = list(generator.generate(prompt, [], temperature=0.0, max_tokens=3))
+    with generator.session() as fast:
+        reply = fast.generate(prompt, [], temperature=0.0, max_tokens=3, experts_per_token=1)
+        next(reply)
+        # The fast session is suspended between two of its tokens
+        assert get_experts_per_token(generator.model) == [2, 2]
+        assert list(generator.generate(prompt, [], temperature=0.0, max_tokens=3)) == expected
+        assert len(list(reply)) == 2
+
+
+def test_empty_prompt(make_generator):
+    generator = make_generator()
+    with generator.session() as session:
+        with pytest.raises(AssertionError, match="must not be empty"):
+            next(session.generate([], [], temperature=0.0))
@@ -0,0 +1,130 @@
+import pytest
+import torch
+
+from gpt_oss.torch.model import RotaryEmbedding, Transformer
+from gpt_oss.torch.streaming import StreamingConfig, StreamingKVCache, evict_kv, rotate_keys
+from gpt_oss.torch.streaming_eval import compare_streaming, full_attention_logprobs
+
+
+def make_rope():
+    # With YaRN scaling, so that the keys are scaled by the concentration as well
+    return RotaryEmbedding(16, 150000, torch.float32, scaling_factor=32.0)
+
+
+def test_rotate_keys_moves_positions():
+    rope = make_rope()
+    _, inv_freq = rope._compute_concentration_and_inv_freq()
+    key = torch.randn(6, 2, 16)
+    positions = torch.arange(10, 16)
+    _, at_positions = rope(key.clone(), key.clone(), positions=positions)
+    _, expected = rope(key.clone(), key.clone(), positions=positions - 7)
+    torch.testing.assert_close(rotate_keys(at_positions, -7, inv_freq), expected, atol=1e-5, rtol=1e-5)
+
+
+def test_evict_kv_compacts_positions():
+    rope = make_rope()
+    _, inv_freq = rope._compute_concentration_and_inv_freq()
+    raw_k = torch.randn(10, 2, 16)
+    raw_v = torch.randn(10, 2, 16)
+    _, k = rope(raw_k.clone(), raw_k.clone(), positions=torch.arange(10))
+    k, v = k[None].clone(), raw_v[None].clone()
+    # Two sinks, evict entries 2 to 4
+    evict_kv(k, v, num_sink_tokens=2, num_cached=10, n=3, inv_freq=inv_freq)
+    kept = torch.tensor([0, 1, 5, 6, 7, 8, 9])
+    _, expected = rope(raw_k[kept].clone(), raw_k[kept].clone(), positions=torch.arange(7))
+    torch.testing.assert_close(k[0, :7], expected, atol=1e-5, rtol=1e-5)
+    torch.testing.assert_close(v[0, :7], raw_v[kept])
+
+
+def test_evict_kv_rounds_keys_once():
+    rope = make_rope()
+    _, inv_freq = rope._compute_concentration_and_inv_freq()
+    raw_k = torch.randn(24, 2, 16)
+    _, k_fp32 = rope(raw_k.clone(), raw_k.clone(), positions=torch.arange(24))
+    k_fp32 = k_fp32[None].clone()
+    k, v = k_fp32.to(torch.bfloat16), torch.zeros(1, 24, 2, 16, dtype=torch.bfloat16)
+    # One sink, evict one entry at a time
+    for num_cached in range(24, 4, -1):
+        evict_kv(k, v, num_sink_tokens=1, num_cached=num_cached, n=1, inv_freq=inv_freq, k_fp32=k_fp32)
+    kept = torch.tensor([0, 21, 22, 23])
+    _, expected = rope(raw_k[kept].clone(), raw_k[kept].clone(), positions=torch.arange(4))
+    torch.testing.assert_close(k_fp32[0, :4], expected, atol=1e-5, rtol=1e-5)
+    torch.testing.assert_close(k[0, :4], expected.to(torch.bfloat16))
+
+
+def test_num_to_evict():
+    config = StreamingConfig(num_sink_tokens=2, window=8, evict_chunk=3, chunk_size=4)
+    assert config.capacity == 10
+    assert config.num_to_evict(6, 4) == 0
+    # One entry too many, evicted in a chunk of three
+    assert config.num_to_evict(10, 1) == 3
+    assert config.num_to_evict(10, 4) == 4
+    assert config.can_truncate(10, num_evicted=0, n=10)
+    assert not config.can_truncate(10, num_evicted=3, n=9)
+
+
+def test_window_must_cover_the_sliding_window(tiny_model):
+    # The sliding window of the tiny model is 4 tokens
+    with pytest.raises(AssertionError, match="must be at least 10"):
+        StreamingKVCache(tiny_model, StreamingConfig(num_sink_tokens=2, window=8, evict_chunk=2, chunk_size=4))
+
+
+def test_large_window_matches_full_attention(tiny_checkpoint):
+    model = Transformer.from_checkpoint(tiny_checkpoint, device=torch.device("cpu"))
+    tokens = list(range(1, 21))
+    cache = StreamingKVCache(model, StreamingConfig(num_sink_tokens=2, window=32, evict_chunk=8, chunk_size=8))
+    x = torch.as_tensor(tokens, dtype=torch.int32)
+    with torch.inference_mode():
+        logits = torch.cat([model(chunk, caches=cache.prepare(len(chunk))) for chunk in x.split(8)])
+        expected = model(x)
+    torch.testing.assert_close(logits, expected, atol=2e-2, rtol=2e-2)
+
+
+def test_streaming_session_bounds_cache(make_generator):
+    config = StreamingConfig(num_sink_tokens=2, window=10, evict_chunk=2, chunk_size=4)
+    generator = make_generator(context=128, prefix_cache=False, streaming=config)
+    with generator.session() as session:
+        prompt = [(7 * i) % 60 + 1 for i in range(30)]
+        reply = list(session.generate(prompt, [], temperature=0.0, max_tokens=12))
+        assert len(reply) == 12
+        assert session.tokens == prompt + reply[:-1]
+        assert session.cache.num_tokens <= config.capacity
+        assert session.cache.num_evicted == len(session.tokens) - session.cache.num_tokens
+
+        # Continuing the conversation only appends the new tokens
+        num_evicted = session.cache.num_evicted
+        conversation = prompt + reply + [3, 4]
+        list(session.generate(conversation, [], temperature=0.0, max_tokens=1))
+        assert session.tokens == conversation
+        assert session.cache.num_evicted >= num_evicted
+
+        # Rolling back over evicted tokens starts over
+        list(session.generate([1, 2, 3], [], temperature=0.0, max_tokens=1))
+        assert session.tokens == [1, 2, 3]
+        assert session.cache.num_evicted == 0
+
+
+def test_streaming_matches_regular_generation_within_window(make_generator):
+    streaming = StreamingConfig(num_sink_tokens=4, window=64, evict_chunk=8, chunk_size=8)
+    generator = make_generator(context=128, prefix_cache=False, streaming=streaming)
+    prompt = list(range(1, 20))
+    streamed = list(generator.generate(prompt, [], temperature=0.0, max_tokens=5))
+    generator.streaming = None
+    assert streamed == list(generator.generate(prompt, [], temperature=0.0, max_tokens=5))
+
+
+def test_compare_streaming(tiny_checkpoint):
+    model = Transformer.from_checkpoint(tiny_checkpoint, device=torch.device("cpu"))
+    tokens = [(5 * i) % 60 + 1 for i in range(40)]
+
+    unbounded = compare_streaming(model, tokens, StreamingConfig(num_sink_tokens=4, window=64, evict_chunk=4, chunk_size=4))
+    assert unbounded["all"]["num_tokens"] == 39
+    assert unbounded["all"]["mean_abs_logprob_diff"] == 0.0
+    assert unbounded["all"]["top1_agreement"] == 1.0
+    assert unbounded["beyond_capacity"]["num_tokens"] == 0
+
+    config = StreamingConfig(num_sink_tokens=2, window=12, evict_chunk=4, chunk_size=4)
+    reference = full_attention_logprobs(model, tokens, chunk_size=4)
+    bounded = compare_streaming(model, tokens, config, reference)
+    assert bounded["beyond_capacity"]["num_tokens"] == 39 - config.capacity
+    assert bounded["beyond_capacity"]["mean_abs_logprob_diff"] > 0.0
@@ -0,0 +1,37 @@
+import dataclasses
+import os
+
+import torch
+
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.synthetic_checkpoint import PRESETS, write_synthetic_checkpoint
+from gpt_oss.torch.weights import Checkpoint
+
+CONFIG = dataclasses.replace(PRESETS["tiny"], vocab_size=64)
+
+
+def test_checkpoint_layout(tmp_path):
+    filenames = write_synthetic_checkpoint(str(tmp_path), CONFIG, num_shards=3)
+    assert len(filenames) == 3
+    assert sorted(os.listdir(tmp_path)) == sorted(filenames + ["config.json"])
+
+    checkpoint = Checkpoint(str(tmp_path), torch.device("cpu"))
+    names = set(checkpoint.tensor_name_to_file)
+    assert "block.1.mlp.mlp1_weight.blocks" in names
+    assert "block.1.mlp.mlp1_weight.scales" in names
+    blocks_file = checkpoint.tensor_name_to_file["block.0.mlp.mlp2_weight.blocks"]
+    assert checkpoint.tensor_name_to_file["block.0.mlp.mlp2_weight.scales"] == blocks_file
+
+    mlp1 = checkpoint.get("block.0.mlp.mlp1_weight")
+    assert mlp1.shape == (CONFIG.num_experts, CONFIG.intermediate_size * 2, CONFIG.hidden_size)
+    assert torch.isfinite(mlp1).all()
+
+
+@torch.inference_mode()
+def test_from_checkpoint_runs(tmp_path):
+    write_synthetic_checkpoint(str(tmp_path), CONFIG, num_shards=2)
+    model = Transformer.from_checkpoint(str(tmp_path), device="cpu")
+    assert model.config == CONFIG
+    logits = model(torch.arange(5, dtype=torch.int32))
+    assert logits.shape == (5, CONFIG.vocab_size)
+    assert torch.isfinite(logits).all()
@@ -0,0 +1,48 @@
+import dataclasses
+import json
+import struct
+
+import torch
+from safetensors import safe_open
+
+from gpt_oss.torch.model import Transformer
+from gpt_oss.torch.synthetic_checkpoint import PRESETS, write_synthetic_checkpoint
+from gpt_oss.torch.weights import Checkpoint, get_mapped_tensor, map_safetensors
+
+CONFIG = dataclasses.replace(PRESETS["tiny"], vocab_size=64)
+
+
+def test_cpu_tensors_are_views_into_the_mapped_file(tmp_path):
+    write_synthetic_checkpoint(str(tmp_path), CONFIG, num_shards=2)
+    checkpoint = Checkpoint(str(tmp_path), torch.device("cpu"))
+    for name, path in checkpoint.tensor_name_to_file.items():
+        with safe_open(path, framework="pt", device="cpu") as f:
+            expected = f.get_tensor(name)
+        mapped = checkpoint._get_tensor(name)
+        assert mapped.dtype == expected.dtype
+        assert torch.equal(mapped, expected)
+        # No copy: every read of a tensor points at the same mapped pages
+        assert checkpoint._get_tensor(name).data_ptr() == mapped.data_ptr()
+
+
+def test_misaligned_tensors_are_copied(tmp_path):
+    values = torch.arange(6, dtype=torch.float32)
+    header = json.dumps({"x": {"dtype": "F32", "shape": [2, 3], "data_offsets": [0, 24]}}).encode()
+    # The safetensors writer pads the header to 8 bytes, other writers may not
+    header += b" " * (8 - len(header) % 8 + 1)
+    path = tmp_path / "odd.safetensors"
+    path.write_bytes(struct.pack("<Q", len(header)) + header + values.numpy().tobytes())
+    mapped = get_mapped_tensor(map_safetensors(str(path)), "x")
+    assert mapped.data_ptr() % 4 == 0
+    assert torch.equal(mapped, values.view(2, 3))
+
+
+@torch.inference_mode()
+def test_from_checkpoint_materializes_every_parameter(tmp_path):
+    write_synthetic_checkpoint(str(tmp_path), CONFIG)
+    model = Transformer.from_checkpoint(str(tmp_path), device="cpu")
+    checkpoint = Checkpoint(str(tmp_path), torch.device("cpu"))
+    for name, param in model.named_parameters():
+        assert not param.is_meta, name
+        assert torch.equal(param, checkpoint.get(name).to(param.dtype)), name
+    assert model.block[0].attn.rope.device == torch.device("cpu")
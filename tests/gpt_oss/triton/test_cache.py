@@ -0,0 +1,134 @@
+import pytest
+import torch
+
+from gpt_oss.torch.attention_backends import ATTENTION_BACKENDS
+from gpt_oss.triton.cache import Cache, CacheSlots, NoFreeSlotError
+
+
+def eager_truncate(cache: Cache, n_ctx: int):
+    # The previous implementation, which zeroed everything after n_ctx
+    cache.k[:, n_ctx:].zero_()
+    cache.v[:, n_ctx:].zero_()
+    cache.offset.fill_(n_ctx)
+
+
+def attend(cache: Cache, backend: str, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, sliding_window: int):
+    start_q = cache.offset.clone()
+    keys, values = cache.extend(k, v)
+    sinks = torch.linspace(-1.0, 1.0, q.shape[2] * q.shape[3]).bfloat16()
+    return ATTENTION_BACKENDS[backend].fn(q, keys, values, sinks, 0.25, sliding_window, start_q)
+
+
+@pytest.mark.parametrize("backend", ["ref", "sdpa"])
+@pytest.mark.parametrize("sliding_window", [0, 4])
+@pytest.mark.parametrize("num_new_tokens", [1, 3])
+def test_lazy_truncate_matches_eager(backend, sliding_window, num_new_tokens):
+    torch.manual_seed(0)
+    batch_size, n_ctx, n_kv_heads, q_mult, d_head = 2, 16, 2, 2, 16
+    lazy = Cache(batch_size, n_ctx, n_kv_heads, d_head)
+    eager = Cache(batch_size, n_ctx, n_kv_heads, d_head)
+    k = torch.randn(batch_size, 12, n_kv_heads, d_head).bfloat16()
+    v = torch.randn(batch_size, 12, n_kv_heads, d_head).bfloat16()
+    for cache in (lazy, eager):
+        cache.extend(k, v)
+
+    lazy.truncate(5)
+    eager_truncate(eager, 5)
+    assert lazy.offset.tolist() == eager.offset.tolist() == [5] * batch_size
+    # The stale entries are still there, but never attended to
+    assert lazy.k[:, 5:12].abs().sum() > 0
+
+    q = torch.randn(batch_size, num_new_tokens, n_kv_heads, q_mult, d_head).bfloat16()
+    new_k = torch.randn(batch_size, num_new_tokens, n_kv_heads, d_head).bfloat16()
+    new_v = torch.randn(batch_size, num_new_tokens, n_kv_heads, d_head).bfloat16()
+    expected = attend(eager, backend, q, new_k, new_v, sliding_window)
+    actual = attend(lazy, backend, q, new_k, new_v, sliding_window)
+    torch.testing.assert_close(actual, expected, rtol=0, atol=0)
+    torch.testing.assert_close(lazy.k[:, : 5 + num_new_tokens], eager.k[:, : 5 + num_new_tokens], rtol=0, atol=0)
+
+
+def test_truncate_does_not_write_kv():
+    cache = Cache(1, 8, 1, 16)
+    cache.extend(torch.ones(1, 6, 1, 16).bfloat16(), torch.ones(1, 6, 1, 16).bfloat16())
+    k, v = cache.k.clone(), cache.v.clone()
+    cache.truncate(2)
+    assert cache.offset.item() == 2
+    assert torch.equal(cache.k, k) and torch.equal(cache.v, v)
+
+
+def test_rows_append_at_their_own_offset():
+    cache = Cache(2, 8, 1, 16)
+    cache.extend(torch.ones(2, 4, 1, 16).bfloat16(), torch.ones(2, 4, 1, 16).bfloat16())
+    cache.truncate(1, slot=0)
+    assert cache.offset.tolist() == [1, 4]
+    cache.extend(torch.full((2, 2, 1, 16), 2.0).bfloat16(), torch.full((2, 2, 1, 16), 3.0).bfloat16())
+    assert cache.offset.tolist() == [3, 6]
+    assert cache.k[0, :3, 0, 0].tolist() == [1.0, 2.0, 2.0]
+    assert cache.k[1, :6, 0, 0].tolist() == [1.0, 1.0, 1.0, 1.0, 2.0, 2.0]
+
+
+def test_slot_view_shares_storage():
+    cache = Cache(3, 8, 1, 16)
+    view = cache.slot(1)
+    view.extend(torch.ones(1, 5, 1, 16).bfloat16(), torch.ones(1, 5, 1, 16).bfloat16())
+    assert cache.offset.tolist() == [0, 5, 0]
+    assert cache.k[1, :5].eq(1).all() and cache.k[0].eq(0).all()
+    cache.reset(slot=1)
+    assert cache.offset.tolist() == [0, 0, 0] and cache.k[1].eq(0).all()
+
+
+def test_slots_keep_conversations():
+    slots = CacheSlots(2, n_ctx=16)
+    a, num_cached = slots.acquire([1, 2, 3])
+    assert num_cached == 0
+    slots.append(a, [1, 2, 3])
+    b, _ = slots.acquire([1, 2, 9])
+    assert b != a
+    slots.append(b, [1, 2, 9])
+    # A busy slot is only reused by the conversation it holds
+    assert slots.acquire([1, 2, 3, 4]) == (a, 3)
+    assert slots.acquire([1, 2, 9, 5]) == (b, 3)
+
+    # Released slots keep their tokens for the next turn of the conversation
+    slots.release(a)
+    assert slots.num_free_slots == 1
+    assert slots.acquire([1, 2, 3, 4, 5]) == (a, 3)
+
+
+def test_new_conversations_take_their_own_slot():
+    slots = CacheSlots(2, n_ctx=16, steal=False)
+    a, _ = slots.acquire([1, 2, 3])
+    slots.append(a, [1, 2, 3])
+    # Not the busy slot holding the same prompt
+    b, num_cached = slots.acquire([1, 2, 3, 4], new=True)
+    assert b != a and num_cached == 0
+    with pytest.raises(NoFreeSlotError):
+        slots.acquire([1, 2, 3, 4], new=True)
+
+
+def test_slots_steal_least_recently_used():
+    slots = CacheSlots(2, n_ctx=16)
+    a, _ = slots.acquire([1])
+    slots.append(a, [1])
+    b, _ = slots.acquire([2])
+    slots.append(b, [2])
+    slots.acquire([1, 1])
+    assert slots.acquire([3]) == (b, 0)
+    strict = CacheSlots(1, n_ctx=16, steal=False)
+    strict.acquire([1])
+    with pytest.raises(NoFreeSlotError):
+        strict.acquire([2])
+
+
+def test_slots_sync_rolls_back_offsets():
+    slots = CacheSlots(2, n_ctx=8)
+    assert slots.acquire([4, 5]) == (0, 0)
+    slots.append(0, [4, 5])
+    cache = Cache(2, 8, 1, 16)
+    # A batched decode step appends to every slot
+    cache.extend(torch.ones(2, 3, 1, 16).bfloat16(), torch.ones(2, 3, 1, 16).bfloat16())
+    slots.sync([cache])
+    assert cache.offset.tolist() == [2, 0]
+    with pytest.raises(AssertionError):
+        # One entry per slot stays free for the dummy tokens of batched decode steps
+        slots.append(0, [1] * 6)
@@ -0,0 +1,76 @@
+import pytest
+import torch
+
+from gpt_oss.torch.weights import dequantize_mxfp4
+from gpt_oss.triton.mxfp4 import quantize_mxfp4_ref, transpose_mxfp4
+
+
+def random_checkpoint_weight(num_experts=3, rows=8, groups=2, canonical=True):
+    generator = torch.Generator().manual_seed(0)
+    blocks = torch.randint(0, 256, (num_experts, rows, groups, 16), dtype=torch.uint8, generator=generator)
+    scales = torch.randint(115, 135, (num_experts, rows, groups), dtype=torch.uint8, generator=generator)
+    if canonical:
+        # A quantizer picks the scale that makes the largest value of a block 4 or 6 (+-), e.g. nibbles 6, 7, 14, 15
+        largest = torch.tensor([6, 7, 14, 15], dtype=torch.uint8)[torch.randint(0, 4, scales.shape, generator=generator)]
+        blocks[..., 0] = (blocks[..., 0] & 0xF0) | largest
+    return blocks, scales
+
+
+def dequantize_transposed(values, scales):
+    # Values [..., in / 2, out] and scales [..., in / 32, out] as returned by quantize_mxfp4_ref(..., axis=-2)
+    return dequantize_mxfp4(values.mT.unflatten(-1, (-1, 16)), scales.mT).mT
+
+
+def test_transpose_matches_requantization():
+    blocks, scales = random_checkpoint_weight()
+    weight = dequantize_mxfp4(blocks, scales)
+    expected_values, expected_scales = quantize_mxfp4_ref(weight.mT, axis=1)
+    values, transposed_scales = transpose_mxfp4(blocks, scales)
+    assert values.shape == (3, 32, 8) and transposed_scales.shape == (3, 2, 8)
+    assert torch.equal(values, expected_values)
+    assert torch.equal(transposed_scales, expected_scales)
+
+
+def test_transpose_matches_triton_kernels():
+    # The quantization quantize_mx4 applies to the bf16 weights, which repack_mx4 replaces
+    mxfp = pytest.importorskip("triton_kernels.numerics_details.mxfp")
+    blocks, scales = random_checkpoint_weight()
+    weight = dequantize_mxfp4(blocks, scales).mT.to(torch.bfloat16)
+    if torch.cuda.is_available():
+        expected_values, expected_scales = mxfp.downcast_to_mxfp(weight.cuda(), torch.uint8, axis=1)
+    else:
+        expected_values, expected_scales = mxfp.downcast_to_mxfp_torch(weight, torch.uint8, axis=1)
+    values, transposed_scales = transpose_mxfp4(blocks, scales)
+    assert torch.equal(values, expected_values.cpu())
+    assert torch.equal(transposed_scales, expected_scales.cpu())
+
+
+def test_transpose_is_lossless():
+    # Blocks whose largest value is small get other scales when requantized, the repacked values stay the same
+    blocks, scales = random_checkpoint_weight(canonical=False)
+    weight = dequantize_mxfp4(blocks, scales)
+    assert torch.equal(dequantize_transposed(*transpose_mxfp4(blocks, scales)), weight.mT)
+    assert torch.equal(dequantize_transposed(*quantize_mxfp4_ref(weight.mT, axis=1)), weight.mT)
+
+
+def test_quantize_ref_rounding():
+    x = torch.zeros(1, 32)
+    # 1.25 and -3.5 are halfway between two FP4 values and round away from zero
+    x[0, :4] = torch.tensor([6.0, 1.25, 0.25, -3.5])
+    values, scales = quantize_mxfp4_ref(x, axis=1)
+    assert scales.tolist() == [[127]]
+    assert values[0, :2].tolist() == [0x37, 0xE1]
+    assert values[0, 2:].eq(0).all()
+
+    # The scale is rounded up to the next power of two
+    values, scales = quantize_mxfp4_ref(x * 1.5, axis=1)
+    assert scales.tolist() == [[128]]
+
+
+@pytest.mark.parametrize("axis", [0, 1])
+def test_quantize_ref_axis(axis):
+    x = torch.randn(64, 64)
+    values, scales = quantize_mxfp4_ref(x, axis=axis)
+    expected_values, expected_scales = quantize_mxfp4_ref(x.mT, axis=1 - axis)
+    assert torch.equal(values, expected_values.mT)
+    assert torch.equal(scales, expected_scales.mT)
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import torch
+
+from gpt_oss.torch.engine import Engine
+from gpt_oss.triton.engine import TritonModelRunner
+
+VOCAB_SIZE = 64
+
+
+class SummingModel(torch.nn.Module):
+    """Stands in for the triton Transformer: the next token is the sum of the tokens in the cache row."""
+
+    def __init__(self, num_layers: int = 2):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(VOCAB_SIZE, 4)
+        self.config = SimpleNamespace(num_key_value_heads=1, head_dim=4)
+        self.block = [None] * num_layers
+        self.batch_sizes = []
+
+    def forward(self, x, caches, logits_indices=None):
+        batch_size, n_ctx = x.shape
+        self.batch_sizes.append(batch_size)
+        kv = x.bfloat16()[..., None, None].expand(batch_size, n_ctx, 1, 4)
+        for cache in caches:
+            keys, _ = cache.extend(kv, kv)
+        sums = keys[..., 0, 0].float().cumsum(dim=1)
+        positions = caches[0].offset[:, None] - n_ctx + torch.arange(n_ctx)
+        next_tokens = sums.gather(1, positions).long() % VOCAB_SIZE
+        logits = torch.nn.functional.one_hot(next_tokens, VOCAB_SIZE).float()
+        return logits if logits_indices is None else logits[:, logits_indices]
+
+
+def expected_tokens(prompt: list[int], max_tokens: int) -> list[int]:
+    tokens = list(prompt)
+    for _ in range(max_tokens):
+        tokens.append(sum(tokens) % VOCAB_SIZE)
+    return tokens[len(prompt) :]
+
+
+def test_engine_on_slots():
+    model = SummingModel()
+    runner = TritonModelRunner(model, num_slots=2, context=32)
+    engine = Engine(runner, max_num_tokens=8)
+    prompts = [[1, 2, 3], list(range(12)), [5], [7, 7]]
+    requests = {engine.add_request(prompt, temperature=0.0, max_tokens=4): prompt for prompt in prompts}
+    generated = {}
+    while engine.has_unfinished():
+        for output in engine.step():
+            generated.setdefault(output.request_id, []).append(output.token)
+    assert generated == {request_id: expected_tokens(prompt, 4) for request_id, prompt in requests.items()}
+    # Only two sequences hold a slot at a time, and their decode steps share one pass over both slots
+    assert len(runner.free_slots) == 2
+    assert 2 in model.batch_sizes
+
+
+def test_sequences_fit_in_their_slot():
+    runner = TritonModelRunner(SummingModel(), num_slots=1, context=8)
+    handles = [runner.new_sequence(), runner.new_sequence()]
+    assert runner.max_context == 7
+    assert runner.can_append(handles[:1], [7]) and not runner.can_append(handles[:1], [8])
+    # One free slot for two new sequences
+    assert not runner.can_append(handles, [1, 1])
+    runner.forward(handles[:1], [[1, 2, 3]])
+    assert runner.can_append(handles[:1], [4]) and not runner.can_append(handles[:1], [5])
+    runner.free(handles[0])
+    assert runner.free_slots == [0] and handles[0].num_tokens == 0
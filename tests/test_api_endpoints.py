@@ -227,4 +227,122 @@ class TestUsageTracking:
         usage2 = response2.json()["usage"]
         
         # Longer input should use more tokens
-        assert usage2["input_tokens"] > usage1["input_tokens"]
\ No newline at end of file
+        assert usage2["input_tokens"] > usage1["input_tokens"]
+
+
+class TestScoreEndpoint:
+
+    @pytest.fixture
+    def score_client(self, harmony_encoding, mock_infer_token):
+        from types import SimpleNamespace
+        from fastapi.testclient import TestClient
+        from gpt_oss.responses_api.api_server import create_api_server
+
+        def mock_score(prompt_tokens, continuation_tokens, top_n=0):
+            return [
+                SimpleNamespace(token=token, logprob=-0.5, top=[(token, -0.5)][:top_n])
+                for token in continuation_tokens
+            ]
+
+        app = create_api_server(mock_infer_token, harmony_encoding, score=mock_score)
+        with TestClient(app) as client:
+            yield client
+
+    def test_score_text(self, score_client, harmony_encoding):
+        response = score_client.post("/v1/score", json={"prompt": "The answer is", "continuation": " B", "top_logprobs": 1})
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        continuation_tokens = harmony_encoding.encode(" B", allowed_special="all")
+        assert data["prompt_tokens"] == len(harmony_encoding.encode("The answer is", allowed_special="all"))
+        assert [token["token"] for token in data["tokens"]] == continuation_tokens
+        assert data["total_logprob"] == pytest.approx(-0.5 * len(continuation_tokens))
+        assert data["tokens"][0]["top_logprobs"][0]["text"] == " B"
+
+    def test_score_token_ids(self, score_client):
+        response = score_client.post("/v1/score", json={"prompt": [1, 2, 3], "continuation": [4, 5]})
+        assert response.status_code == status.HTTP_200_OK
+        assert [token["top_logprobs"] for token in response.json()["tokens"]] == [[], []]
+
+    def test_empty_continuation(self, score_client):
+        response = score_client.post("/v1/score", json={"prompt": [1, 2, 3], "continuation": []})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_top_logprobs_out_of_range(self, score_client):
+        for top_logprobs in (-1, 21):
+            response = score_client.post(
+                "/v1/score", json={"prompt": [1, 2, 3], "continuation": [4], "top_logprobs": top_logprobs}
+            )
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_backend_without_scoring(self, api_client):
+        response = api_client.post("/v1/score", json={"prompt": "a", "continuation": "b"})
+        assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
+
+
+class TestInferenceWorker:
+
+    def test_calls_run_in_order_on_one_thread(self):
+        import threading
+        from gpt_oss.responses_api.worker import InferenceWorker
+
+        worker = InferenceWorker()
+        calls = []
+
+        def call(i):
+            calls.append((i, threading.current_thread().name))
+            return i * 2
+
+        async def run_all():
+            return await asyncio.gather(*(worker.run(call, i) for i in range(5)))
+
+        try:
+            assert asyncio.run(run_all()) == [0, 2, 4, 6, 8]
+            assert [i for i, _ in calls] == list(range(5))
+            assert len({name for _, name in calls}) == 1
+            assert calls[0][1] != threading.current_thread().name
+            assert worker.pending == 0
+        finally:
+            worker.close()
+
+    def test_exceptions_reach_the_caller(self):
+        from gpt_oss.responses_api.worker import InferenceWorker
+
+        worker = InferenceWorker()
+
+        def fail():
+            raise RuntimeError("out of memory")
+
+        try:
+            with pytest.raises(RuntimeError, match="out of memory"):
+                asyncio.run(worker.run(fail))
+        finally:
+            worker.close()
+
+    def test_health_while_generating(self, harmony_encoding, sample_request_data):
+        import threading
+        from fastapi.testclient import TestClient
+        from gpt_oss.responses_api.api_server import create_api_server
+
+        token_queue = harmony_encoding.encode("<|channel|>final<|message|>Hi<|return|>", allowed_special="all")
+        started, unblock = threading.Event(), threading.Event()
+
+        def blocking_infer(tokens, temperature=0.0, new_request=False):
+            started.set()
+            assert unblock.wait(timeout=10)
+            return token_queue.pop(0)
+
+        app = create_api_server(blocking_infer, harmony_encoding)
+        responses = []
+        with TestClient(app) as client:
+            thread = threading.Thread(
+                target=lambda: responses.append(client.post("/v1/responses", json=sample_request_data))
+            )
+            thread.start()
+            assert started.wait(timeout=10)
+            # The event loop is free while the backend is busy
+            health = client.get("/health")
+            assert health.status_code == status.HTTP_200_OK
+            assert health.json()["pending_inference_calls"] == 1
+            unblock.set()
+            thread.join(timeout=10)
+        assert responses[0].status_code == status.HTTP_200_OK
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from gpt_oss.responses_api.batching import BatchScheduler, FunctionBackend, SequentialBackend, as_batched_backend
+from gpt_oss.responses_api.inference.stub import StubBackend, fake_tokens
+from gpt_oss.responses_api.worker import InferenceWorker
+
+
+@pytest.fixture
+def worker():
+    worker = InferenceWorker()
+    yield worker
+    worker.close()
+
+
+def generate_all(scheduler: BatchScheduler, num_sequences: int, num_tokens: int) -> dict[str, list[int]]:
+    async def generate(sequence_id: str) -> list[int]:
+        tokens = [1, 2, 3]
+        for _ in range(num_tokens):
+            tokens.append(await scheduler.next_token(sequence_id, tokens))
+        scheduler.release(sequence_id)
+        return tokens[3:]
+
+    async def run():
+        outputs = await asyncio.gather(*(generate(f"seq_{i}") for i in range(num_sequences)))
+        return {f"seq_{i}": output for i, output in enumerate(outputs)}
+
+    return asyncio.run(run())
+
+
+def test_concurrent_sequences_share_steps(worker):
+    backend = StubBackend(step_time=0.01)
+    outputs = generate_all(BatchScheduler(backend, worker), num_sequences=8, num_tokens=5)
+    assert all(output == fake_tokens[:5] for output in outputs.values())
+    # All sequences are decoded in every step
+    assert backend.num_steps == 5
+    assert backend.batch_sizes == [8] * 5
+    worker.submit(lambda: None).result()
+    assert backend.positions == {}
+
+
+def test_batch_size_limit(worker):
+    backend = StubBackend(step_time=0.0, max_batch_size=3)
+    outputs = generate_all(BatchScheduler(backend, worker), num_sequences=7, num_tokens=4)
+    assert all(output == fake_tokens[:4] for output in outputs.values())
+    assert max(backend.batch_sizes) == 3
+    assert sum(backend.batch_sizes) == 7 * 4
+
+
+def test_sequences_wait_for_a_release(worker):
+    live, num_live = set(), []
+
+    def step(sequences):
+        live.update(sequences)
+        num_live.append(len(live))
+        return {sequence_id: len(sequence.tokens) for sequence_id, sequence in sequences.items()}
+
+    backend = FunctionBackend(step, live.discard, max_batch_size=4, max_num_sequences=2)
+    outputs = generate_all(BatchScheduler(backend, worker), num_sequences=5, num_tokens=3)
+    assert all(output == [3, 4, 5] for output in outputs.values())
+    # The other sequences start once one of the first two is done, rather than taking over its state
+    assert max(num_live) == 2
+
+
+def test_experts_per_token_reaches_the_backend(worker):
+    settings = []
+
+    def step(sequences):
+        settings.extend(sequence.experts_per_token for sequence in sequences.values())
+        return {sequence_id: 0 for sequence_id in sequences}
+
+    scheduler = BatchScheduler(FunctionBackend(step), worker)
+    asyncio.run(scheduler.next_token("fast", [1, 2], experts_per_token=[2, 1]))
+    asyncio.run(scheduler.next_token("full", [1, 2]))
+    assert settings == [[2, 1], None]
+
+
+def test_sequential_backend(worker):
+    calls, released = [], []
+
+    def infer_next_token(tokens, temperature=0.0, new_request=False):
+        calls.append(len(tokens))
+        return len(tokens)
+
+    infer_next_token.release = released.append
+    backend = as_batched_backend(infer_next_token)
+    assert isinstance(backend, SequentialBackend)
+    outputs = generate_all(BatchScheduler(backend, worker), num_sequences=2, num_tokens=3)
+    assert outputs == {"seq_0": [3, 4, 5], "seq_1": [3, 4, 5]}
+    # One sequence per step, taking turns
+    assert calls == [3, 3, 4, 4, 5, 5]
+    worker.submit(lambda: None).result()
+    assert released == [[1, 2, 3, 3, 4], [1, 2, 3, 3, 4]]
+
+
+def test_backend_errors_fail_the_step(worker):
+    class FailingBackend(StubBackend):
+        def step(self, sequences):
+            raise RuntimeError("CUDA error")
+
+    scheduler = BatchScheduler(FailingBackend(step_time=0.0), worker)
+
+    async def run():
+        with pytest.raises(RuntimeError, match="CUDA error"):
+            await scheduler.next_token("seq", [1, 2, 3])
+
+    asyncio.run(run())
+
+
+def test_backend_errors_fail_one_sequence(worker):
+    class PartialBackend(StubBackend):
+        def step(self, sequences):
+            next_tokens = super().step(sequences)
+            next_tokens["long"] = RuntimeError("does not fit")
+            return next_tokens
+
+    scheduler = BatchScheduler(PartialBackend(step_time=0.0), worker)
+
+    async def run():
+        results = await asyncio.gather(
+            scheduler.next_token("short", [1, 2, 3]), scheduler.next_token("long", [1, 2, 3]), return_exceptions=True
+        )
+        assert results[0] == fake_tokens[0]
+        assert isinstance(results[1], RuntimeError)
+
+    asyncio.run(run())
+
+
+def test_batched_attribute_is_used():
+    def infer_next_token(tokens, temperature=0.0, new_request=False):
+        return 0
+
+    infer_next_token.batched = StubBackend()
+    assert as_batched_backend(infer_next_token) is infer_next_token.batched